@@ -0,0 +1,128 @@
+"""
+Time trend_filter across sizes, norms, options, linear deviations and solvers
+
+    python benchmarks/bench_fit.py
+"""
+
+from trendfilter import trend_filter
+from common import make_data, get_deviations, measure
+
+# the cvxpy solvers to try, when installed
+SOLVERS = ['ECOS', 'CLARABEL', 'OSQP', 'SCS']
+
+# the largest n to run for each solver or engine, larger sizes are
+# recorded as skipped
+MAX_N = {'cvxpy': 10**4, 'admm': 10**4, 'qp': 10**5, 'banded': 10**6}
+
+OPTIONS = {'plain': {},
+           'monotonic': {'monotonic': True},
+           'positive': {'positive': True},
+           'constrain_zero': {'constrain_zero': True}}
+
+
+def fit_cases(solvers=None):
+    """
+    The cases to run. Every combination of l_norm, options and number of
+    linear deviations with the default solver and the other engines,
+    plus each installed solver on the plain problem.
+    :param solvers: list of cvxpy solver names, defaults to the installed SOLVERS
+    :return: list of trend_filter kwargs, with the case name and n_deviations
+    """
+    if solvers is None:
+        import cvxpy
+        solvers = [solver for solver in SOLVERS if solver in cvxpy.installed_solvers()]
+
+    cases = []
+    for l_norm in [1, 2]:
+        for option, option_kwargs in OPTIONS.items():
+            for n_deviations in [0, 1, 'many']:
+                engines = ['cvxpy', 'admm', 'qp']
+                if l_norm == 2 and option in ['plain', 'constrain_zero'] and \
+                        not (option == 'constrain_zero' and n_deviations):
+                    engines.append('banded')
+
+                for engine in engines:
+                    kwargs = dict(option_kwargs, l_norm=l_norm, alpha_2=1.0,
+                                  n_deviations=n_deviations, engine=engine)
+                    if engine == 'cvxpy':
+                        kwargs['solver'] = solvers[0]
+                    cases.append(kwargs)
+
+        for solver in solvers[1:]:
+            cases.append({'l_norm': l_norm, 'alpha_2': 1.0, 'n_deviations': 0,
+                          'engine': 'cvxpy', 'solver': solver})
+
+    for kwargs in cases:
+        kwargs['case'] = case_name(kwargs)
+
+    return cases
+
+
+def case_name(kwargs):
+    parts = [kwargs.get('solver', kwargs['engine']).lower(), 'l%s' % kwargs['l_norm']]
+    for option in ['monotonic', 'positive', 'constrain_zero']:
+        if kwargs.get(option):
+            parts.append(option)
+    parts.append('dev_%s' % kwargs['n_deviations'])
+    return '_'.join(parts)
+
+
+def objective_value(result):
+    objective = result['objective_total']
+    return float(getattr(objective, 'value', objective))
+
+
+def run_case(x, y, kwargs, repeat=1, memory=True):
+    """
+    Fit one case and measure it
+    :return: dict with seconds, peak_memory_mb, objective and status
+    """
+    kwargs = dict(kwargs)
+    kwargs.pop('case')
+    linear_deviations = get_deviations(kwargs.pop('n_deviations'))
+
+    try:
+        measured = measure(trend_filter, x, y, linear_deviations=linear_deviations,
+                           repeat=repeat, memory=memory, **kwargs)
+    except Exception as error:
+        return {'status': 'failed', 'error': '%s: %s' % (type(error).__name__, error)}
+
+    return {'status': 'ok',
+            'seconds': measured['seconds'],
+            'peak_memory_mb': measured['peak_memory_mb'],
+            'objective': objective_value(measured['value'])}
+
+
+def bench_fit(sizes=(10**2, 10**3, 10**4, 10**5, 10**6), cases=None, max_n=None,
+              repeat=1, memory=True):
+    if cases is None:
+        cases = fit_cases()
+
+    if max_n is None:
+        max_n = MAX_N
+
+    results = []
+    for n in sizes:
+        x, y = make_data(n)
+        for kwargs in cases:
+            record = {'suite': 'fit', 'case': kwargs['case'], 'n': n,
+                      'l_norm': kwargs['l_norm'], 'engine': kwargs['engine'],
+                      'solver': kwargs.get('solver'),
+                      'n_deviations': kwargs['n_deviations']}
+
+            if n > max_n[kwargs['engine']]:
+                record['status'] = 'skipped'
+            else:
+                record.update(run_case(x, y, kwargs, repeat=repeat, memory=memory))
+
+            results.append(record)
+
+    return results
+
+
+if __name__ == '__main__':
+    for result in bench_fit(sizes=(10**2, 10**3)):
+        if result['status'] == 'ok':
+            print('%(case)40s n=%(n)-8d %(seconds).4f s %(peak_memory_mb)8.1f MB' % result)
+        else:
+            print('%(case)40s n=%(n)-8d %(status)s' % result)
@@ -0,0 +1,55 @@
+"""
+Time importing trendfilter in a fresh interpreter and check which
+heavy dependencies get loaded
+
+    python benchmarks/bench_import.py
+"""
+
+import sys
+import json
+import subprocess
+
+HEAVY_MODULES = ['cvxpy', 'bokeh', 'scipy']
+
+STATEMENTS = {'import_trendfilter': 'import trendfilter',
+              'import_fitted': 'from trendfilter import FittedTrend',
+              'import_engines': 'from trendfilter.engines import trend_filter_engine',
+              'import_trend_filter': 'from trendfilter import trend_filter',
+              'import_compiled': 'from trendfilter.compiled import get_compiled_trend_filter'}
+
+SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def time_import(statement):
+    """
+    Run an import statement in a new interpreter
+    :param statement: python import statement
+    :return: dict with seconds and the list of heavy modules loaded
+    """
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT % (statement, HEAVY_MODULES)])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def bench_import(sizes=None, repeat=1, memory=False):
+    # sizes and memory are accepted so this runs like the other suites
+    results = []
+    for name, statement in STATEMENTS.items():
+        timings = [time_import(statement) for _ in range(repeat)]
+        results.append({'suite': 'imports', 'case': name, 'n': 0, 'status': 'ok',
+                        'seconds': min(timing['seconds'] for timing in timings),
+                        'peak_memory_mb': None,
+                        'loaded': timings[0]['loaded']})
+
+    return results
+
+
+if __name__ == '__main__':
+    for result in bench_import(repeat=3):
+        print('%(case)25s %(seconds).4f s loads %(loaded)s' % result)
@@ -0,0 +1,50 @@
+"""
+Time the construction of the derivative and deviation operators
+
+    python benchmarks/bench_operators.py
+"""
+
+import numpy as np
+from trendfilter.derivatives import second_derivative_matrix_nes, \
+    first_derivative_matrix_nes, first_derivative_matrix_circular, cumulative_matrix
+from trendfilter.linear_deviations import get_model_deviation_matrix
+from common import measure, month_mapping
+
+
+def uncached(func, *args, **kwargs):
+    """
+    Call a memoized function with its cache emptied first
+    """
+    func.cache.clear()
+    return func(*args, **kwargs)
+
+
+def bench_operators(sizes=(10**2, 10**4, 10**6), repeat=1, memory=True):
+    results = []
+    for n in sizes:
+        x = np.cumsum(np.random.RandomState(n % 1000).uniform(0.5, 1.5, n))
+        # memoize_on_array keys on the content of x, so the caches are
+        # cleared before each call or every timing after the first is a hit
+        cases = [('second_derivative_matrix_nes',
+                  lambda: uncached(second_derivative_matrix_nes, x, scale_free=True)),
+                 ('first_derivative_matrix_nes',
+                  lambda: uncached(first_derivative_matrix_nes, x)),
+                 ('first_derivative_matrix_circular',
+                  lambda: first_derivative_matrix_circular(n)),
+                 ('cumulative_matrix',
+                  lambda: cumulative_matrix(n)),
+                 ('get_model_deviation_matrix',
+                  lambda: get_model_deviation_matrix(x, month_mapping, 12))]
+
+        for name, func in cases:
+            measured = measure(func, repeat=repeat, memory=memory)
+            results.append({'suite': 'operators', 'case': name, 'n': n, 'status': 'ok',
+                            'seconds': measured['seconds'],
+                            'peak_memory_mb': measured['peak_memory_mb']})
+
+    return results
+
+
+if __name__ == '__main__':
+    for result in bench_operators():
+        print('%(case)35s n=%(n)-8d %(seconds).5f s %(peak_memory_mb)8.1f MB' % result)
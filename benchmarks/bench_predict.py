@@ -0,0 +1,34 @@
+"""
+Time the model functions of a fit result on new x
+
+    python benchmarks/bench_predict.py
+"""
+
+import numpy as np
+from trendfilter import trend_filter
+from common import make_data, get_deviations, measure
+
+
+def bench_predict(sizes=(10**2, 10**4, 10**6), repeat=1, memory=True):
+    results = []
+    for n in sizes:
+        x, y = make_data(n)
+        # the banded engine fits quickly at every size
+        for n_deviations in [0, 1]:
+            result = trend_filter(x, y, l_norm=2, alpha_2=1.0, engine='banded',
+                                  linear_deviations=get_deviations(n_deviations))
+            # interpolation inside and extrapolation past the end
+            x_new = np.linspace(x[0], x[-1] + 0.1 * (x[-1] - x[0]), n)
+            for function in ['function', 'function_base']:
+                measured = measure(result[function], x_new, repeat=repeat, memory=memory)
+                results.append({'suite': 'predict', 'case': '%s_dev_%s' % (function, n_deviations),
+                                'n': n, 'status': 'ok', 'n_deviations': n_deviations,
+                                'seconds': measured['seconds'],
+                                'peak_memory_mb': measured['peak_memory_mb']})
+
+    return results
+
+
+if __name__ == '__main__':
+    for result in bench_predict():
+        print('%(case)25s n=%(n)-8d %(seconds).5f s %(peak_memory_mb)8.1f MB' % result)
@@ -0,0 +1,127 @@
+"""
+Shared helpers for the benchmarks: data, timing and memory
+"""
+
+import sys
+import time
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+
+def make_data(n, seed=0):
+    """
+    Monthly-like data with a smooth trend, seasonality and a few outliers
+    :param n: number of points
+    :param seed: random seed
+    :return: x, y
+    """
+    rand = np.random.RandomState(seed)
+    x = np.arange(n, dtype=float)
+    scale = n / 10.0
+    y = 4.0 + np.sqrt(x / scale) - 0.1 * x / scale
+    y += 0.3 * np.sin(2 * np.pi * x / 12.0)
+    y += 0.3 * rand.randn(n)
+
+    outliers = rand.choice(n, size=max(n // 50, 1), replace=False)
+    y[outliers] += 5.0
+
+    return x, y
+
+
+def month_mapping(x):
+    return np.asarray(x).astype(int) % 12
+
+
+def weekday_mapping(x):
+    return np.asarray(x).astype(int) % 7
+
+
+def quarter_mapping(x):
+    return (np.asarray(x).astype(int) // 3) % 4
+
+
+def year_mapping(x):
+    return (np.asarray(x).astype(int) // 12) % 10
+
+
+def hour_mapping(x):
+    return np.asarray(x).astype(int) % 24
+
+
+DEVIATIONS = [{'name': 'month', 'mapping': month_mapping, 'n_vars': 12, 'alpha': 0.1},
+              {'name': 'weekday', 'mapping': weekday_mapping, 'n_vars': 7, 'alpha': 0.1},
+              {'name': 'quarter', 'mapping': quarter_mapping, 'n_vars': 4, 'alpha': 0.1},
+              {'name': 'year', 'mapping': year_mapping, 'n_vars': 10, 'alpha': 0.1},
+              {'name': 'hour', 'mapping': hour_mapping, 'n_vars': 24, 'alpha': 0.1}]
+
+
+def get_deviations(n_deviations):
+    """
+    :param n_deviations: 0, 1 or 'many'
+    :return: list of linear deviations
+    """
+    if n_deviations == 'many':
+        return list(DEVIATIONS)
+
+    return DEVIATIONS[:n_deviations]
+
+
+def measure(func, *args, repeat=1, memory=True, **kwargs):
+    """
+    Time a function call and measure its peak Python memory.
+    Memory is measured in a separate call as tracemalloc slows things down.
+    It counts numpy allocations but not the solvers' own C allocations.
+    :param func: function to call
+    :param repeat: number of timed calls, the fastest is reported
+    :param memory: If True, also measure the peak memory
+    :return: dict with seconds, peak_memory_mb and the last return value
+    """
+    times = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    measured = {'seconds': min(times), 'peak_memory_mb': None, 'value': value}
+
+    if memory:
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            measured['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+
+    return measured
+
+
+def environment():
+    """
+    What the results depend on, to store with them
+    :return: dict
+    """
+    import scipy
+    info = {'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'git_commit': None}
+
+    try:
+        import cvxpy
+        info['cvxpy'] = cvxpy.__version__
+        info['solvers'] = cvxpy.installed_solvers()
+    except ImportError:
+        info['cvxpy'] = None
+
+    try:
+        info['git_commit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                                     stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    return info
@@ -0,0 +1,131 @@
+"""
+Run the benchmark suites and save the results as JSON
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --suite fit predict
+    python benchmarks/run.py --compare baseline.json results.json
+
+Each result has the suite, case, n, status and, when it ran, the
+seconds (fastest of --repeat calls) and the peak Python memory in MB.
+--compare reports the cases that got slower than the threshold and
+exits with 1 if there are any, so it can be used in CI.
+"""
+
+import sys
+import json
+import argparse
+from common import environment
+from bench_operators import bench_operators
+from bench_fit import bench_fit
+from bench_predict import bench_predict
+from bench_import import bench_import
+
+SUITES = {'operators': bench_operators,
+          'fit': bench_fit,
+          'predict': bench_predict,
+          'imports': bench_import}
+
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+QUICK_SIZES = [10**2, 10**3]
+
+
+def run(suites=None, sizes=None, repeat=1, memory=True):
+    """
+    Run the benchmark suites
+    :param suites: list of suite names, defaults to all SUITES
+    :param sizes: list of n, defaults to SIZES
+    :param repeat: number of timed calls per case, the fastest is reported
+    :param memory: If True, also measure the peak memory
+    :return: dict with the environment, sizes and list of results
+    """
+    if suites is None:
+        suites = list(SUITES)
+
+    if sizes is None:
+        sizes = SIZES
+
+    results = []
+    for suite in suites:
+        results.extend(SUITES[suite](sizes=sizes, repeat=repeat, memory=memory))
+
+    return {'environment': environment(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'results': results}
+
+
+def compare(baseline, current, threshold=1.25, min_seconds=1e-3):
+    """
+    Find the cases that got slower
+    :param baseline: results from run
+    :param current: results from run
+    :param threshold: ratio of seconds counted as a regression
+    :param min_seconds: cases faster than this in both are ignored as noise
+    :return: list of dicts with suite, case, n, baseline, current and ratio
+    """
+    def by_key(results):
+        return {(r['suite'], r['case'], r['n']): r for r in results['results']
+                if r['status'] == 'ok'}
+
+    baseline = by_key(baseline)
+    current = by_key(current)
+
+    regressions = []
+    for key in sorted(set(baseline) & set(current)):
+        before = baseline[key]['seconds']
+        after = current[key]['seconds']
+        if max(before, after) < min_seconds:
+            continue
+
+        ratio = after / before
+        if ratio > threshold:
+            suite, case, n = key
+            regressions.append({'suite': suite, 'case': case, 'n': n,
+                                'baseline': before, 'current': after, 'ratio': ratio})
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the trendfilter benchmarks')
+    parser.add_argument('--suite', nargs='+', choices=sorted(SUITES), default=None)
+    parser.add_argument('--sizes', nargs='+', type=int, default=None)
+    parser.add_argument('--quick', action='store_true', help='only the small sizes')
+    parser.add_argument('--repeat', type=int, default=1, help='timed calls per case')
+    parser.add_argument('--no-memory', action='store_true', help='skip the memory measurement')
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), default=None)
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as fp:
+            baseline = json.load(fp)
+        with open(args.compare[1]) as fp:
+            current = json.load(fp)
+
+        regressions = compare(baseline, current, threshold=args.threshold)
+        for reg in regressions:
+            print('%(suite)s %(case)s n=%(n)d %(baseline).4f s -> %(current).4f s (x%(ratio).2f)' % reg)
+
+        return 1 if regressions else 0
+
+    sizes = args.sizes
+    if args.quick:
+        sizes = QUICK_SIZES
+
+    results = run(suites=args.suite, sizes=sizes, repeat=args.repeat,
+                  memory=not args.no_memory)
+
+    text = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text)
+    else:
+        print(text)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+from trendfilter import trend_filter
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-4
+
+
+def test_admm_matches_cvxpy():
+    x, y_noisy = get_example_data()
+    options = [{'l_norm': 1, 'alpha_2': 0.2},
+               {'l_norm': 1, 'alpha_2': 0.2, 'monotonic': True},
+               {'l_norm': 1, 'alpha_1': 1.0, 'constrain_zero': True},
+               {'l_norm': 1, 'alpha_2': 0.2, 'positive': True},
+               {'l_norm': 2, 'alpha_2': 2.0}]
+
+    for kwargs in options:
+        expected = trend_filter(x, y_noisy, **kwargs)['objective_total'].value
+        result = trend_filter(x, y_noisy, engine='admm', **kwargs)
+        obj = result['objective_total']
+        print('objective', obj, expected, kwargs)
+        assert result['solver_info']['converged']
+        assert abs(obj - expected) < tolerance * expected
+
+
+def test_admm_with_seasonality_and_warm_start():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    result = trend_filter(x, y_noisy, l_norm=1, alpha_2=4.0,
+                          linear_deviations=[linear_deviation], engine='admm')
+    obj = result['objective_total']
+    assert abs(obj - 28.308657555529226) < tolerance * obj
+
+    state = result['solver_info']['state']
+    warm = trend_filter(x, y_noisy, l_norm=1, alpha_2=4.0,
+                        linear_deviations=[linear_deviation], engine='admm',
+                        engine_options={'warm_start': state})
+
+    assert warm['solver_info']['iterations'] < result['solver_info']['iterations']
+    assert abs(warm['objective_total'] - obj) < tolerance * obj
@@ -0,0 +1,48 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.banded import get_penalty_bands, banded_matvec
+from trendfilter.derivatives import second_derivative_matrix_nes
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-8
+
+
+def test_banded_matches_cvxpy():
+    x, y_noisy = get_example_data()
+    options = [{'alpha_2': 2.0},
+               {'alpha_1': 1.0},
+               {'alpha_1': 0.3, 'alpha_2': 2.0, 'constrain_zero': True}]
+
+    for kwargs in options:
+        expected = trend_filter(x, y_noisy, l_norm=2, **kwargs)['objective_total'].value
+        result = trend_filter(x, y_noisy, l_norm=2, engine='banded', **kwargs)
+        obj = result['objective_total']
+        print('objective', obj, expected, kwargs)
+        assert result['solver_info']['converged']
+        assert abs(obj - expected) < tolerance * expected
+
+
+def test_banded_with_seasonality():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    kwargs = {'l_norm': 2, 'alpha_2': 4.0, 'linear_deviations': [linear_deviation]}
+    expected = trend_filter(x, y_noisy, **kwargs)
+    result = trend_filter(x, y_noisy, engine='banded', **kwargs)
+
+    assert abs(result['objective_total'] - expected['objective_total'].value) < 1e-6
+    assert np.abs(result['y_fit'] - expected['y_fit']).max() < 1e-4
+
+
+def test_penalty_bands():
+    x = np.sort(np.random.RandomState(3).uniform(0, 10, 50))
+    d2 = second_derivative_matrix_nes(x, scale_free=True)
+    vector = np.random.RandomState(4).randn(50)
+
+    d1_bands, d2_bands = get_penalty_bands(x)
+    assert np.allclose(banded_matvec(d2_bands, vector), d2.T @ (d2 @ vector))
+    assert get_penalty_bands(x) is get_penalty_bands(x.copy())
@@ -0,0 +1,44 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.batch import trend_filter_batch
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-6
+
+
+def test_batch_matches_single():
+    x, y_noisy = get_example_data()
+    ys = np.vstack([y_noisy, 2 * y_noisy, y_noisy + 1])
+    results = trend_filter_batch(x, ys, l_norm=1, alpha_2=0.2)
+
+    assert [r['index'] for r in results] == [0, 1, 2]
+    for y, result in zip(ys, results):
+        assert result['status'] == 'ok'
+        expected = trend_filter(x, y, l_norm=1, alpha_2=0.2)
+        obj = expected['objective_total'].value
+        assert abs(result['objective'] - obj) < tolerance
+        assert np.abs(result['y_fit'] - expected['y_fit']).max() < 1e-4
+
+
+def test_batch_ragged_with_bad_series_in_pool():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    # missing points are left out of the fit, but there has to be something to fit
+    bad_y = np.full(50, np.nan)
+    xs = [x, x[:60], x[:50], x]
+    ys = [y_noisy, y_noisy[:60], bad_y, y_noisy]
+
+    results = trend_filter_batch(xs, ys, l_norm=1, alpha_2=4.0,
+                                 linear_deviations=[linear_deviation],
+                                 n_jobs=2, chunk_size=1)
+
+    assert [r['status'] for r in results] == ['ok', 'ok', 'error', 'ok']
+    assert results[2]['error']
+    assert abs(results[0]['objective'] - 28.308657555529226) < tolerance
+    assert results[1]['y_fit'].shape == (60,)
+    assert results[3]['deviations']['seasonal_term'].shape == (12,)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from trendfilter.bootstrap import trend_filter_bootstrap, iter_bootstrap, resample_residuals
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+
+def test_resample_blocks():
+    residuals = np.arange(20.0)
+    sample = resample_residuals(residuals, np.random.default_rng(0), method='block', block_size=5)
+    assert len(sample) == 20
+    assert np.all(np.diff(sample.reshape(4, 5), axis=1) == 1)
+
+
+def test_bootstrap_bands():
+    x, y_noisy = get_example_data()
+    x_new = np.array([10.5, 12.0, 15.0])
+    boot = trend_filter_bootstrap(x, y_noisy, x_new=x_new, alpha_2=1.0, n_replicates=40)
+
+    assert boot['n_replicates'] == 40
+    assert boot['bands'].shape == (3, len(x))
+    assert boot['bands_new'].shape == (3, 3)
+    assert np.all(np.diff(boot['bands'], axis=0) >= 0)
+
+    # the bands widen further into the extrapolation
+    width = boot['bands_new'][2] - boot['bands_new'][0]
+    assert np.all(np.diff(width) > 0)
+
+    # replicates are seeded by their number, so the workers don't matter
+    parallel = trend_filter_bootstrap(x, y_noisy, x_new=x_new, alpha_2=1.0,
+                                      n_replicates=40, n_jobs=2, batch_size=7)
+    assert np.allclose(parallel['bands'], boot['bands'])
+    assert np.allclose(parallel['bands_new'], boot['bands_new'])
+
+
+def test_bootstrap_stops_early():
+    x, y_noisy = get_example_data()
+    boot = trend_filter_bootstrap(x, y_noisy, alpha_2=1.0, n_replicates=100, batch_size=10,
+                                  callback=lambda update: update['n_replicates'] >= 30)
+    assert boot['n_replicates'] == 30
+
+    # the batches are added in order, so the same replicates are kept in parallel
+    parallel = trend_filter_bootstrap(x, y_noisy, alpha_2=1.0, n_replicates=100, batch_size=10,
+                                      n_jobs=3, callback=lambda update: update['n_replicates'] >= 30)
+    assert np.allclose(parallel['replicates'], boot['replicates'])
+
+    counts = [update['n_replicates'] for update
+              in iter_bootstrap(x, y_noisy, alpha_2=1.0, n_replicates=25, batch_size=10)]
+    assert counts == [10, 20, 25]
+
+
+def test_bootstrap_with_seasonality():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    x_new = np.array([x.max() + 0.5])
+    boot = trend_filter_bootstrap(x, y_noisy, x_new=x_new, alpha_2=1.0, l_norm=1,
+                                  method='block', linear_deviations=[linear_deviation],
+                                  n_replicates=20)
+    point = boot['point']['function'](x_new)
+    assert boot['bands_new'][0, 0] < point[0] < boot['bands_new'][2, 0]
+
+    linear_deviation = dict(linear_deviation, matrix=boot['point']['linear_deviations'][0]['matrix'])
+    del linear_deviation['mapping']
+    with pytest.raises(ValueError):
+        trend_filter_bootstrap(x, y_noisy, x_new=x_new, alpha_2=1.0,
+                               linear_deviations=[linear_deviation], n_replicates=5)
+
+
+def test_bootstrap_missing():
+    x, y_noisy = get_example_data()
+    y_gappy = y_noisy.copy()
+    y_gappy[20:30] = np.nan
+    boot = trend_filter_bootstrap(x, y_gappy, alpha_2=1.0, n_replicates=20, noise=True)
+    assert np.isfinite(boot['bands']).all()
+    # the model fills the gap in each replicate
+    assert np.isfinite(boot['replicates'][:, 20:30]).all()
@@ -0,0 +1,101 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.chunked import get_windows, blend_weights, trend_filter_chunked, median_abs, \
+    share_array, read_array
+from trendfilter.get_example_data import deviation_mapping
+
+
+def get_long_data(n=6000):
+    rand = np.random.RandomState(11)
+    x = np.cumsum(rand.uniform(0.5, 1.5, n))
+    y = np.sqrt(x) + 0.3 * np.sin(2 * np.pi * x / 12.0) + 0.3 * rand.randn(n)
+    return x, y
+
+
+def test_windows():
+    windows = get_windows(1050, 300, 50)
+    assert windows[0] == (0, 350, 0, 300)
+    assert windows[-1] == (850, 1050, 900, 1050)
+
+    # a short last chunk is merged into the one before
+    assert get_windows(940, 300, 50)[-1] == (550, 940, 600, 940)
+
+    # the blend weights add up to one everywhere
+    total = np.zeros(1050)
+    for window in windows:
+        total[window[0]:window[1]] += blend_weights(window, 1050, 50)
+    assert np.allclose(total, 1.0)
+
+
+def test_chunked_matches_monolithic(tmp_path):
+    x, y = get_long_data()
+    direct = trend_filter(x, y, l_norm=2, alpha_2=10.0, engine='banded')
+
+    np.save(tmp_path / 'x.npy', x)
+    np.save(tmp_path / 'y.npy', y)
+    result = trend_filter_chunked(str(tmp_path / 'x.npy'), str(tmp_path / 'y.npy'),
+                                  l_norm=2, alpha_2=10.0, chunk_size=1000, overlap=100,
+                                  out=str(tmp_path / 'out'))
+    assert len(result['windows']) == 6
+    assert len(result['seams']) == 5
+    error = np.abs(result['y_fit'] - direct['y_fit']).max()
+    assert error < 1e-6
+    assert max(seam['max_difference'] for seam in result['seams']) < 1e-6
+
+    saved = np.load(tmp_path / 'out' / 'y_fit.npy')
+    assert np.allclose(saved, result['y_fit'])
+
+
+def test_chunked_deviations_parallel():
+    x, y = get_long_data(3000)
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    direct = trend_filter(x, y, l_norm=2, alpha_2=10.0, engine='banded',
+                          linear_deviations=[linear_deviation])
+    result = trend_filter_chunked(x, y, l_norm=2, alpha_2=10.0, chunk_size=1000,
+                                  overlap=200, linear_deviations=[linear_deviation],
+                                  n_jobs=2)
+    values = direct['linear_deviations'][0]['values']
+    assert np.abs(result['deviations']['seasonal_term'] - values).max() < 1e-3
+    assert np.abs(result['y_fit'] - direct['y_fit']).max() < 1e-3
+
+
+def test_median_abs():
+    rand = np.random.RandomState(2)
+    y = np.concatenate([rand.standard_cauchy(5001), np.full(500, np.nan), np.full(3000, 2.5)])
+    for size in [len(y), len(y) - 1]:
+        assert median_abs(y[:size], chunk_size=100, n_bins=16) == np.nanmedian(np.abs(y[:size]))
+
+
+def test_chunked_reports_deviations_used():
+    x, y = get_long_data(3000)
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    result = trend_filter_chunked(x, y, l_norm=2, alpha_2=10.0, chunk_size=1000,
+                                  overlap=200, linear_deviations=[linear_deviation],
+                                  consensus_rounds=0)
+    values = result['deviations']['seasonal_term']
+    seasonal = values[deviation_mapping(x)]
+    assert np.allclose(result['y_fit'], result['base_model'] + seasonal)
+
+
+def test_share_array(tmp_path):
+    x, y = get_long_data(3000)
+    np.save(tmp_path / 'y.npy', y)
+    mapped = np.load(tmp_path / 'y.npy', mmap_mode='r')
+    for array in [str(tmp_path / 'y.npy'), mapped]:
+        shared = share_array(array, 1000, 2000)
+        # only the file is described, the data isn't sent
+        assert 'array' not in shared
+        assert np.array_equal(read_array(shared), y[1000:2000])
+
+    shared = share_array(mapped[500:], 1000, 2000)
+    assert np.array_equal(read_array(shared), y[1500:2500])
+
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    options = {'l_norm': 2, 'alpha_2': 10.0, 'chunk_size': 1000, 'overlap': 200,
+               'linear_deviations': [linear_deviation]}
+    serial = trend_filter_chunked(x, y, **options)
+    parallel = trend_filter_chunked(x, str(tmp_path / 'y.npy'), n_jobs=2, **options)
+    assert np.allclose(parallel['y_fit'], serial['y_fit'])
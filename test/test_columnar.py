@@ -0,0 +1,119 @@
+import json
+import numpy as np
+import pytest
+from trendfilter.columnar import get_index, iter_columnar, trend_filter_columnar
+from trendfilter.engines import trend_filter_engine
+from trendfilter.get_example_data import deviation_mapping
+
+
+def save_columns(path, lengths=(60, 45, 80, 30, 70, 55, 40)):
+    rand = np.random.RandomState(3)
+    xs = [np.sort(rand.uniform(0, 30, n)) for n in lengths]
+    ys = [np.sqrt(x) + 0.3 * np.sin(2 * np.pi * x / 12.0) + 0.2 * rand.randn(len(x))
+          for x in xs]
+    offsets = np.cumsum([0] + list(lengths))
+    np.save(path / 'x.npy', np.concatenate(xs))
+    np.save(path / 'y.npy', np.concatenate(ys))
+    np.save(path / 'offsets.npy', offsets)
+    return xs, ys, offsets
+
+
+def test_get_index():
+    offsets, lengths = get_index([0, 3, 7], n_points=7)
+    assert offsets.tolist() == [0, 3] and lengths.tolist() == [3, 4]
+    offsets, lengths = get_index([0, 3], n_points=7)
+    assert lengths.tolist() == [3, 4]
+    offsets, lengths = get_index([5, 0], lengths=[2, 5], n_points=7)
+    assert offsets.tolist() == [5, 0]
+    with pytest.raises(AssertionError):
+        get_index([0, 3], lengths=[3, 5], n_points=7)
+
+
+def test_columnar_matches_engine(tmp_path):
+    xs, ys, offsets = save_columns(tmp_path)
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    result = trend_filter_columnar(str(tmp_path / 'x.npy'), str(tmp_path / 'y.npy'),
+                                   offsets=str(tmp_path / 'offsets.npy'),
+                                   out=str(tmp_path / 'out'), alpha_2=1.0,
+                                   linear_deviations=[linear_deviation], chunk_size=3)
+    assert result['n_fit'] == result['n_series'] == len(xs)
+    assert result['counts']['ok'] == len(xs)
+
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        expected = trend_filter_engine(x, y, alpha_2=1.0, engine='banded',
+                                       linear_deviations=[linear_deviation])
+        series = slice(offsets[i], offsets[i + 1])
+        assert np.allclose(result['y_fit'][series], expected['y_fit'])
+        assert np.allclose(result['base_model'][series], expected['base_model'])
+        assert np.allclose(result['deviations']['seasonal_term'][i],
+                           expected['linear_deviations'][0]['values'])
+        assert abs(result['objective'][i] - expected['objective_total']) < 1e-8
+
+
+def test_columnar_resumes(tmp_path):
+    save_columns(tmp_path)
+    columns = {'x': str(tmp_path / 'x.npy'), 'y': str(tmp_path / 'y.npy'),
+               'offsets': str(tmp_path / 'offsets.npy')}
+    expected = trend_filter_columnar(out=str(tmp_path / 'expected'), alpha_2=1.0,
+                                     **columns)
+
+    # stop after the second chunk, each chunk is written before it's yielded
+    out = str(tmp_path / 'out')
+    for summary in iter_columnar(out=out, alpha_2=1.0, chunk_size=2, **columns):
+        if summary['index'] == 2:
+            break
+
+    with open(tmp_path / 'out' / 'progress.json') as progress_file:
+        assert json.load(progress_file)['n_done'] == 4
+
+    with pytest.raises(ValueError):
+        trend_filter_columnar(out=out, alpha_2=2.0, **columns)
+    with pytest.raises(ValueError):
+        trend_filter_columnar(out=out, alpha_2=1.0, engine_options={'max_iter': 10}, **columns)
+
+    # other data of the same length
+    np.save(tmp_path / 'y_2.npy', np.load(tmp_path / 'y.npy') + 1.0)
+    with pytest.raises(ValueError):
+        trend_filter_columnar(out=out, alpha_2=1.0, **dict(columns, y=str(tmp_path / 'y_2.npy')))
+
+    result = trend_filter_columnar(out=out, alpha_2=1.0, chunk_size=2, n_jobs=2, **columns)
+    assert result['n_fit'] == 3
+    assert result['n_done'] == 7
+    assert np.allclose(result['y_fit'], expected['y_fit'])
+    assert np.allclose(result['objective'], expected['objective'])
+
+
+def test_columnar_errors(tmp_path):
+    y = np.concatenate([np.random.RandomState(0).randn(20), np.full(10, np.nan)])
+    lengths = [20, 10]
+    result = trend_filter_columnar(None, y, offsets=[0, 20], lengths=lengths,
+                                   out=str(tmp_path), alpha_2=1.0, l_norm=1)
+    assert result['status'].tolist() == [1, 3]
+    assert np.isfinite(result['y_fit'][:20]).all()
+    assert np.isnan(result['y_fit'][20:]).all()
+
+
+def test_columnar_parallel_parts(tmp_path):
+    xs, ys, offsets = save_columns(tmp_path)
+    x, y = np.load(tmp_path / 'x.npy'), np.load(tmp_path / 'y.npy', mmap_mode='r')
+    # the series out of order, so the chunks span more than their series
+    order = [3, 0, 6, 2, 5, 1, 4]
+    lengths = np.diff(offsets)[order]
+    linear_deviation = {'indices': deviation_mapping(np.arange(len(x))), 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    options = {'offsets': offsets[order], 'lengths': lengths, 'alpha_2': 1.0,
+               'linear_deviations': [linear_deviation], 'chunk_size': 2}
+    serial = trend_filter_columnar(x, y, out=str(tmp_path / 'serial'), **options)
+    parallel = trend_filter_columnar(x, y, out=str(tmp_path / 'parallel'), n_jobs=2, **options)
+    assert serial['counts']['ok'] == 7
+    assert np.allclose(parallel['y_fit'], serial['y_fit'])
+    assert np.allclose(parallel['deviations']['seasonal_term'],
+                       serial['deviations']['seasonal_term'])
+
+    for i, index in enumerate(order):
+        series = slice(offsets[index], offsets[index + 1])
+        lin_dev = dict(linear_deviation, indices=linear_deviation['indices'][series])
+        expected = trend_filter_engine(xs[index], ys[index], alpha_2=1.0, engine='banded',
+                                       linear_deviations=[lin_dev])
+        assert abs(serial['objective'][i] - expected['objective_total']) < 1e-8
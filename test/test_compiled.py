@@ -0,0 +1,57 @@
+from trendfilter import trend_filter
+from trendfilter.compiled import ProblemCache, get_compiled_trend_filter
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-6
+
+
+def test_compiled_matches_trend_filter():
+    x, y_noisy = get_example_data()
+    cache = ProblemCache()
+    compiled = get_compiled_trend_filter(x, l_norm=1, monotonic=True, cache=cache)
+
+    for alpha_2 in [0.2, 2.0]:
+        result = compiled.solve(y_noisy, alpha_2=alpha_2)
+        obj = result['objective_total'].value
+        expected = trend_filter(x, y_noisy, l_norm=1, alpha_2=alpha_2,
+                                monotonic=True)['objective_total'].value
+        print('objective', obj, expected)
+        assert abs(obj - expected) < tolerance
+
+    assert compiled.n_solves == 2
+
+
+def test_cache_hits_with_linear_deviations():
+    x, y_noisy = get_example_data_seasonal()
+    cache = ProblemCache(maxsize=2)
+
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    compiled = cache.get(x, l_norm=1, linear_deviations=[linear_deviation])
+    result = compiled.solve(y_noisy, alpha_2=4.0, linear_deviations=[linear_deviation])
+    obj = result['objective_total'].value
+    assert abs(obj - 28.308657555529226) < tolerance
+
+    # different alpha is only a parameter change
+    linear_deviation['alpha'] = 0.2
+    same = cache.get(x, l_norm=1, linear_deviations=[linear_deviation])
+    assert same is compiled
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+    # different options are a new problem and the cache stays bounded
+    cache.get(x, l_norm=2)
+    cache.get(x, l_norm=1)
+    assert cache.misses == 3
+    assert len(cache) == 2
+
+
+def test_use_cache_keyword():
+    x, y_noisy = get_example_data()
+    result = trend_filter(x, y_noisy, l_norm=2, alpha_2=2.0, use_cache=True)
+    obj = result['objective_total'].value
+    assert abs(obj - 11.971096302251315) < tolerance
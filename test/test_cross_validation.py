@@ -0,0 +1,47 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.cross_validation import trend_filter_cv, alpha_path, get_folds
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-6
+
+
+def test_alpha_path_matches_trend_filter():
+    x, y_noisy = get_example_data()
+    fits = alpha_path(x, y_noisy, {'alpha_2': [2.0, 0.2]}, l_norm=1)
+    assert [fit['alphas']['alpha_2'] for fit in fits] == [2.0, 0.2]
+    assert abs(fits[0]['objective'] - 13.167173504429053) < tolerance
+    assert abs(fits[1]['objective'] - 12.044960558386068) < tolerance
+
+
+def test_folds():
+    for train, test in get_folds(10, n_folds=3):
+        assert not (train & test).any()
+        assert (train | test).all()
+
+    folds = get_folds(12, n_folds=3, method='forward')
+    assert [test.sum() for train, test in folds] == [3, 3, 3]
+    for train, test in folds:
+        assert np.argmax(test) == train.sum()
+
+
+def test_cv_with_seasonality():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    param_grid = {'alpha_2': [10.0, 4.0, 1.0], 'seasonal_term': [1.0, 0.1]}
+    cv = trend_filter_cv(x, y_noisy, param_grid, l_norm=1, n_folds=4,
+                         linear_deviations=[linear_deviation], n_jobs=2)
+
+    assert cv['scores'].shape == (6, 4)
+    assert cv['score_surface'].shape == (3, 2)
+    assert cv['best_alphas'] == cv['grid'][int(np.argmin(cv['mean_scores']))]
+
+    expected = trend_filter(x, y_noisy, l_norm=1, alpha_2=cv['best_alphas']['alpha_2'],
+                            linear_deviations=[dict(linear_deviation,
+                                                    alpha=cv['best_alphas']['seasonal_term'])])
+    assert abs(cv['result']['objective_total'].value - expected['objective_total'].value) < tolerance
@@ -0,0 +1,58 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.decimate import lttb, minmax, decimate
+from trendfilter.plot_model import plot_model
+
+
+def get_long_data(n=100000):
+    rand = np.random.RandomState(0)
+    x = np.arange(n, dtype=float)
+    y = np.sin(x / 5000.0) + 0.1 * rand.randn(n)
+    y[n // 3] = 5.0
+    return x, y
+
+
+def test_lttb():
+    x, y = get_long_data()
+    index = lttb(x, y, 1000)
+    assert len(index) == 1000
+    assert index[0] == 0 and index[-1] == len(x) - 1
+    assert np.all(np.diff(index) > 0)
+    # a spike makes the largest triangle in its bucket
+    assert len(x) // 3 in index
+    assert np.array_equal(lttb(x[:10], y[:10], 1000), np.arange(10))
+
+
+def test_minmax():
+    x, y = get_long_data()
+    index = minmax(x, y, 1000)
+    assert len(index) <= 1000
+    assert np.all(np.diff(index) > 0)
+    assert len(x) // 3 in index
+    assert np.argmin(y) in index
+
+
+def test_decimate_missing():
+    x, y = get_long_data(100)
+    y[[3, 50]] = np.nan
+    x_new, y_new = decimate(x, y, 1000, method=None)
+    assert len(x_new) == 98 and np.isfinite(y_new).all()
+    x_new, y_new = decimate(x, y, 20, method='minmax')
+    assert np.isfinite(y_new).all()
+
+
+def test_plot_many_points():
+    x, y = get_long_data()
+    result = trend_filter(x, y, alpha_2=1000.0, engine='banded')
+    plot = plot_model(result, show_plot=False, show_extrap=True, show_base=True,
+                      extrap_max=1000)
+    assert plot.output_backend == 'webgl'
+    for renderer in plot.renderers:
+        assert len(renderer.data_source.data['x']) <= 1800
+
+    small = trend_filter(x[:100], y[:100], alpha_2=1.0, engine='banded')
+    layout = plot_model([result, small], title=['long', 'short'], show_plot=False,
+                        max_points=500, decimation='minmax', webgl=False)
+    assert len(layout.children) == 2
+    assert layout.children[1].output_backend == 'canvas'
+    assert len(layout.children[1].renderers[0].data_source.data['x']) == 100
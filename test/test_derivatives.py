@@ -0,0 +1,74 @@
+import numpy as np
+from trendfilter.derivatives import second_derivative_matrix_nes, first_derivative_matrix_nes, \
+    first_derivative_matrix_circular, cumulative_matrix, first_derv_nes
+from trendfilter.linear_deviations import get_model_deviation_matrix
+from trendfilter.get_example_data import deviation_mapping
+
+
+def second_derivative_loop(x, a_min=0.0, a_max=None, scale_free=False):
+    # straightforward per point version to check against
+    n = len(x)
+    matrix = np.zeros((n - 2, n))
+    for i in range(1, n - 1):
+        a0 = float(x[i + 1] - x[i])
+        a2 = float(x[i] - x[i - 1])
+        if a_max is not None:
+            a0 = min(a0, a_max)
+            a2 = min(a2, a_max)
+        a0 = max(a0, a_min)
+        a2 = max(a2, a_min)
+        a1 = a0 + a2
+        scf = a1 / 2.0 if scale_free else 1.0
+        matrix[i - 1, i - 1:i + 2] = [2.0 * scf / (a1 * a2), -2.0 * scf / (a0 * a2),
+                                      2.0 * scf / (a0 * a1)]
+    return matrix
+
+
+def test_second_derivative_matrix_nes():
+    x = np.cumsum(np.random.RandomState(1).uniform(0.1, 2.0, 30))
+    for kwargs in [{}, {'scale_free': True}, {'a_min': 0.5, 'a_max': 1.5}]:
+        expected = second_derivative_matrix_nes(x, **kwargs).toarray()
+        assert np.array_equal(expected, second_derivative_loop(x, **kwargs))
+
+    # integer x
+    x = np.arange(10)
+    assert np.array_equal(second_derivative_matrix_nes(x).toarray(), second_derivative_loop(x))
+
+
+def test_first_derivative_operators():
+    x = np.cumsum(np.random.RandomState(2).uniform(0.1, 2.0, 20))
+    y = np.random.RandomState(3).randn(20)
+    assert np.allclose(first_derivative_matrix_nes(x) @ y, first_derv_nes(x, y))
+
+    n = 6
+    circular = np.eye(n) - np.roll(np.eye(n), 1, axis=0)
+    assert np.array_equal(first_derivative_matrix_circular(n).toarray(), circular)
+    assert np.allclose(cumulative_matrix(n) @ y[:n], np.tril(np.ones((n, n))) @ y[:n])
+
+
+def test_deviation_matrix_array_and_scalar_mappings():
+    x = np.arange(30)
+    scalar = get_model_deviation_matrix(x, deviation_mapping, 12)
+    array = get_model_deviation_matrix(x, lambda xx: xx % 12, 12)
+    assert np.array_equal(scalar.toarray(), array.toarray())
+    assert scalar.toarray().sum() == 30
+    assert scalar[13, 1] == 1.0
+
+    # an array-aware mapping is only called once
+    calls = []
+
+    def counted(xx):
+        calls.append(xx)
+        return xx % 12
+
+    get_model_deviation_matrix(x, counted, 12)
+    assert len(calls) == 1
+
+    # a scalar mapping that raises IndexError on an array is called per point
+    def scalar_only(xx):
+        if np.ndim(xx):
+            raise IndexError('scalars only')
+        return int(xx) % 12
+
+    by_scalar = get_model_deviation_matrix(x, scalar_only, 12)
+    assert np.array_equal(by_scalar.toarray(), array.toarray())
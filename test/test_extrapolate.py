@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+from trendfilter import trend_filter
+from trendfilter.extrapolate import get_interp_extrapolate_functions
+from trendfilter.linear_deviations import get_model_deviation_matrix
+from trendfilter.get_example_data import get_example_data_seasonal, deviation_mapping
+
+
+def test_functions_match_interp1d():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    result = trend_filter(x, y_noisy, l_norm=1, alpha_2=4.0, linear_deviations=[linear_deviation])
+    seasonal = result['linear_deviations'][0]['variable'].value
+    interp = interp1d(x, result['base_model'].value, fill_value="extrapolate")
+
+    x_new = np.linspace(-10.0, 150.0, 1001)
+    expected_base = interp(x_new)
+    expected_deviates = seasonal[x_new.astype(int) % 12]
+
+    assert np.allclose(result['function_base'](x_new), expected_base)
+    assert np.allclose(result['function_deviates'](x_new), expected_deviates)
+    assert np.allclose(result['function'](x_new), expected_base + expected_deviates)
+    assert np.allclose(result['y_fit'], result['function'](x.astype(float)))
+
+    # scalars, lists and arrays as before
+    assert np.isscalar(result['function'](120.0))
+    assert isinstance(result['function']([120.0, 121.0]), list)
+    assert result['function'](np.ones((2, 3))).shape == (2, 3)
+
+
+def test_matrix_only_deviation():
+    x = np.arange(24.0)
+    base = 0.5 * x
+    matrix = get_model_deviation_matrix(x, deviation_mapping, 12)
+    linear_deviations = [{'name': 'seasonal_term', 'matrix': matrix, 'values': np.arange(12.0)}]
+
+    func_base, func_deviates, func = get_interp_extrapolate_functions(x, base, linear_deviations)
+    assert np.allclose(func(x), base + x % 12)
+
+    with pytest.raises(ValueError):
+        func_deviates(np.array([30.0]))
+
+
+def test_integer_mapping():
+    x = np.arange(24.0)
+    months = np.arange(48) % 12
+
+    def mapping(index):
+        # only works with integer x
+        return months[index]
+
+    linear_deviations = [{'name': 'seasonal_term', 'mapping': mapping, 'values': np.arange(12.0)}]
+    func_base, func_deviates, func = get_interp_extrapolate_functions(x, 0.5 * x, linear_deviations)
+    x_new = np.arange(20, 40)
+    assert np.allclose(func(x_new), 0.5 * x_new + x_new % 12)
+    assert func(30) == 15.0 + 6
+    assert func([30, 31]) == [21.0, 22.5]
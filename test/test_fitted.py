@@ -0,0 +1,101 @@
+import pickle
+import numpy as np
+import pytest
+from trendfilter import trend_filter, fit_trend, FittedTrend
+from trendfilter.get_example_data import get_example_data_seasonal, deviation_mapping
+
+
+def get_fitted(**kwargs):
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    kwargs = dict({'l_norm': 1, 'alpha_2': 4.0, 'linear_deviations': [linear_deviation]},
+                  **kwargs)
+    return x, trend_filter(x, y_noisy, **kwargs), fit_trend(x, y_noisy, **kwargs)
+
+
+def test_predict_matches_result():
+    x, result, fitted = get_fitted()
+    x_new = np.linspace(-10.0, 150.0, 1001)
+
+    assert np.allclose(fitted.predict(x_new), result['function'](x_new))
+    assert np.allclose(fitted.predict_base(x_new), result['function_base'](x_new))
+    assert np.allclose(fitted.predict(x), result['y_fit'])
+    assert isinstance(fitted.predict(3.5), float)
+    assert fitted.metadata['alpha_2'] == 4.0
+    assert fitted.debug is None
+
+
+@pytest.mark.parametrize('filename', ['model.npz', 'model_dir'])
+def test_save_load(tmp_path, filename):
+    x, result, fitted = get_fitted(engine='banded', l_norm=2)
+    path = str(tmp_path / filename)
+    fitted.save(path)
+
+    loaded = FittedTrend.load(path)
+    assert loaded.metadata == fitted.metadata
+    assert np.array_equal(loaded.predict(x), fitted.predict(x))
+    if filename == 'model_dir':
+        assert isinstance(loaded.x, np.memmap)
+
+    # the mapping isn't saved, so new x needs it or the indices
+    x_new = np.array([120.0, 121.0])
+    with pytest.raises(ValueError):
+        loaded.predict(x_new)
+
+    expected = fitted.predict(x_new)
+    assert np.allclose(loaded.predict(x_new, deviation_indices={'seasonal_term': [0, 1]}),
+                       expected)
+    loaded = FittedTrend.load(path, mappings={'seasonal_term': deviation_mapping})
+    assert np.allclose(loaded.predict(x_new), expected)
+
+
+def test_pickle_without_debug():
+    x, result, fitted = get_fitted()
+    fitted = FittedTrend.from_result(result, debug=True)
+    assert fitted.debug is result
+
+    unpickled = pickle.loads(pickle.dumps(fitted))
+    assert unpickled.debug is None
+    assert np.array_equal(unpickled.predict(x), fitted.predict(x))
+
+
+def test_multiple_memberships(tmp_path):
+    x, y_noisy = get_example_data_seasonal()
+    indices = deviation_mapping(x)
+    # two memberships per point, the second padded with -1, with weights
+    multi = np.column_stack([indices, np.where(indices % 2 == 0, indices + 1, -1)])
+    weights = np.where(multi >= 0, 0.5, 0.0)
+    linear_deviation = {'indices': multi, 'weights': weights, 'n_vars': 12,
+                        'name': 'seasonal_term', 'alpha': 0.1}
+    result = trend_filter(x, y_noisy, l_norm=2, alpha_2=4.0, engine='banded',
+                          linear_deviations=[linear_deviation])
+    fitted = fit_trend(x, y_noisy, l_norm=2, alpha_2=4.0, engine='banded',
+                       linear_deviations=[linear_deviation])
+    assert np.allclose(fitted.predict(x), result['y_fit'])
+
+    path = str(tmp_path / 'model.npz')
+    fitted.save(path)
+    assert np.allclose(FittedTrend.load(path).predict(x), result['y_fit'])
+    assert np.allclose(FittedTrend.from_dict(fitted.to_dict()).predict(x), result['y_fit'])
+
+    x_new = np.array([200.0])
+    values = fitted.deviation_values[0]
+    expected = fitted.predict_base(x_new) + 0.5 * (values[2] + values[3])
+    predicted = fitted.predict(x_new, deviation_indices={'seasonal_term': ([[2, 3]], [[0.5, 0.5]])})
+    assert np.allclose(predicted, expected)
+
+
+def test_no_solution(monkeypatch):
+    x, y = get_example_data_seasonal()
+    result = trend_filter(x, y, alpha_2=1.0)
+    with pytest.raises(ValueError):
+        FittedTrend.from_result(dict(result, objective_total=None))
+
+    # as if the solver failed, leaving the problem without values
+    monkeypatch.setattr('trendfilter.trendfilter.solve_problem', lambda problem, solver: None)
+    with pytest.raises(ValueError):
+        fit_trend(x, y, alpha_2=1.0)
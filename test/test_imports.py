@@ -0,0 +1,30 @@
+import sys
+import subprocess
+
+SCRIPT = """
+import sys
+import trendfilter
+assert 'cvxpy' not in sys.modules and 'bokeh' not in sys.modules and 'scipy' not in sys.modules
+
+from trendfilter import FittedTrend, get_example_data
+from trendfilter.engines import trend_filter_engine
+x, y = get_example_data()
+trend_filter_engine(x, y, alpha_2=1.0, engine='banded')
+assert 'cvxpy' not in sys.modules and 'bokeh' not in sys.modules
+
+trendfilter.trend_filter(x, y, alpha_2=1.0)
+assert 'cvxpy' in sys.modules and 'bokeh' not in sys.modules
+"""
+
+
+def test_lazy_imports():
+    # a fresh interpreter, as the tests have already imported everything
+    subprocess.check_call([sys.executable, '-c', SCRIPT])
+
+
+def test_public_attributes():
+    import trendfilter
+    from trendfilter.fitted import FittedTrend
+    assert trendfilter.FittedTrend is FittedTrend
+    assert callable(trendfilter.trend_filter)
+    assert set(trendfilter.__all__) <= set(dir(trendfilter))
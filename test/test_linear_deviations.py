@@ -1,6 +1,9 @@
+import numpy as np
 from trendfilter import trend_filter
 from trendfilter.get_example_data import get_example_data_seasonal, deviation_mapping
 from trendfilter.plot_model import plot_model
+from trendfilter.linear_deviations import membership_matrix, deviation_contribution, \
+    slice_deviation
 
 show_plot = True
 tolerance = 1e-8
@@ -34,3 +37,68 @@ def test_with_seasonality():
     obj = result['objective_total'].value
     print('objective', obj, title)
     assert abs(obj - 28.308657555529226) < tolerance
+
+
+def test_indices_and_weighted_memberships():
+    x, y_noisy = get_example_data_seasonal()
+    indices = np.array([deviation_mapping(i) for i in x])
+
+    by_mapping = trend_filter(x, y_noisy, l_norm=2, alpha_2=4.0, engine='banded',
+                              linear_deviations=[{'mapping': deviation_mapping, 'n_vars': 12}])
+    by_indices = trend_filter(x, y_noisy, l_norm=2, alpha_2=4.0, engine='banded',
+                              linear_deviations=[{'indices': indices, 'n_vars': 12}])
+    assert abs(by_mapping['objective_total'] - by_indices['objective_total']) < tolerance
+
+    # two memberships per point, the second padded with -1, with weights
+    multi = np.column_stack([indices, np.where(indices % 2 == 0, indices + 1, -1)])
+    weights = np.where(multi >= 0, 0.5, 0.0)
+    matrix = membership_matrix(multi, 12, weights=weights)
+    assert np.allclose(np.ravel(matrix.sum(axis=1)), np.where(indices % 2 == 0, 1.0, 0.5))
+
+    values = np.arange(12.0)
+    assert np.allclose(deviation_contribution(values, multi, weights), matrix @ values)
+
+    def multi_mapping(xx):
+        month = np.asarray(xx, dtype=int) % 12
+        return np.column_stack([month, np.where(month % 2 == 0, month + 1, -1)])
+
+    result = trend_filter(x, y_noisy, l_norm=2, alpha_2=4.0, engine='banded',
+                          linear_deviations=[{'mapping': multi_mapping, 'n_vars': 12}])
+    assert np.allclose(result['function'](x), result['y_fit'])
+
+
+def test_many_categories():
+    rand = np.random.RandomState(3)
+    n, n_vars = 20000, 2000
+    x = np.arange(n, dtype=float)
+    y = np.sqrt(x) + 0.3 * rand.randn(n)
+    linear_deviations = []
+    for group in range(3):
+        indices = rand.randint(0, n_vars, n)
+        y += 0.2 * rand.randn(n_vars)[indices]
+        linear_deviations.append({'indices': indices, 'n_vars': n_vars, 'alpha': 1.0,
+                                  'name': 'group_%s' % group})
+
+    # many deviation variables use conjugate gradients, compare with the dense solve
+    result = trend_filter(x, y, l_norm=2, alpha_2=100.0, engine='banded',
+                          linear_deviations=linear_deviations)
+    small = [dict(lin_dev, indices=lin_dev['indices'] % 10, n_vars=10)
+             for lin_dev in linear_deviations]
+    assert result['solver_info']['converged']
+    assert len(result['linear_deviations'][2]['values']) == n_vars
+
+    dense = trend_filter(x, y, l_norm=2, alpha_2=100.0, engine='banded', linear_deviations=small)
+    iterative = trend_filter(x, y, l_norm=2, alpha_2=100.0, engine='banded',
+                             linear_deviations=small,
+                             engine_options={'max_dense_deviations': 0})
+    assert np.abs(dense['y_fit'] - iterative['y_fit']).max() < 1e-6
+
+    # admm solves the deviations with conjugate gradients too
+    admm = trend_filter(x[:3000], y[:3000], l_norm=2, alpha_2=100.0, engine='admm',
+                        linear_deviations=[slice_deviation(lin_dev, slice(0, 3000))
+                                           for lin_dev in small],
+                        engine_options={'max_dense_deviations': 0})
+    banded = trend_filter(x[:3000], y[:3000], l_norm=2, alpha_2=100.0, engine='banded',
+                          linear_deviations=[slice_deviation(lin_dev, slice(0, 3000))
+                                             for lin_dev in small])
+    assert abs(admm['objective_total'] / banded['objective_total'] - 1) < 1e-6
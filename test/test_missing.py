@@ -0,0 +1,75 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.chunked import trend_filter_chunked
+from trendfilter.compiled import ProblemCache
+from trendfilter.engines import trend_filter_engine
+from trendfilter.get_example_data import get_example_data
+from trendfilter.panel import trend_filter_panel
+from trendfilter.trendfilter import get_mask
+
+tolerance = 1e-6
+
+
+def get_gappy_data():
+    x, y_noisy = get_example_data()
+    y_gappy = y_noisy.copy()
+    y_gappy[20:30] = np.nan
+    return x, y_noisy, y_gappy
+
+
+def test_get_mask():
+    y = np.array([1.0, np.nan, 3.0, 4.0])
+    y_err = np.array([1.0, 1.0, np.inf, 1.0])
+    assert get_mask(np.ones(4)) is None
+    assert get_mask(y).tolist() == [True, False, True, True]
+    assert get_mask(y, y_err=y_err, mask=[False, True, True, True]).tolist() == \
+        [False, False, False, True]
+
+
+def test_nan_is_masked():
+    x, y_noisy, y_gappy = get_gappy_data()
+    mask = np.isfinite(y_gappy)
+
+    expected = trend_filter(x, y_noisy, l_norm=1, alpha_2=1.0, mask=mask)
+    objective = expected['objective_total'].value
+    y_fit = expected['y_fit']
+
+    for options in [{}, {'use_cache': True}, {'engine': 'qp'}]:
+        result = trend_filter(x, y_gappy, l_norm=1, alpha_2=1.0, **options)
+        assert abs(float(getattr(result['objective_total'], 'value', result['objective_total'])) -
+                   objective) < tolerance
+        assert np.isfinite(result['y_fit']).all()
+
+    # the gap is filled in by the model
+    assert np.isfinite(y_fit).all()
+
+
+def test_gaps_share_compiled_problem():
+    x, y_noisy, y_gappy = get_gappy_data()
+    cache = ProblemCache()
+    compiled = cache.get(x, l_norm=2)
+
+    other_gaps = y_noisy.copy()
+    other_gaps[[3, 40, 41, 70]] = np.nan
+    for y in [y_noisy, y_gappy, other_gaps]:
+        result = compiled.solve(y, alpha_2=1.0)
+        assert np.isfinite(result['y_fit']).all()
+
+    assert cache.get(x, l_norm=2) is compiled
+    assert compiled.n_solves == 3
+
+
+def test_nan_in_chunked_and_panel():
+    x, y_noisy, y_gappy = get_gappy_data()
+    mask = np.isfinite(y_gappy)
+    expected = trend_filter_engine(x, y_noisy, alpha_2=1.0, engine='banded', mask=mask)
+
+    # one window is the same problem, with more the gap only adds to the stitching error
+    chunked = trend_filter_chunked(x, y_gappy, alpha_2=1.0, chunk_size=len(x), overlap=10)
+    assert np.allclose(chunked['y_fit'], expected['y_fit'])
+    chunked = trend_filter_chunked(x, y_gappy, alpha_2=1.0, chunk_size=40, overlap=10)
+    assert np.abs(chunked['y_fit'] - expected['y_fit']).max() < 1e-2
+
+    panel = trend_filter_panel(x, [y_noisy, y_gappy], alpha_2=1.0)
+    assert np.allclose(panel['series'][1]['y_fit'], expected['y_fit'])
+    assert np.isnan(panel['series'][1]['y'][20:30]).all()
@@ -0,0 +1,55 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.multiresolution import get_levels, trend_filter_multiresolution
+from trendfilter.get_example_data import deviation_mapping
+
+
+def get_long_data(n=5000):
+    rand = np.random.RandomState(7)
+    x = np.cumsum(rand.uniform(0.5, 1.5, n))
+    y = np.sqrt(x) + 0.3 * np.sin(2 * np.pi * x / 12.0) + 0.3 * rand.randn(n)
+    y[rand.choice(n, 20, replace=False)] += 5.0
+    return x, y
+
+
+def test_levels():
+    levels = get_levels(10000, factor=4, min_points=500)
+    assert [len(level) for level in levels] == [626, 2501, 10000]
+    for level in levels:
+        assert level[0] == 0 and level[-1] == 9999
+
+
+def test_multiresolution_matches_direct():
+    x, y = get_long_data()
+    result = trend_filter_multiresolution(x, y, l_norm=2, alpha_2=10.0,
+                                          min_points=200, check=True)
+    assert len(result['levels']) == 3
+    assert result['levels'][-1]['n'] == len(x)
+    assert abs(result['check']['relative_difference']) < 1e-10
+
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    result = trend_filter(x, y, l_norm=1, alpha_2=10.0, linear_deviations=[linear_deviation],
+                          engine='qp', multiresolution={'min_points': 500, 'check': True})
+    assert result['engine'] == 'qp'
+    assert abs(result['check']['relative_difference']) < 1e-6
+
+    result = trend_filter(x, y, l_norm=2, alpha_2=10.0, engine='qp',
+                          multiresolution={'min_points': 500, 'check': True})
+    assert result['solver_info']['solver'] == 'OSQP'
+    assert abs(result['check']['relative_difference']) < 1e-6
+
+
+def test_multiresolution_extrapolates_deviations():
+    x, y = get_long_data()
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    result = trend_filter_multiresolution(x, y, l_norm=2, alpha_2=10.0, min_points=500,
+                                          linear_deviations=[linear_deviation])
+    direct = trend_filter(x, y, l_norm=2, alpha_2=10.0, engine='banded',
+                          linear_deviations=[linear_deviation])
+    assert 'mapping' in result['linear_deviations'][0]
+
+    x_new = x.max() + np.array([0.5, 3.0, 20.0])
+    assert np.allclose(result['function'](x_new), direct['function'](x_new))
+    assert np.allclose(result['function_deviates'](x_new), direct['function_deviates'](x_new))
@@ -0,0 +1,40 @@
+import numpy as np
+from trendfilter.engines import trend_filter_engine
+from trendfilter.online import OnlineTrendFilter
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-8
+
+
+def test_online_matches_batch():
+    x, y_noisy = get_example_data()
+    online = OnlineTrendFilter(alpha_2=2.0)
+    online.fit(x[:30], y_noisy[:30])
+
+    for x_new, y_new in zip(x[30:], y_noisy[30:]):
+        result = online.update(x_new, y_new)
+
+    expected = trend_filter_engine(x, y_noisy, alpha_2=2.0, engine='banded')
+    obj = result['objective_total']
+    assert abs(obj - expected['objective_total']) < tolerance * expected['objective_total']
+
+
+def test_online_window_with_seasonality():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    window = 40
+    online = OnlineTrendFilter(alpha_2=4.0, linear_deviations=[linear_deviation],
+                               window=window)
+    for x_new, y_new in zip(x, y_noisy):
+        result = online.update(x_new, y_new)
+
+    assert len(result['x']) == window
+    expected = trend_filter_engine(x[-window:], y_noisy[-window:], alpha_2=4.0,
+                                   linear_deviations=[linear_deviation], engine='banded')
+    assert abs(result['objective_total'] - expected['objective_total']) < 1e-6
+    assert np.abs(result['y_fit'] - expected['y_fit']).max() < 1e-6
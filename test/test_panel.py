@@ -0,0 +1,52 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.panel import trend_filter_panel
+from trendfilter.get_example_data import deviation_mapping
+
+
+def get_panel_data(n_series=20, n=120):
+    rand = np.random.RandomState(5)
+    x = np.arange(n, dtype=float)
+    seasonal = np.sin(2 * np.pi * np.arange(12) / 12.0)
+    ys = [rand.uniform(1, 5) * np.sqrt(x) + seasonal[x.astype(int) % 12] + 0.5 * rand.randn(n)
+          for _ in range(n_series)]
+    return x, ys, seasonal
+
+
+def test_panel_single_series_matches_trend_filter():
+    x, ys, _ = get_panel_data(n_series=1)
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    panel = trend_filter_panel(x, ys, alpha_2=10.0, linear_deviations=[linear_deviation])
+    single = trend_filter(x, ys[0], alpha_2=10.0, linear_deviations=[linear_deviation],
+                          engine='banded')
+    assert abs(panel['objective_total'] - single['objective_total']) < 1e-8
+    assert np.allclose(panel['series'][0]['y_fit'], single['y_fit'])
+
+
+def test_panel_shares_seasonality():
+    x, ys, seasonal = get_panel_data()
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    panel = trend_filter_panel(x, ys, alpha_2=10.0, linear_deviations=[linear_deviation])
+    assert len(panel['series']) == len(ys)
+
+    def error(values):
+        values = values - values.mean()
+        return np.abs(values - seasonal).max()
+
+    shared_error = error(panel['deviations']['seasonal_term'])
+    single_errors = [error(trend_filter(x, y, alpha_2=10.0, linear_deviations=[linear_deviation],
+                                        engine='banded')['linear_deviations'][0]['values'])
+                     for y in ys]
+    assert shared_error < np.mean(single_errors)
+
+    # per-series offsets shrunk towards the shared values, with both engines
+    hierarchical = dict(linear_deviation, series_alpha=1.0)
+    banded = trend_filter_panel(x, ys, alpha_2=10.0, linear_deviations=[hierarchical])
+    admm = trend_filter_panel(x, ys, alpha_2=10.0, linear_deviations=[hierarchical],
+                              engine='admm')
+    assert banded['offsets']['seasonal_term'].shape == (len(ys), 12)
+    assert abs(admm['objective_total'] / banded['objective_total'] - 1) < 1e-6
+    series = banded['series'][3]
+    assert np.allclose(series['function'](x), series['y_fit'])
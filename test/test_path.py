@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from trendfilter.engines import trend_filter_engine
+from trendfilter.derivatives import get_operators
+from trendfilter.path import trend_filter_path, evaluate_path
+
+
+def get_data(n=150):
+    rand = np.random.RandomState(1)
+    x = np.sort(rand.uniform(0, 100, n))
+    y = np.abs(x - 40) * 0.1 + 0.2 * rand.randn(n)
+    return x, y, np.full(n, 5.0)
+
+
+def test_path_matches_fits():
+    x, y, y_err = get_data()
+    path = trend_filter_path(x, y, y_err=y_err)
+    assert path['complete']
+    assert path['huber_ok'].all()
+    assert np.all(np.diff(path['alphas']) <= 0)
+
+    # at a knot, between knots and above the first knot
+    for alpha_2 in [path['alphas'][5], 0.97 * path['alphas'][3],
+                    1.01 * path['alphas'][10], 2 * path['alphas'][0]]:
+        result = trend_filter_engine(x, y, y_err=y_err, l_norm=1, alpha_2=alpha_2, engine='qp')
+        assert np.abs(evaluate_path(path, alpha_2) - result['base_model']).max() < 1e-4
+
+    # above the first knot the base model is linear
+    assert np.abs(get_operators(x)['d2'] @ path['base_models'][0]).max() < 1e-6
+
+
+def test_path_stops_early():
+    x, y, y_err = get_data()
+    path = trend_filter_path(x, y, y_err=y_err, max_changepoints=4)
+    assert not path['complete']
+    assert path['n_changepoints'][-1] == 4
+    with pytest.raises(ValueError):
+        evaluate_path(path, 0.5 * path['alphas'][-1])
@@ -0,0 +1,35 @@
+from trendfilter import trend_filter, get_example_data
+from trendfilter.profiling import add_profile_hook, remove_profile_hook
+
+
+def test_profile_phases():
+    x, y_noisy = get_example_data()
+    result = trend_filter(x, y_noisy, alpha_2=0.3, l_norm=1, profile=True)
+    profile = result['profile']
+
+    phases = ['linear_deviations', 'objective', 'operators', 'canonicalization',
+              'solve', 'interpolation']
+    assert list(profile['phases']) == phases
+    assert profile['solver_stats']['status'] == 'optimal'
+    assert profile['solver_stats']['num_iters'] > 0
+    assert profile['total_seconds'] >= sum(p['seconds'] for p in profile['phases'].values())
+
+    assert 'profile' not in trend_filter(x, y_noisy, alpha_2=0.3, l_norm=1)
+
+
+def test_profile_hooks_and_memory():
+    x, y_noisy = get_example_data()
+    profiles = []
+    add_profile_hook(profiles.append)
+    try:
+        trend_filter(x, y_noisy, alpha_2=2.0, engine='banded', profile='memory')
+        trend_filter(x, y_noisy, alpha_2=2.0, use_cache=True, profile=True)
+        trend_filter(x, y_noisy, alpha_2=2.0)
+    finally:
+        remove_profile_hook(profiles.append)
+
+    assert len(profiles) == 2
+    assert profiles[0]['engine'] == 'banded'
+    assert profiles[0]['phases']['solve']['peak_memory_mb'] > 0
+    assert profiles[0]['solver_stats']['num_iters'] > 0
+    assert 'peak_memory_mb' not in profiles[1]['phases']['solve']
@@ -0,0 +1,90 @@
+import numpy as np
+from trendfilter import trend_filter
+from trendfilter.trendfilter import get_isig
+from trendfilter.qp import assemble_qp, choose_solvers, get_osqp_settings, osqp_is_legacy
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+
+tolerance = 1e-6
+
+
+def test_qp_matches_cvxpy():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    options = [{'l_norm': 1, 'alpha_2': 4.0},
+               {'l_norm': 2, 'alpha_1': 0.3, 'alpha_2': 4.0},
+               {'l_norm': 1, 'alpha_2': 1.0, 'monotonic': True, 'positive': True},
+               {'l_norm': 1, 'alpha_1': 1.0, 'alpha_2': 4.0,
+                'linear_deviations': [linear_deviation]},
+               {'l_norm': 2, 'alpha_2': 4.0, 'constrain_zero': True,
+                'linear_deviations': [linear_deviation]}]
+
+    for kwargs in options:
+        expected = trend_filter(x, y_noisy, solver='CLARABEL', **kwargs)
+        # OSQP is a first-order method so less accurate
+        for solver, rel_tolerance in [('CLARABEL', tolerance), ('OSQP', 1e-5)]:
+            result = trend_filter(x, y_noisy, engine='qp',
+                                  engine_options={'solver': solver}, **kwargs)
+            obj = result['objective_total']
+            expected_obj = expected['objective_total'].value
+            print('objective', solver, obj, expected_obj, kwargs)
+            assert result['solver_info']['solver'] == solver
+            assert abs(obj - expected_obj) < rel_tolerance * expected_obj
+
+
+def test_qp_fallback_and_warm_start():
+    x, y_noisy = get_example_data()
+    options = {'solver': 'OSQP', 'solver_options': {'OSQP': {'max_iter': 1}}}
+    result = trend_filter(x, y_noisy, alpha_2=1.0, engine='qp', engine_options=options)
+    assert result['solver_info']['solver'] == 'CLARABEL'
+    assert result['solver_info']['fallbacks'][0]['solver'] == 'OSQP'
+
+    first = trend_filter(x, y_noisy, alpha_2=1.0, engine='qp', engine_options={'solver': 'OSQP'})
+    again = trend_filter(x, y_noisy, alpha_2=1.0, engine='qp',
+                         engine_options={'solver': 'OSQP', 'warm_start': first['solver_info']['state']})
+    assert again['solver_info']['iterations'] <= first['solver_info']['iterations']
+    assert abs(again['objective_total'] - first['objective_total']) < tolerance
+
+
+def test_assemble_qp_huber_epigraph():
+    # with s and u at their optimum for a given model, the QP
+    # objective is the Huber loss plus the regularization
+    x, y_noisy = get_example_data()
+    isig = get_isig(y_noisy, np.ones(len(x)))
+    qp = assemble_qp(x, y_noisy, isig, l_norm=2, alpha_2=2.0)
+    assert qp['A'].shape[1] == len(qp['q']) == 3 * len(x)
+
+    model = np.sqrt(x)
+    resid = isig * (model - y_noisy)
+    s = np.clip(resid, -1.0, 1.0)
+    z = np.concatenate([model, s, np.abs(resid - s)])
+    p_matrix = (qp['P'] + qp['P'].T).tolil()
+    p_matrix.setdiag(qp['P'].diagonal())
+    value = 0.5 * z @ (p_matrix @ z) + qp['q'] @ z
+    expected = trend_filter(x, y_noisy, alpha_2=2.0, engine='banded',
+                            engine_options={'max_iter': 0, 'warm_start': model})
+    a_z = qp['A'] @ z
+    assert np.all(a_z >= qp['l'] - 1e-12) and np.all(a_z <= qp['u'] + 1e-12)
+    assert abs(value - expected['objective_total']) < 1e-9
+    assert choose_solvers(10**6, 2)[0] == 'OSQP'
+    assert choose_solvers(100, 1)[0] == 'CLARABEL'
+
+
+def test_auto_cvxpy_solver():
+    x, y_noisy = get_example_data()
+    expected = trend_filter(x, y_noisy, l_norm=1, alpha_2=1.0)['objective_total'].value
+    result = trend_filter(x, y_noisy, l_norm=1, alpha_2=1.0, solver='auto', profile=True)
+    assert abs(result['objective_total'].value - expected) < tolerance * expected
+    assert result['profile']['solver_stats']['solver_name'] == 'CLARABEL'
+
+
+def test_osqp_settings():
+    assert get_osqp_settings()['polishing'] is True
+    legacy = get_osqp_settings({'polishing': False}, legacy=True)
+    assert legacy['polish'] is False and 'polishing' not in legacy
+    assert get_osqp_settings({'polish': False})['polishing'] is False
+    assert osqp_is_legacy('0.6.7') and not osqp_is_legacy('1.1.3')
@@ -0,0 +1,56 @@
+import numpy as np
+from trendfilter.result_cache import ResultCache, cached_fit_trend, result_key
+from trendfilter.get_example_data import get_example_data_seasonal, deviation_mapping
+
+
+def test_result_cache(tmp_path):
+    x, y = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping, 'name': 'seasonal_term',
+                        'n_vars': 12, 'alpha': 0.1}
+    options = {'l_norm': 1, 'alpha_2': 4.0, 'linear_deviations': [linear_deviation]}
+
+    cache = ResultCache(directory=str(tmp_path))
+    fitted = cached_fit_trend(x, y, cache=cache, **options)
+    again = cached_fit_trend(x, y, cache=cache, **options)
+    assert again.base is fitted.base
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+    # the same numbers as other types give the same key
+    assert result_key(x, y, **options) == result_key(x, y, l_norm=np.int64(1), alpha_2=4,
+                                                     linear_deviations=[linear_deviation])
+
+    # the key covers the options and the deviation structure
+    assert result_key(x, y, **options) != result_key(x, y, l_norm=1, alpha_2=5.0,
+                                                     linear_deviations=[linear_deviation])
+    indices = dict(linear_deviation, indices=np.array([deviation_mapping(i) for i in x]))
+    indices.pop('mapping')
+    assert result_key(x, y, **options) == result_key(x, y, l_norm=1, alpha_2=4.0,
+                                                     linear_deviations=[indices])
+
+    # a hit without the mapping doesn't take it from the earlier caller
+    without = cached_fit_trend(x, y, cache=cache, l_norm=1, alpha_2=4.0,
+                               linear_deviations=[indices])
+    assert without.mappings == [None]
+    assert fitted.mappings == [deviation_mapping]
+
+    # a new cache on the same directory loads from disk without cvxpy solving
+    on_disk = ResultCache(directory=str(tmp_path))
+    loaded = cached_fit_trend(x, y, cache=on_disk, **options)
+    assert on_disk.stats['disk_hits'] == 1
+    x_new = np.arange(x.max() + 1, x.max() + 20)
+    assert np.allclose(loaded.predict(x_new), fitted.predict(x_new))
+
+
+def test_result_cache_eviction(tmp_path):
+    x, y = get_example_data_seasonal()
+    fitted = cached_fit_trend(x, y, cache=ResultCache(), l_norm=2, alpha_2=4.0, engine='banded')
+
+    cache = ResultCache(max_bytes=int(2.5 * fitted.nbytes), directory=str(tmp_path),
+                        max_disk_bytes=1)
+    for shift in range(3):
+        cache.put(result_key(x, y + shift), fitted)
+    assert len(cache) == 2
+    assert cache.get(result_key(x, y)) is None
+    assert cache.get(result_key(x, y + 2)) is fitted
+    assert len(list(tmp_path.iterdir())) == 0
+    assert cache.stats['evictions'] == 4
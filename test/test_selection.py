@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from trendfilter import trend_filter
+from trendfilter.get_example_data import get_example_data, get_example_data_seasonal, \
+    deviation_mapping
+from trendfilter.selection import select_alpha_2, get_degrees_of_freedom, get_criteria
+from trendfilter.path import trend_filter_path
+
+
+def test_degrees_of_freedom():
+    x = np.arange(11.0)
+    base = np.maximum(x - 3, 0) - 2 * np.maximum(x - 7, 0)
+    assert get_degrees_of_freedom(x, base, base) == 4
+    assert get_degrees_of_freedom(x, base, 1 + 0.5 * x) == 2
+    assert get_degrees_of_freedom(x, base, base, deviation_values=[np.array([0, 1.0, 0])],
+                                  constrain_zero=True) == 4
+
+
+def test_auto_alpha_from_path():
+    x, y_noisy = get_example_data()
+    # errors large enough that the Huber loss stays quadratic along the path
+    y_err = np.full(len(x), 5.0)
+    result = trend_filter(x, y_noisy, y_err=y_err, l_norm=1, alpha_2='auto',
+                          selection={'criterion': 'sure'})
+    selection = result['alpha_selection']
+    assert selection['method'] == 'path'
+    assert selection['index'] == int(np.argmin(selection['sure']))
+    assert np.all(np.diff(selection['alphas']) <= 0)
+
+    values = get_criteria(selection['loss'], selection['df'], len(x))
+    assert np.allclose(values['sure'], selection['sure'])
+
+    expected = trend_filter(x, y_noisy, y_err=y_err, l_norm=1, alpha_2=selection['alpha_2'])
+    assert abs(result['objective_total'].value - expected['objective_total'].value) < 1e-6
+    # at the knot, the changepoint being added or dropped is zero up to the solver's precision
+    df = get_degrees_of_freedom(x, y_noisy, result['base_model'].value)
+    assert abs(df - selection['df'][selection['index']]) <= 1
+
+
+def test_auto_alpha_with_huber_loss():
+    x, y_noisy = get_example_data()
+    path = trend_filter_path(x, y_noisy)
+    assert not path['huber_ok'].all()
+
+    # the path is the squared loss fit here, so the knots are refit with the Huber loss
+    selection = select_alpha_2(x, y_noisy, criterion='sure')
+    assert selection['method'] == 'grid'
+    knots = select_alpha_2(x, y_noisy, criterion='sure', alphas=path['alphas'], engine='qp')
+    assert 0.5 < selection['alpha_2'] / knots['alpha_2'] < 2.0
+
+
+def test_auto_alpha_with_seasonality():
+    x, y_noisy = get_example_data_seasonal()
+    linear_deviation = {'mapping': deviation_mapping,
+                        'name': 'seasonal_term',
+                        'n_vars': 12,
+                        'alpha': 0.1}
+
+    alphas = [30.0, 10.0, 3.0, 1.0, 0.3, 0.1]
+    result = trend_filter(x, y_noisy, l_norm=1, alpha_2='auto', engine='qp',
+                          linear_deviations=[linear_deviation],
+                          selection={'alphas': alphas, 'criterion': 'aic'})
+    selection = result['alpha_selection']
+    assert selection['method'] == 'grid'
+    assert selection['alpha_2'] == alphas[int(np.argmin(selection['aic']))]
+    # the seasonal values count towards the degrees of freedom
+    assert selection['df'].min() > 12
+
+    # without the choice of alphas, the default grid
+    selection = select_alpha_2(x, y_noisy, n_alphas=5, engine='qp',
+                               linear_deviations=[linear_deviation])
+    assert len(selection['alphas']) == 5
+
+
+def test_auto_alpha_needs_l1():
+    x, y_noisy = get_example_data()
+    with pytest.raises(AssertionError):
+        trend_filter(x, y_noisy, l_norm=2, alpha_2='auto')
@@ -0,0 +1,93 @@
+import os
+import signal
+import asyncio
+import numpy as np
+import pytest
+from trendfilter.fitted import fit_trend
+from trendfilter.get_example_data import get_example_data
+from trendfilter.server import FitService, ServerBusy, serve, fit_remote
+
+options = {'l_norm': 2, 'alpha_2': 4.0, 'engine': 'banded'}
+
+
+def test_service_coalesces_and_batches():
+    x, y = get_example_data()
+    y_2 = y + 1.0
+
+    async def run():
+        async with FitService(batch_delay=0.05) as service:
+            fits = await asyncio.gather(service.fit(x, y, options=options),
+                                        service.fit(x, y, options=options),
+                                        service.fit(x, y_2, options=options))
+            return fits, service.stats
+
+    fits, stats = asyncio.run(run())
+    assert stats['requests'] == 3
+    assert stats['coalesced'] == 1
+    assert stats['batches'] == 1
+    assert stats['fits'] == 2
+    assert np.allclose(fits[0].predict(x), fit_trend(x, y, **options).predict(x))
+    assert np.allclose(fits[2].predict(x), fit_trend(x, y_2, **options).predict(x))
+
+
+def test_service_backpressure_and_timeout():
+    x, y = get_example_data()
+
+    async def run():
+        async with FitService(max_pending=1, batch_delay=0.05) as service:
+            first = asyncio.ensure_future(service.fit(x, y, options=options))
+            await asyncio.sleep(0)
+            with pytest.raises(ServerBusy):
+                await service.fit(x, y + 1.0, options=options)
+            await first
+
+            with pytest.raises(asyncio.TimeoutError):
+                await service.fit(x, y + 2.0, options=options, timeout=1e-3)
+            # the timed out request doesn't hold the only place
+            assert service.pending == 0
+            await service.fit(x, y + 3.0, options=options)
+            return service.stats
+
+    stats = asyncio.run(run())
+    assert stats['rejected'] == 1
+    assert stats['timeouts'] == 1
+
+
+def test_service_replaces_broken_pool():
+    x, y = get_example_data()
+
+    async def run():
+        async with FitService(batch_delay=0.0) as service:
+            for pid in list(service.executor._processes):
+                os.kill(pid, signal.SIGKILL)
+            try:
+                await service.fit(x, y, options=options)
+            except RuntimeError:
+                # the pool may break under this request
+                pass
+            fitted = await service.fit(x, y + 1.0, options=options)
+            return fitted, service.stats
+
+    fitted, stats = asyncio.run(run())
+    assert stats['restarts'] == 1
+    assert np.allclose(fitted.predict(x), fit_trend(x, y + 1.0, **options).predict(x))
+
+
+def test_socket_server():
+    x, y = get_example_data()
+    expected = fit_trend(x, y, **options).predict(x)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        server = asyncio.ensure_future(serve(port=0, ready=ready))
+        port = await ready
+        fits = await asyncio.gather(
+            loop.run_in_executor(None, lambda: fit_remote(x, y, options=options, port=port)),
+            loop.run_in_executor(None, lambda: fit_remote(x, y, options=options, port=port,
+                                                          binary=True)))
+        server.cancel()
+        return fits
+
+    for fitted in asyncio.run(run()):
+        assert np.allclose(fitted.predict(x), expected)
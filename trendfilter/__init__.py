@@ -1,5 +1,33 @@
-from trendfilter.trendfilter import trend_filter
+"""
+The fitting functions are imported on first use, so importing
+trendfilter doesn't load cvxpy, scipy or bokeh until they're needed
+"""
+
+import importlib
+
+# these only need numpy. They share their module's name so are
+# imported here, otherwise importing the module would shadow them
 from trendfilter.plot_model import plot_model
 from trendfilter.get_example_data import get_example_data, get_example_data_seasonal
 
 __version__ = "0.2.1"
+
+_LAZY_ATTRIBUTES = {'trend_filter': 'trendfilter.trendfilter',
+                    'FittedTrend': 'trendfilter.fitted',
+                    'fit_trend': 'trendfilter.fitted'}
+
+__all__ = ['trend_filter', 'plot_model', 'FittedTrend', 'fit_trend',
+           'get_example_data', 'get_example_data_seasonal']
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module 'trendfilter' has no attribute '%s'" % name)
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
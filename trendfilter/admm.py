@@ -0,0 +1,289 @@
+"""
+A specialized ADMM solver for trend filtering that doesn't use cvxpy
+
+The problem is split as
+    w = base + sum(M_k c_k)   Huber loss, constrain_zero
+    z = D2 base               alpha_2 norm
+    v = D1 base / dx          alpha_1 norm, monotonic
+    p = base                  positive
+    q_k = c_k                 deviation alpha_k norm, positive
+Every split has the same rho so the linear system for (base, c)
+never changes. It is sparse and banded, apart from the deviation
+columns, and is factored once. Each iteration is then O(n). With many
+deviation variables the factor would fill in, so only the banded base
+block is factored and the deviations are solved for with conjugate
+gradients, warm started from the previous iteration.
+"""
+
+import numpy as np
+from scipy.sparse import identity, vstack, hstack, csc_matrix
+from scipy.sparse.linalg import splu, LinearOperator, cg
+from trendfilter.derivatives import get_operators
+from trendfilter.banded import MAX_DENSE_DEVIATIONS
+
+
+def admm_trend_filter(x, y, isig, alpha_1=0.0, alpha_2=0.0, l_norm=1,
+                      constrain_zero=False, monotonic=False, positive=False,
+                      linear_deviations=None, rho=None, max_iter=10000,
+                      eps_abs=1e-7, eps_rel=1e-7, relaxation=1.6,
+                      adaptive_rho=True, warm_start=None, operators=None,
+                      max_dense_deviations=MAX_DENSE_DEVIATIONS):
+    """
+    Solve the trend filter problem with ADMM
+    :param x: The x-value, numpy array, sorted
+    :param y: The y variable, numpy array
+    :param isig: inverse sigma from get_isig
+    :param alpha_1: Regularization against non-zero slope
+    :param alpha_2: Regularization against changing slope
+    :param l_norm: 1 or 2 to use either L1 or L2 norm
+    :param constrain_zero: If True constrains the model to be zero at origin
+    :param monotonic: If True, the base model will be monotonically increasing
+    :param positive: If True, the base model will be positive
+    :param linear_deviations: list of completed linear deviations (no variables needed)
+    :param rho: ADMM penalty parameter. Defaults to the mean Huber curvature.
+    :param max_iter: maximum number of iterations
+    :param eps_abs: absolute tolerance on the residuals
+    :param eps_rel: relative tolerance on the residuals
+    :param relaxation: over-relaxation parameter, between 1 and 2
+    :param adaptive_rho: If True, balance the primal and dual residuals
+        by adjusting rho
+    :param warm_start: None, an array of initial base model values or the
+        'state' from a previous solution on the same problem
+    :param operators: optional dict of 'd1' and 'd2' matrices for x,
+        see get_operators
+    :param max_dense_deviations: with more deviation variables than this
+        the system is solved with a SchurSolver rather than factored
+    :return: dict with base_model, deviation_values and the solver info
+    """
+    assert l_norm in [1, 2]
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    isig = np.asarray(isig, dtype=float)
+    n = len(x)
+    n_devs = [lin_dev['n_vars'] for lin_dev in linear_deviations]
+    n_theta = n + sum(n_devs)
+
+    dev_matrices = [csc_matrix(lin_dev['matrix'], dtype=float) for lin_dev in linear_deviations]
+
+    if operators is None:
+        operators = get_operators(x)
+
+    if rho is None:
+        rho = max(float(np.mean(2.0 * isig ** 2)), 1e-6)
+
+    # build the split blocks (matrix acting on theta, prox function)
+    blocks = []
+
+    loss_matrix = hstack([identity(n, format='csc')] + dev_matrices, format='csc')
+    blocks.append((loss_matrix, _huber_prox(y, isig, constrain_zero)))
+
+    base_columns = _base_columns(n, n_theta)
+
+    if alpha_2 > 0:
+        blocks.append((csc_matrix(operators['d2']) @ base_columns, _norm_prox(alpha_2, l_norm)))
+
+    if alpha_1 > 0 or monotonic:
+        blocks.append((csc_matrix(operators['d1']) @ base_columns, _norm_prox(alpha_1, l_norm, monotonic)))
+
+    if positive:
+        blocks.append((base_columns, _norm_prox(0.0, l_norm, True)))
+
+    start = n
+    for lin_dev, n_dev in zip(linear_deviations, n_devs):
+        columns = _columns(start, n_dev, n_theta)
+        blocks.append((columns, _norm_prox(lin_dev['alpha'], l_norm, lin_dev.get('positive', False))))
+        start += n_dev
+
+    a_matrix = vstack([block[0] for block in blocks], format='csr')
+    a_matrix_t = a_matrix.T.tocsr()
+    slices = []
+    row = 0
+    for block in blocks:
+        slices.append(slice(row, row + block[0].shape[0]))
+        row += block[0].shape[0]
+
+    m = a_matrix.shape[0]
+
+    # the same for any rho as all the blocks share it
+    kkt = csc_matrix(a_matrix_t @ a_matrix)
+    if n_theta - n > max_dense_deviations:
+        factor = SchurSolver(kkt, n)
+    else:
+        factor = splu(kkt)
+
+    # initialize
+    if isinstance(warm_start, dict):
+        split = warm_start['split'].copy()
+        dual = warm_start['dual'].copy()
+        rho = warm_start['rho']
+    else:
+        if warm_start is None:
+            theta = np.zeros(n_theta)
+            theta[:n] = y
+        else:
+            theta = np.zeros(n_theta)
+            theta[:n] = warm_start
+
+        split = a_matrix @ theta
+        dual = np.zeros(m)
+
+    converged = False
+    primal_residual = np.inf
+    dual_residual = np.inf
+    rho_updates = 0
+    iteration = 0
+
+    for iteration in range(1, max_iter + 1):
+        theta = factor.solve(a_matrix_t @ (split - dual))
+        a_theta = a_matrix @ theta
+        a_theta_relaxed = relaxation * a_theta + (1 - relaxation) * split
+
+        split_prev = split
+        split = np.empty(m)
+        point = a_theta_relaxed + dual
+        for block, slc in zip(blocks, slices):
+            split[slc] = block[1](point[slc], rho)
+
+        dual += a_theta_relaxed - split
+
+        primal_residual = np.linalg.norm(a_theta - split)
+        dual_residual = rho * np.linalg.norm(a_matrix_t @ (split - split_prev))
+
+        eps_primal = np.sqrt(m) * eps_abs + \
+            eps_rel * max(np.linalg.norm(a_theta), np.linalg.norm(split))
+        eps_dual = np.sqrt(n_theta) * eps_abs + \
+            eps_rel * rho * np.linalg.norm(a_matrix_t @ dual)
+
+        if primal_residual <= eps_primal and dual_residual <= eps_dual:
+            converged = True
+            break
+
+        if adaptive_rho and iteration % 10 == 0:
+            if primal_residual > 10 * dual_residual:
+                rho *= 2.0
+                dual /= 2.0
+                rho_updates += 1
+            elif dual_residual > 10 * primal_residual:
+                rho /= 2.0
+                dual *= 2.0
+                rho_updates += 1
+
+    # report the solution satisfying the hard constraints exactly
+    # where the splits enforce them
+    base_model = theta[:n].copy()
+    if positive:
+        base_model = np.maximum(base_model, 0.0)
+
+    deviation_values = []
+    start = n
+    for n_dev in n_devs:
+        deviation_values.append(theta[start:start + n_dev].copy())
+        start += n_dev
+
+    info = {'iterations': iteration,
+            'converged': converged,
+            'primal_residual': primal_residual,
+            'dual_residual': dual_residual,
+            'rho': rho,
+            'rho_updates': rho_updates,
+            'state': {'split': split, 'dual': dual, 'rho': rho}}
+
+    return {'base_model': base_model,
+            'deviation_values': deviation_values,
+            'solver_info': info}
+
+
+class SchurSolver:
+    """
+    Solves the system for (base, deviations) by factoring the banded
+    base block and solving the Schur complement for the deviations
+    with Jacobi preconditioned conjugate gradients
+    """
+
+    def __init__(self, kkt, n):
+        """
+        :param kkt: the symmetric system matrix, sparse
+        :param n: the size of the base block
+        """
+        kkt = csc_matrix(kkt)
+        self.n = n
+        self.base_factor = splu(kkt[:n, :n].tocsc())
+        self.coupling = kkt[:n, n:].tocsc()
+        self.coupling_t = self.coupling.T.tocsr()
+        self.deviation_block = kkt[n:, n:].tocsr()
+        self.deviations = np.zeros(kkt.shape[0] - n)
+
+        n_devs = len(self.deviations)
+        diagonal = self.deviation_block.diagonal()
+        self.schur = LinearOperator((n_devs, n_devs), matvec=self._schur_matvec, dtype=float)
+        self.preconditioner = LinearOperator((n_devs, n_devs), matvec=lambda v: v / diagonal,
+                                             dtype=float)
+
+    def _schur_matvec(self, values):
+        values = np.ravel(values)
+        return self.deviation_block @ values - \
+            self.coupling_t @ self.base_factor.solve(self.coupling @ values)
+
+    def solve(self, rhs):
+        """
+        :param rhs: numpy array
+        :return: numpy array, the solution
+        """
+        base_rhs = self.base_factor.solve(rhs[:self.n])
+        schur_rhs = rhs[self.n:] - self.coupling_t @ base_rhs
+        self.deviations = cg(self.schur, schur_rhs, x0=self.deviations, rtol=1e-10,
+                             atol=0.0, M=self.preconditioner)[0]
+        base = base_rhs - self.base_factor.solve(self.coupling @ self.deviations)
+        return np.concatenate([base, self.deviations])
+
+
+def _columns(start, size, n_theta):
+    return csc_matrix((np.ones(size), (np.arange(size), np.arange(start, start + size))),
+                      shape=(size, n_theta))
+
+
+def _base_columns(n, n_theta):
+    return _columns(0, n, n_theta)
+
+
+def _huber_prox(y, isig, constrain_zero):
+    """
+    prox of sum(huber(isig * (w - y)))
+    """
+    s2 = 2.0 * isig ** 2
+
+    def prox(a, rho):
+        d = a - y
+        quad = rho * d / (s2 + rho)
+        lin = d - 2.0 * isig * np.sign(d) / rho
+        in_quad = np.abs(isig * quad) <= 1.0
+        w = y + np.where(in_quad, quad, lin)
+        if constrain_zero:
+            w[0] = 0.0
+        return w
+
+    return prox
+
+
+def _norm_prox(alpha, l_norm, non_negative=False):
+    """
+    prox of alpha * norm(v), optionally with v >= 0
+    """
+    def prox(a, rho):
+        if alpha == 0:
+            v = a
+        elif l_norm == 1:
+            v = np.sign(a) * np.maximum(np.abs(a) - alpha / rho, 0.0)
+        else:
+            v = rho * a / (rho + 2.0 * alpha)
+
+        if non_negative:
+            v = np.maximum(v, 0.0)
+
+        return v
+
+    return prox
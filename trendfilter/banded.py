@@ -0,0 +1,300 @@
+"""
+A direct banded solver for L2 trend filtering
+
+With l_norm=2 the regularization is quadratic. The Huber loss is handled
+with iteratively re-weighted least squares, each step of which solves
+    (W + alpha_1 D1'D1 + alpha_2 D2'D2) base = W y - g
+a pentadiagonal system, with solveh_banded. W weights the points in the
+quadratic part of the Huber loss and g is the constant gradient of the
+points in the linear part. Linear deviations are
+eliminated with a Schur complement, which is formed densely for a few
+deviation variables and solved with conjugate gradients, one banded
+solve per product, when there are many. The bands of D1'D1 and D2'D2 only
+depend on the x grid and are cached.
+"""
+
+import numpy as np
+from scipy.linalg import solveh_banded, cholesky_banded, cho_solve_banded
+from scipy.sparse import csc_matrix, hstack
+from scipy.sparse.linalg import LinearOperator, cg
+from trendfilter.derivatives import get_operators
+from trendfilter.hashing import memoize_on_array
+from trendfilter.numeric import huber
+
+BANDWIDTH = 2
+
+# the default number of deviation variables above which the
+# Schur complement is solved iteratively rather than formed
+MAX_DENSE_DEVIATIONS = 50
+
+
+@memoize_on_array()
+def get_penalty_bands(x):
+    """
+    The upper bands of D1'D1 and D2'D2 for the x grid, in the form
+    used by scipy.linalg.solveh_banded. Cached per x grid.
+    D1 includes the 1/dx of first_derv_nes and D2 is scale free
+    as in get_reg.
+    :param x: The x-value, numpy array
+    :return: (d1 bands, d2 bands) each of shape (3, n)
+    """
+    return get_penalty_bands_from_operators(get_operators(np.asarray(x, dtype=float)))
+
+
+def get_penalty_bands_from_operators(operators):
+    """
+    The upper bands of D1'D1 and D2'D2, not cached
+    :param operators: dict of 'd1' and 'd2' matrices, see get_operators
+    :return: (d1 bands, d2 bands) each of shape (3, n)
+    """
+    d1 = operators['d1']
+    d2 = operators['d2']
+    return sparse_to_upper_bands(d1.T @ d1), sparse_to_upper_bands(d2.T @ d2)
+
+
+def sparse_to_upper_bands(matrix, bandwidth=BANDWIDTH):
+    """
+    Convert a symmetric banded sparse matrix to upper banded form
+    :param matrix: scipy sparse matrix
+    :param bandwidth: number of super-diagonals
+    :return: numpy array of shape (bandwidth + 1, n)
+    """
+    matrix = csc_matrix(matrix)
+    n = matrix.shape[0]
+    bands = np.zeros((bandwidth + 1, n))
+    for k in range(bandwidth + 1):
+        bands[bandwidth - k, k:] = matrix.diagonal(k)
+
+    return bands
+
+
+def banded_matvec(bands, vector):
+    """
+    Multiply a symmetric matrix in upper banded form with a vector
+    :param bands: numpy array of shape (bandwidth + 1, n)
+    :param vector: numpy array of length n
+    :return: numpy array of length n
+    """
+    bandwidth = bands.shape[0] - 1
+    result = bands[bandwidth] * vector
+    for k in range(1, bandwidth + 1):
+        upper = bands[bandwidth - k, k:]
+        result[:-k] += upper * vector[k:]
+        result[k:] += upper * vector[:-k]
+
+    return result
+
+
+def banded_trend_filter(x, y, isig, alpha_1=0.0, alpha_2=0.0, l_norm=2,
+                        constrain_zero=False, monotonic=False, positive=False,
+                        linear_deviations=None, max_iter=200, tol=1e-10,
+                        warm_start=None, operators=None,
+                        max_dense_deviations=MAX_DENSE_DEVIATIONS):
+    """
+    Solve the L2 trend filter problem with re-weighted banded solves.
+    Each iteration is a Newton step for the Huber loss, which weights
+    the points in its quadratic part, with a backtracking line search.
+    It stops once the set of points in the quadratic part is stable.
+    :param x: The x-value, numpy array, sorted
+    :param y: The y variable, numpy array
+    :param isig: inverse sigma from get_isig
+    :param alpha_1: Regularization against non-zero slope
+    :param alpha_2: Regularization against changing slope
+    :param l_norm: must be 2
+    :param constrain_zero: If True constrains the model to be zero at origin.
+        Not supported with linear deviations.
+    :param monotonic: not supported, use the admm engine
+    :param positive: not supported, use the admm engine
+    :param linear_deviations: list of completed linear deviations (no variables needed)
+    :param max_iter: maximum number of IRLS iterations
+    :param tol: relative tolerance on the change in the model
+    :param warm_start: None or an array of initial base model values
+    :param operators: optional dict of 'd1' and 'd2' matrices for x,
+        see get_operators. Otherwise the cached bands for x are used.
+    :param max_dense_deviations: with more deviation variables than this
+        the Schur complement is solved with conjugate gradients
+    :return: dict with base_model, deviation_values and the solver info
+    """
+    assert l_norm == 2, 'The banded engine is for l_norm=2 only'
+    assert not monotonic, 'The banded engine does not support monotonic, use admm'
+    assert not positive, 'The banded engine does not support positive, use admm'
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    isig = np.asarray(isig, dtype=float)
+    n = len(x)
+
+    if operators is None:
+        d1_bands, d2_bands = get_penalty_bands(x)
+    else:
+        d1_bands, d2_bands = get_penalty_bands_from_operators(operators)
+    penalty_bands = alpha_1 * d1_bands + alpha_2 * d2_bands
+
+    assert not (constrain_zero and linear_deviations), \
+        'The banded engine does not support constrain_zero with linear deviations, use admm'
+
+    if linear_deviations:
+        dev_matrix = hstack([lin_dev['matrix'] for lin_dev in linear_deviations], format='csc')
+        dev_alphas = np.concatenate([np.full(lin_dev['n_vars'], lin_dev['alpha'])
+                                     for lin_dev in linear_deviations])
+    else:
+        dev_matrix = None
+        dev_alphas = None
+
+    # the base model is fixed to zero at the origin if constrain_zero
+    # so that point is dropped from the system
+    start = 1 if constrain_zero else 0
+
+    # a tiny ridge keeps the system positive definite when
+    # almost every point is in the linear part of the Huber loss
+    ridge = 1e-12 * (1.0 + penalty_bands[BANDWIDTH].max() + (isig ** 2).max())
+
+    n_dev_vars = 0 if dev_matrix is None else dev_matrix.shape[1]
+    if warm_start is None:
+        base_model = np.zeros(n)
+        deviation_values = np.zeros(n_dev_vars)
+        model = y.copy()
+    else:
+        base_model = np.asarray(warm_start, dtype=float).copy()
+        if constrain_zero:
+            base_model[0] = 0.0
+        deviation_values = np.zeros(n_dev_vars)
+        model = base_model.copy()
+
+    def objective(base, devs):
+        value = np.sum(huber(isig * (_model(base, devs, dev_matrix) - y)))
+        value += base @ banded_matvec(penalty_bands, base)
+        if dev_alphas is not None:
+            value += np.sum(dev_alphas * devs ** 2)
+        return value
+
+    current = np.inf if warm_start is None else objective(base_model, deviation_values)
+    converged = False
+    iteration = 0
+    in_quad = None
+
+    for iteration in range(1, max_iter + 1):
+        resid = isig * (model - y)
+        in_quad_prev = in_quad
+        in_quad = np.abs(resid) <= 1.0
+
+        # Newton step for the Huber loss: quadratic points are weighted,
+        # points in the linear part only contribute a constant gradient
+        weights = np.where(in_quad, isig ** 2, 0.0)
+        rhs = weights * y - np.where(in_quad, 0.0, isig * np.sign(resid))
+
+        bands = penalty_bands[:, start:].copy()
+        bands[BANDWIDTH] += weights[start:] + ridge
+
+        new_base = np.zeros(n)
+        if dev_matrix is None:
+            new_base[start:] = solveh_banded(bands, rhs[start:], check_finite=False)
+            new_devs = deviation_values
+        elif n_dev_vars <= max_dense_deviations:
+            new_base[start:], new_devs = \
+                _solve_with_deviations(bands, rhs, weights, dev_matrix, dev_alphas, start)
+        else:
+            new_base[start:], new_devs = \
+                _solve_with_deviations_cg(bands, rhs, weights, dev_matrix, dev_alphas + ridge,
+                                          start, deviation_values)
+
+        # backtrack if the full step doesn't decrease the objective
+        step = 1.0
+        value = objective(new_base, new_devs)
+        while value > current and step > 1e-8:
+            step /= 2.0
+            value = objective(base_model + step * (new_base - base_model),
+                              deviation_values + step * (new_devs - deviation_values))
+
+        change = np.linalg.norm(step * (new_base - base_model))
+        base_model = base_model + step * (new_base - base_model)
+        deviation_values = deviation_values + step * (new_devs - deviation_values)
+        model = _model(base_model, deviation_values, dev_matrix)
+        current = value
+
+        same_regions = in_quad_prev is not None and np.array_equal(in_quad, in_quad_prev)
+        if (same_regions and step == 1.0) or change <= tol * (np.linalg.norm(base_model) + tol):
+            converged = True
+            break
+
+    splits = np.cumsum([lin_dev['n_vars'] for lin_dev in linear_deviations])[:-1]
+    info = {'iterations': iteration,
+            'converged': converged,
+            'objective': float(current),
+            'n_outliers': int(np.sum(np.abs(isig * (model - y)) > 1.0))}
+
+    return {'base_model': base_model,
+            'deviation_values': np.split(deviation_values, splits) if linear_deviations else [],
+            'solver_info': info}
+
+
+def _model(base_model, deviation_values, dev_matrix):
+    if dev_matrix is None:
+        return base_model
+
+    return base_model + dev_matrix @ deviation_values
+
+
+def _solve_with_deviations(bands, rhs, weights, dev_matrix, dev_alphas, start):
+    """
+    Solve the arrow shaped system for the base model and deviations
+        [B       W M      ] [base]   [W y  ]
+        [M' W    M'W M + A] [c   ] = [M'W y]
+    by eliminating the base model
+    """
+    weighted = dev_matrix.multiply(weights[:, None]).tocsc()
+    coupling = weighted[start:].toarray()
+
+    solved = solveh_banded(bands, np.column_stack([rhs[start:], coupling]),
+                           check_finite=False)
+    base_rhs = solved[:, 0]
+    base_coupling = solved[:, 1:]
+
+    schur = (dev_matrix.T @ weighted).toarray() + np.diag(dev_alphas) - coupling.T @ base_coupling
+    schur_rhs = dev_matrix.T @ rhs - coupling.T @ base_rhs
+
+    deviation_values = np.linalg.lstsq(schur, schur_rhs, rcond=None)[0]
+    base_model = base_rhs - base_coupling @ deviation_values
+
+    return base_model, deviation_values
+
+
+def _solve_with_deviations_cg(bands, rhs, weights, dev_matrix, dev_alphas, start, initial):
+    """
+    The same system as _solve_with_deviations, with the Schur complement
+        S = M'W M + A - M'W B^-1 W M
+    applied as an operator and solved with Jacobi preconditioned
+    conjugate gradients, so there is no dense matrix in the deviations
+    """
+    factor = (cholesky_banded(bands, check_finite=False), False)
+    weighted = dev_matrix.multiply(weights[:, None]).tocsr()
+    coupling = weighted[start:]
+    coupling_t = coupling.T.tocsr()
+    dev_matrix_t = dev_matrix.T.tocsr()
+
+    base_rhs = cho_solve_banded(factor, rhs[start:], check_finite=False)
+
+    def schur_matvec(values):
+        values = np.ravel(values)
+        base_coupling = cho_solve_banded(factor, coupling @ values, check_finite=False)
+        return dev_matrix_t @ (weighted @ values) + dev_alphas * values - \
+            coupling_t @ base_coupling
+
+    n_dev_vars = len(dev_alphas)
+    diagonal = np.asarray(dev_matrix.multiply(weighted).sum(axis=0)).ravel() + dev_alphas
+    diagonal = np.maximum(diagonal, 1e-12 * (1.0 + diagonal.max()))
+
+    schur = LinearOperator((n_dev_vars, n_dev_vars), matvec=schur_matvec, dtype=float)
+    preconditioner = LinearOperator((n_dev_vars, n_dev_vars), matvec=lambda v: v / diagonal,
+                                    dtype=float)
+    schur_rhs = dev_matrix_t @ rhs - coupling_t @ base_rhs
+
+    deviation_values = cg(schur, schur_rhs, x0=initial, rtol=1e-10, atol=0.0,
+                          maxiter=10 * n_dev_vars, M=preconditioner)[0]
+    base_model = base_rhs - cho_solve_banded(factor, coupling @ deviation_values,
+                                             check_finite=False)
+
+    return base_model, deviation_values
@@ -0,0 +1,197 @@
+"""
+Fit many independent series in one call
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from trendfilter.compiled import get_compiled_trend_filter
+from trendfilter.hashing import hash_array
+from trendfilter.linear_deviations import matrix_only_deviations
+
+OK_STATUSES = ['optimal', 'optimal_inaccurate']
+
+
+def trend_filter_batch(xs, ys, y_errs=None, alpha_1=0.0,
+                       alpha_2=0.0, l_norm=2,
+                       constrain_zero=False, monotonic=False,
+                       positive=False,
+                       linear_deviations=None,
+                       solver='ECOS',
+                       n_jobs=1, chunk_size=None):
+    """
+    Fit many independent series with the same options.
+    Series which share an x grid share one compiled problem
+    so only the parameters change between fits.
+    :param xs: a single x array shared by all series, a 2-D array
+        with one row per series or a list of (possibly ragged) x arrays
+    :param ys: 2-D array with one row per series or a list of y arrays
+    :param y_errs: None, or like ys
+    :param alpha_1: see trend_filter
+    :param alpha_2: see trend_filter
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter. Mappings are turned
+        into matrices here so they don't need to be picklable.
+    :param solver: see trend_filter
+    :param n_jobs: number of worker processes. 1 runs in this process,
+        -1 uses all cores.
+    :param chunk_size: number of series sent to a worker at a time.
+        Defaults to spreading each grid over about 4 chunks per worker.
+    :return: list of per-series result dicts in the input order with
+        keys index, status, error, y_fit, base_model, deviations,
+        objective and solver_status. status is 'ok', 'failed' (solver didn't
+        converge) or 'error' (an exception, see error)
+    """
+    n_series = len(ys)
+    xs = _broadcast_xs(xs, n_series)
+
+    if y_errs is None:
+        y_errs = [None] * n_series
+
+    assert len(xs) == n_series
+    assert len(y_errs) == n_series
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    assert n_jobs >= 1
+
+    options = {'alpha_1': alpha_1, 'alpha_2': alpha_2, 'l_norm': l_norm,
+               'constrain_zero': constrain_zero, 'monotonic': monotonic,
+               'positive': positive, 'solver': solver}
+
+    tasks = []
+    results = [None] * n_series
+    for x, indices in group_by_grid(xs):
+        try:
+            lin_devs = matrix_only_deviations(linear_deviations, x)
+        except Exception as error:
+            for index in indices:
+                results[index] = _error_result(index, error)
+            continue
+
+        if chunk_size is None:
+            size = max(1, int(np.ceil(len(indices) / (4.0 * n_jobs))))
+        else:
+            size = chunk_size
+
+        for start in range(0, len(indices), size):
+            chunk = indices[start:start + size]
+            tasks.append((x, [ys[i] for i in chunk], [y_errs[i] for i in chunk],
+                          chunk, lin_devs, options))
+
+    if n_jobs == 1:
+        for task in tasks:
+            for result in fit_chunk(*task):
+                results[result['index']] = result
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [(task, executor.submit(fit_chunk, *task)) for task in tasks]
+            for task, future in futures:
+                try:
+                    chunk_results = future.result()
+                except Exception as error:
+                    chunk_results = [_error_result(index, error) for index in task[3]]
+
+                for result in chunk_results:
+                    results[result['index']] = result
+
+    return results
+
+
+def group_by_grid(xs):
+    """
+    Group series by their x grid
+    :param xs: list of x arrays
+    :return: list of (x, list of indices) tuples, one per distinct grid
+    """
+    groups = {}
+    grids = {}
+    for index, x in enumerate(xs):
+        x = np.asarray(x, dtype=float)
+        key = hash_array(x)
+        if key not in groups:
+            groups[key] = []
+            grids[key] = x
+        groups[key].append(index)
+
+    return [(grids[key], indices) for key, indices in groups.items()]
+
+
+def fit_chunk(x, ys, y_errs, indices, linear_deviations, options):
+    """
+    Fit a chunk of series that share the same x grid.
+    Runs in a worker process.
+    :return: list of per-series result dicts
+    """
+    x = np.asarray(x, dtype=float)
+    results = []
+    try:
+        compiled = get_compiled_trend_filter(x, l_norm=options['l_norm'],
+                                             constrain_zero=options['constrain_zero'],
+                                             monotonic=options['monotonic'],
+                                             positive=options['positive'],
+                                             linear_deviations=linear_deviations)
+    except Exception as error:
+        return [_error_result(index, error) for index in indices]
+
+    for index, y, y_err in zip(indices, ys, y_errs):
+        try:
+            tf_result = compiled.solve(y, y_err=y_err,
+                                       alpha_1=options['alpha_1'],
+                                       alpha_2=options['alpha_2'],
+                                       linear_deviations=linear_deviations,
+                                       solver=options['solver'])
+            solver_status = compiled.problem.status
+            if solver_status in OK_STATUSES:
+                status = 'ok'
+                error = None
+            else:
+                status = 'failed'
+                error = 'solver status: %s' % solver_status
+
+            deviations = {lin_dev['name']: _copy(lin_dev['variable'].value)
+                          for lin_dev in tf_result['linear_deviations']}
+
+            results.append({'index': index,
+                            'status': status,
+                            'error': error,
+                            'y_fit': _copy(tf_result['y_fit']),
+                            'base_model': _copy(tf_result['base_model'].value),
+                            'deviations': deviations,
+                            'objective': compiled.problem.value,
+                            'solver_status': solver_status})
+        except Exception as error:
+            results.append(_error_result(index, error))
+
+    return results
+
+
+def _broadcast_xs(xs, n_series):
+    if isinstance(xs, np.ndarray) and xs.ndim == 1:
+        return [xs] * n_series
+
+    return list(xs)
+
+
+def _copy(value):
+    if value is None:
+        return None
+    return np.array(value, copy=True)
+
+
+def _error_result(index, error):
+    return {'index': index,
+            'status': 'error',
+            'error': '%s: %s' % (type(error).__name__, error),
+            'y_fit': None,
+            'base_model': None,
+            'deviations': {},
+            'objective': None,
+            'solver_status': None}
@@ -0,0 +1,285 @@
+"""
+Bootstrap uncertainty bands for the fitted trend
+
+The point fit is resampled by adding its residuals back on, either
+independently (residual) or in contiguous blocks (block), which keeps
+their autocorrelation. The residuals are scaled by the inverse sigma so
+points with different y_err are exchangeable. Missing points, NaN in y
+or y_err, are left out of the resampling and stay missing in every
+replicate, so their bands are those of the model filling the gap.
+Each replicate is refit with one of the engines, warm-started from the
+point fit, and evaluated on the fitted x and on any new x, in and
+beyond the data, with one sparse product per batch of replicates.
+Replicate i always uses the same random numbers and the batches are
+added in order, so the result, even when stopped early, doesn't depend
+on n_jobs.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import csr_matrix, hstack, identity
+from trendfilter.engines import trend_filter_engine
+from trendfilter.extrapolate import interpolation_matrix
+from trendfilter.linear_deviations import matrix_only_deviations, build_deviation_matrix, \
+    slice_deviation
+from trendfilter.trendfilter import get_isig, get_mask
+
+
+def resample_residuals(residuals, rng, method='residual', block_size=None):
+    """
+    One bootstrap sample of the residuals
+    :param residuals: numpy array of scaled residuals, in x order
+    :param rng: numpy random Generator
+    :param method: 'residual' to draw each one independently, or 'block'
+        to draw contiguous blocks of them
+    :param block_size: the length of the blocks, defaults to n^(1/3)
+    :return: numpy array like residuals
+    """
+    assert method in ['residual', 'block']
+    n = len(residuals)
+    if method == 'residual':
+        return residuals[rng.integers(0, n, n)]
+
+    if block_size is None:
+        block_size = max(1, int(round(n ** (1.0 / 3))))
+
+    block_size = min(block_size, n)
+    n_blocks = -(-n // block_size)
+    starts = rng.integers(0, n - block_size + 1, n_blocks)
+    index = (starts[:, None] + np.arange(block_size)).ravel()[:n]
+    return residuals[index]
+
+
+def fit_replicates(replicates, x, y_fit, y_err, present, sigma, residuals, options,
+                   matrices, sigma_new, seed, method, block_size, noise):
+    """
+    Fit a batch of bootstrap replicates and evaluate them.
+    Runs in a worker process. The points that aren't present
+    are NaN in the replicates.
+    :return: (replicates, values at x, values at the new x), with one
+        row per replicate
+    """
+    coefficients, noise_x, noise_new = [], [], []
+    for replicate in replicates:
+        rng = np.random.default_rng([seed, replicate])
+        y_sample = np.full(len(x), np.nan)
+        y_sample[present] = y_fit[present] + sigma[present] * \
+            resample_residuals(residuals, rng, method=method, block_size=block_size)
+        result = trend_filter_engine(x, y_sample, y_err=y_err, **options)
+        coefficients.append(np.concatenate([result['base_model']] +
+                                           [lin_dev['values'] for lin_dev
+                                            in result['linear_deviations']]))
+
+        if noise:
+            noise_x.append(sigma * residuals[rng.integers(0, len(residuals), len(sigma))])
+            noise_new.append(sigma_new * residuals[rng.integers(0, len(residuals),
+                                                                len(sigma_new))])
+
+    # one product evaluates every replicate in the batch
+    coefficients = np.array(coefficients)
+    fits = (matrices['x'] @ coefficients.T).T
+    fits_new = (matrices['x_new'] @ coefficients.T).T
+    if noise:
+        fits += np.array(noise_x)
+        fits_new += np.array(noise_new)
+
+    return list(replicates), fits, fits_new
+
+
+def iter_bootstrap(x, y, y_err=None, x_new=None, n_replicates=200, method='residual',
+                   block_size=None, quantiles=(0.025, 0.5, 0.975), noise=False,
+                   seed=0, n_jobs=1, batch_size=10, alpha_1=0.0, alpha_2=0.0,
+                   l_norm=2, constrain_zero=False, monotonic=False, positive=False,
+                   linear_deviations=None, engine=None, engine_options=None):
+    """
+    Run the bootstrap, yielding the bands so far after each batch
+    of replicates, in batch order. Stop iterating to stop the bootstrap
+    early.
+    See trend_filter_bootstrap for the parameters.
+    :return: generator of dicts as returned by trend_filter_bootstrap,
+        with n_replicates the number done so far
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if engine_options is None:
+        engine_options = {}
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if engine is None:
+        banded_ok = l_norm == 2 and not monotonic and not positive and \
+            not (constrain_zero and linear_deviations)
+        engine = 'banded' if banded_ok else 'admm'
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    y_err = np.ones(n) if y_err is None else np.asarray(y_err, dtype=float)
+
+    order = np.argsort(x, kind='stable')
+    lin_devs = [slice_deviation(lin_dev, order)
+                for lin_dev in matrix_only_deviations(linear_deviations, x)]
+    x, y, y_err = x[order], y[order], y_err[order]
+    x_new = np.zeros(0) if x_new is None else np.asarray(x_new, dtype=float).ravel()
+
+    # the deviations' matrices at the new x need their mappings,
+    # the workers only get the matrices
+    matrices_new = [_new_deviation_matrix(linear_deviation, lin_dev['matrix'].shape[1],
+                                          x_new, i)
+                    for i, (linear_deviation, lin_dev)
+                    in enumerate(zip(linear_deviations, lin_devs))]
+
+    options = {'alpha_1': alpha_1, 'alpha_2': alpha_2, 'l_norm': l_norm,
+               'constrain_zero': constrain_zero, 'monotonic': monotonic,
+               'positive': positive, 'linear_deviations': lin_devs, 'engine': engine}
+    point = trend_filter_engine(x, y, y_err=y_err, engine_options=engine_options,
+                                **dict(options, linear_deviations=[
+                                    slice_deviation(lin_dev, order)
+                                    for lin_dev in linear_deviations]))
+
+    info = point['solver_info']
+    warm_start = info['state'] if 'state' in info else point['base_model']
+    options['engine_options'] = dict(engine_options, warm_start=warm_start)
+
+    # the values at x and x_new from the base model and deviation values
+    # stacked end to end
+    matrices = {'x': hstack([identity(n, format='csr')] +
+                            [lin_dev['matrix'] for lin_dev in lin_devs],
+                            format='csr'),
+                'x_new': hstack([interpolation_matrix(x, x_new)] + matrices_new, format='csr')}
+
+    mask = get_mask(y, y_err=y_err)
+    present = np.ones(n, dtype=bool) if mask is None else mask
+    isig = get_isig(y, y_err, mask=mask)[present]
+    residuals = isig * (y[present] - point['y_fit'][present])
+    residuals = residuals - residuals.mean()
+    # missing and new points take the sigma of the nearest x, for the noise
+    sigma = np.interp(x, x[present], 1.0 / isig)
+    sigma_new = np.interp(x_new, x[present], 1.0 / isig)
+
+    batches = [np.arange(start, min(start + batch_size, n_replicates))
+               for start in range(0, n_replicates, batch_size)]
+    tasks = [(batch, x, point['y_fit'], y_err, present, sigma, residuals, options, matrices,
+              sigma_new, seed, method, block_size, noise) for batch in batches]
+
+    fits = np.full((n_replicates, n), np.nan)
+    fits_new = np.full((n_replicates, len(x_new)), np.nan)
+    done = np.zeros(n_replicates, dtype=bool)
+
+    def update(batch_result):
+        replicates, batch_fits, batch_fits_new = batch_result
+        fits[replicates] = batch_fits
+        fits_new[replicates] = batch_fits_new
+        done[replicates] = True
+        return {'x': x,
+                'x_new': x_new,
+                'quantiles': np.array(quantiles),
+                'bands': np.quantile(fits[done], quantiles, axis=0),
+                'bands_new': np.quantile(fits_new[done], quantiles, axis=0),
+                'n_replicates': int(done.sum()),
+                'replicates': fits[done],
+                'replicates_new': fits_new[done],
+                'point': point}
+
+    if n_jobs == 1:
+        for task in tasks:
+            yield update(fit_replicates(*task))
+        return
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        futures = [executor.submit(fit_replicates, *task) for task in tasks]
+        # in batch order, not as they finish, so an early stop keeps
+        # the same replicates however many workers there are
+        for future in futures:
+            yield update(future.result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def trend_filter_bootstrap(x, y, y_err=None, x_new=None, n_replicates=200,
+                           method='residual', block_size=None,
+                           quantiles=(0.025, 0.5, 0.975), noise=False, seed=0,
+                           n_jobs=1, batch_size=10, tol=None, callback=None,
+                           alpha_1=0.0, alpha_2=0.0, l_norm=2, constrain_zero=False,
+                           monotonic=False, positive=False, linear_deviations=None,
+                           engine=None, engine_options=None):
+    """
+    Bootstrap quantile bands of the fitted trend
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param x_new: optional numpy array of other x to get bands at,
+        e.g. beyond max(x) for the extrapolation
+    :param n_replicates: number of bootstrap replicates
+    :param method: 'residual' or 'block', see resample_residuals
+    :param block_size: see resample_residuals
+    :param quantiles: the quantiles of the bands
+    :param noise: If True, add resampled residuals to each replicate so the
+        bands are for new data rather than the trend. At x_new they are
+        scaled by the sigma of the nearest x.
+    :param seed: the seed for the replicates, each uses (seed, replicate)
+    :param n_jobs: number of worker processes. 1 runs in this process,
+        -1 uses all cores.
+    :param batch_size: number of replicates sent to a worker at a time,
+        and between updates of the bands
+    :param tol: optional, stop once no band has moved by more than tol
+        times the range of y since the last update
+    :param callback: optional function called with the results so far
+        after each batch. Return True to stop.
+    :param alpha_1: see trend_filter
+    :param alpha_2: see trend_filter
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter. Deviations without a mapping
+        can't be evaluated at x_new.
+    :param engine: one of the ENGINES. Defaults to 'banded' where it supports
+        the options, otherwise 'admm'
+    :param engine_options: dict of keyword arguments for the engine
+    :return: dict with x (sorted) and x_new, quantiles, bands and bands_new
+        (one row per quantile), n_replicates, the replicates and
+        replicates_new (one row per replicate) and the point fit
+    """
+    # missing points may be NaN
+    y_range = float(np.nanmax(y) - np.nanmin(y)) or 1.0
+    result = None
+    for update in iter_bootstrap(x, y, y_err=y_err, x_new=x_new, n_replicates=n_replicates,
+                                 method=method, block_size=block_size, quantiles=quantiles,
+                                 noise=noise, seed=seed, n_jobs=n_jobs,
+                                 batch_size=batch_size, alpha_1=alpha_1, alpha_2=alpha_2,
+                                 l_norm=l_norm, constrain_zero=constrain_zero,
+                                 monotonic=monotonic, positive=positive,
+                                 linear_deviations=linear_deviations, engine=engine,
+                                 engine_options=engine_options):
+        stable = tol is not None and result is not None and \
+            _max_change(result, update) <= tol * y_range
+        result = update
+
+        if stable or (callback is not None and callback(update)):
+            break
+
+    return result
+
+
+def _max_change(previous, current):
+    changes = [np.abs(current[name] - previous[name]).max()
+               for name in ['bands', 'bands_new'] if current[name].size]
+    return max(changes)
+
+
+def _new_deviation_matrix(linear_deviation, n_vars, x_new, index):
+    if not len(x_new):
+        return csr_matrix((0, n_vars))
+
+    if 'mapping' not in linear_deviation:
+        name = linear_deviation.get('name', 'linear_deviation_%s' % index)
+        raise ValueError("Linear deviation '%s' has no mapping so can't be evaluated "
+                         "at x_new" % name)
+
+    return build_deviation_matrix({'mapping': linear_deviation['mapping'],
+                                   'n_vars': n_vars}, x_new)
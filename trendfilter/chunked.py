@@ -0,0 +1,503 @@
+"""
+Out-of-core fitting of very long series in overlapping windows
+
+The x grid is split into chunks. Each chunk is fit on a window that
+extends it by `overlap` points on each side, so the windows can be
+fit independently and in parallel. The solutions are then blended
+across the overlaps with weights ramping linearly from one window
+to the next. Linear deviations are shared by the whole series, so
+after a first pass they are solved for globally from normal equations
+summed over the chunks, and the windows refit with them held fixed.
+The workers read their windows from the memory-mapped inputs and each
+fit is folded into the sums or the output as it arrives, so only a
+few windows are held in memory at once.
+
+Error versus the monolithic fit: the effect of cutting the series at
+a window edge dies away with the distance from the edge. For l_norm=2
+the solution is a linear smoother whose weights decay exponentially,
+with a length scale of order (alpha_2 * y_err ** 2) ** 0.25 in units
+of x. The blend only uses points at least overlap / 2 from a window
+edge, so the error is bounded by C exp(-overlap * spacing / (2 * length)).
+For l_norm=1 the same holds away from knots near the edges. The
+largest difference between neighbouring windows where they're blended
+is reported as an a posteriori estimate of the stitching error; make
+the overlap larger if it is too big.
+"""
+
+import os
+import mmap
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import diags, hstack
+from trendfilter.derivatives import get_operators
+from trendfilter.linear_deviations import complete_linear_deviations, slice_deviation
+from trendfilter.trendfilter import get_mask
+
+
+def open_array(array):
+    """
+    Open an array without reading it into memory
+    :param array: numpy array, np.memmap, or the path of a .npy file
+    :return: numpy array or memmap
+    """
+    if isinstance(array, (str, os.PathLike)):
+        return np.load(array, mmap_mode='r')
+
+    return array
+
+
+def share_array(array, start=0, stop=None):
+    """
+    What to send to a worker process so it can read array[start:stop].
+    A .npy file or a memmap is described by its file, offset, dtype and
+    shape, so the worker maps it again and nothing is copied. Anything
+    else is sent as the slice alone.
+    :param array: numpy array, np.memmap, or the path of a .npy file
+    :param start: the first element
+    :param stop: one past the last element, defaults to the end
+    :return: dict for read_array
+    """
+    array = open_array(array)
+    # a slice of a memmap has its parent's offset, so only a whole mapping is described
+    if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap):
+        order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+        return {'filename': array.filename, 'offset': array.offset,
+                'dtype': array.dtype.str, 'shape': array.shape, 'order': order,
+                'start': start, 'stop': stop}
+
+    return {'array': array[start:stop]}
+
+
+def read_array(shared):
+    """
+    Read an array described by share_array, without reading a memmap
+    into memory
+    :param shared: dict from share_array
+    :return: numpy array or memmap
+    """
+    if 'array' in shared:
+        return shared['array']
+
+    mapped = np.memmap(shared['filename'], dtype=shared['dtype'], mode='r',
+                       offset=shared['offset'], shape=shared['shape'], order=shared['order'])
+    return mapped[shared['start']:shared['stop']]
+
+
+def get_windows(n, chunk_size, overlap):
+    """
+    The chunks and their windows
+    :param n: number of points
+    :param chunk_size: number of points per chunk
+    :param overlap: number of points each window extends past its chunk
+    :return: list of (window start, window stop, chunk start, chunk stop)
+    """
+    assert chunk_size > 2 * overlap, 'chunk_size must be more than twice the overlap'
+
+    windows = []
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        windows.append((max(start - overlap, 0), min(stop + overlap, n), start, stop))
+
+    # merge a short last chunk into the one before
+    if len(windows) > 1 and windows[-1][3] - windows[-1][2] <= overlap:
+        last = windows.pop()
+        previous = windows.pop()
+        windows.append((previous[0], n, previous[2], last[3]))
+
+    return windows
+
+
+def blend_weights(window, n_points, overlap):
+    """
+    The weight of a window's solution at each of its points. Weights
+    ramp linearly across the middle half of each overlap zone, so
+    neighbouring windows sum to one and the points nearest a window's
+    edges, where the cut has the most effect, get zero weight.
+    :param window: (window start, window stop, chunk start, chunk stop)
+    :param n_points: total number of points
+    :param overlap: overlap in points
+    :return: numpy array of weights for the window
+    """
+    window_start, window_stop, chunk_start, chunk_stop = window
+    positions = np.arange(window_start, window_stop)
+    weights = np.ones(len(positions))
+
+    half = overlap // 2
+    ramp_width = 2.0 * half + 1
+    if chunk_start > 0:
+        weights = np.minimum(weights, (positions - (chunk_start - half) + 1) / ramp_width)
+    if chunk_stop < n_points:
+        weights = np.minimum(weights, ((chunk_stop + half) - positions) / ramp_width)
+
+    return np.clip(weights, 0.0, 1.0)
+
+
+def get_buffer(y, chunk_size=1000000):
+    """
+    The buffer added to the errors in quadrature, as in get_isig,
+    0.01 * median(abs(y)) over the whole series. Reads y a chunk at a
+    time and never holds more than a chunk of it, see median_abs.
+    :param y: numpy array or memmap
+    :param chunk_size: number of points read at a time
+    :return: float
+    """
+    # missing points are NaN
+    if len(y) <= chunk_size:
+        return 0.01 * float(np.nanmedian(np.abs(y)))
+
+    return 0.01 * median_abs(y, chunk_size=chunk_size)
+
+
+def median_abs(y, chunk_size=1000000, n_bins=1024):
+    """
+    The exact median of abs(y), ignoring NaN, reading y a chunk at a time.
+    Each pass counts the values in a histogram and narrows the range to
+    the bin holding the median, until that bin has no more than a chunk
+    of values, which are then read and sorted.
+    :param y: numpy array or memmap
+    :param chunk_size: number of points read at a time
+    :param n_bins: number of bins per pass
+    :return: float
+    """
+    def chunks():
+        for start in range(0, len(y), chunk_size):
+            values = np.abs(np.asarray(y[start:start + chunk_size], dtype=float))
+            yield values[np.isfinite(values)]
+
+    n_finite = 0
+    low, high = np.inf, -np.inf
+    for values in chunks():
+        if len(values):
+            n_finite += len(values)
+            low, high = min(low, values.min()), max(high, values.max())
+
+    assert n_finite, 'No points to fit'
+
+    # the middle one, or the mean of the middle two
+    ranks = sorted({(n_finite - 1) // 2, n_finite // 2})
+    return float(np.mean([_order_statistic(chunks, rank, low, high, chunk_size, n_bins)
+                          for rank in ranks]))
+
+
+def _order_statistic(chunks, rank, low, high, chunk_size, n_bins):
+    # the values in [low, high), or [low, high] for the last bin, with
+    # `below` of them less than low
+    below = 0
+    closed = True
+    while np.nextafter(low, np.inf) < high:
+        edges = np.linspace(low, high, n_bins + 1)
+        counts = np.zeros(n_bins, dtype=np.int64)
+        for values in chunks():
+            values = _in_range(values, low, high, closed)
+            bins = np.minimum(np.searchsorted(edges, values, side='right') - 1, n_bins - 1)
+            counts += np.bincount(bins, minlength=n_bins)
+
+        cumulative = below + np.cumsum(counts)
+        chosen = int(np.searchsorted(cumulative, rank, side='right'))
+        below = int(cumulative[chosen] - counts[chosen])
+        closed = closed and chosen == n_bins - 1
+        low, high = edges[chosen], edges[chosen + 1]
+
+        if counts[chosen] <= chunk_size:
+            values = np.sort(np.concatenate([_in_range(values, low, high, closed)
+                                             for values in chunks()]))
+            return values[rank - below]
+
+    # more than a chunk of the same value, the range is low and maybe high
+    n_low = sum(int(np.sum(values == low)) for values in chunks())
+    return low if rank < below + n_low else high
+
+
+def _in_range(values, low, high, closed):
+    if closed:
+        return values[(values >= low) & (values <= high)]
+    return values[(values >= low) & (values < high)]
+
+
+def fit_window(x, y, y_err, window, linear_deviations, consensus_values, buffer, options):
+    """
+    Fit one window. Runs in a worker process.
+    :param x: the window's x, see share_array
+    :param y: the window's y, see share_array
+    :param y_err: None, or the window's y_err, see share_array
+    :param window: (window start, window stop, chunk start, chunk stop)
+    :param linear_deviations: linear deviations, matrices sliced to the window
+    :param consensus_values: None to fit the deviations in the window,
+        otherwise a list of their values, held fixed
+    :param buffer: the buffer for the inverse sigmas, see get_buffer
+    :param options: engine, engine_options and the trend_filter options
+    :return: dict with the window, base_model, y_fit, deviation values,
+        solver_info and seconds. With consensus_values, also the
+        normal equations for the deviations over the chunk.
+    """
+    # imported here so the workers only load what the engine needs
+    from trendfilter.engines import ENGINES
+
+    start = time.perf_counter()
+    window_start, window_stop, chunk_start, chunk_stop = window
+    x = np.asarray(read_array(x), dtype=float)
+    y = np.asarray(read_array(y), dtype=float)
+    if y_err is None:
+        y_err = np.ones(len(x))
+    else:
+        y_err = np.asarray(read_array(y_err), dtype=float)
+
+    # missing points get zero weight, as in get_isig
+    mask = get_mask(y, y_err=y_err)
+    isig = 1 / np.sqrt(buffer ** 2 + y_err ** 2)
+    if mask is not None:
+        isig = np.where(mask, isig, 0.0)
+        y = np.where(mask, y, 0.0)
+
+    options = dict(options)
+    engine = options.pop('engine')
+    engine_options = options.pop('engine_options') or {}
+
+    lin_devs = complete_linear_deviations(linear_deviations, x, with_variables=False)
+    offset = np.zeros(len(x))
+    if consensus_values is not None:
+        for lin_dev, values in zip(lin_devs, consensus_values):
+            offset += lin_dev['matrix'] @ values
+
+    solution = ENGINES[engine](x, y - offset, isig,
+                               linear_deviations=[] if consensus_values is not None else lin_devs,
+                               operators=get_operators(x), **options, **engine_options)
+
+    base_model = np.asarray(solution['base_model'], dtype=float)
+    fit = {'window': window,
+           'base_model': base_model,
+           'solver_info': solution['solver_info']}
+
+    if consensus_values is None:
+        deviation_values = solution['deviation_values']
+        fit['y_fit'] = base_model + sum((lin_dev['matrix'] @ values
+                                         for lin_dev, values in zip(lin_devs, deviation_values)),
+                                        np.zeros(len(x)))
+    else:
+        deviation_values = consensus_values
+        fit['y_fit'] = base_model + offset
+
+        # iteratively reweighted normal equations of the Huber loss for
+        # the deviations, over the chunk only so each point counts once
+        core = slice(chunk_start - window_start, chunk_stop - window_start)
+        scaled = np.abs(isig[core] * (fit['y_fit'][core] - y[core]))
+        weights = isig[core] ** 2 * np.minimum(1.0, 1.0 / np.maximum(scaled, 1e-12))
+        dev_matrix = hstack([lin_dev['matrix'][core] for lin_dev in lin_devs], format='csr')
+        fit['normal_matrix'] = (dev_matrix.T @ diags(weights) @ dev_matrix).toarray()
+        fit['normal_rhs'] = dev_matrix.T @ (weights * (y[core] - base_model[core]))
+
+    fit['deviations'] = {lin_dev['name']: np.array(values)
+                         for lin_dev, values in zip(lin_devs, deviation_values)}
+    fit['seconds'] = time.perf_counter() - start
+    return fit
+
+
+def update_consensus(normal_matrix, normal_rhs, linear_deviations, values, l_norm):
+    """
+    Solve for the deviations given the base models of the windows,
+    one reweighted least squares step
+    :param normal_matrix: the windows' normal matrices summed
+    :param normal_rhs: the windows' normal right hand sides summed
+    :param linear_deviations: completed linear deviations
+    :param values: list of the current deviation values
+    :param l_norm: 1 or 2, the norm of the deviation regularization
+    :return: list of the new deviation values
+    """
+    alphas = np.concatenate([np.full(lin_dev['n_vars'], lin_dev['alpha'])
+                             for lin_dev in linear_deviations])
+    if l_norm == 1:
+        # alpha |v| is reweighted as alpha v^2 / (2 |v|)
+        alphas = alphas / (2 * np.maximum(np.abs(np.concatenate(values)), 1e-8))
+
+    solution = np.linalg.solve(normal_matrix + np.diag(alphas), normal_rhs)
+
+    new_values = []
+    start = 0
+    for lin_dev in linear_deviations:
+        new = solution[start:start + lin_dev['n_vars']]
+        if lin_dev['positive']:
+            new = np.maximum(new, 0.0)
+        new_values.append(new)
+        start += lin_dev['n_vars']
+
+    return new_values
+
+
+def trend_filter_chunked(x, y, y_err=None, alpha_1=0.0, alpha_2=0.0, l_norm=2,
+                         constrain_zero=False, monotonic=False, positive=False,
+                         linear_deviations=None, engine=None, engine_options=None,
+                         chunk_size=100000, overlap=1000, consensus_rounds=5,
+                         n_jobs=1, buffer=None, out=None):
+    """
+    Fit a long series in overlapping windows and stitch them together
+    :param x: The x-value, numpy array, np.memmap or path of a .npy file, sorted
+    :param y: The y variable, same types as x. Points where y or y_err
+        is NaN are missing, as in trend_filter.
+    :param y_err: None, or same types as x
+    :param alpha_1: see trend_filter
+    :param alpha_2: see trend_filter
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter, applies to the first window
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter. The deviations are shared by
+        all the windows. They are first fit in each window and averaged,
+        then alternately solved for over the whole series and held fixed
+        while the windows are refit. Mappings must be picklable for
+        n_jobs > 1, matrices and indices are sliced for each window.
+    :param engine: one of the ENGINES. Defaults to 'banded' where it supports
+        the options, otherwise 'admm'
+    :param engine_options: dict of keyword arguments for the engine
+    :param chunk_size: number of points per chunk
+    :param overlap: number of points each window extends past its chunk
+    :param consensus_rounds: number of rounds of refitting the windows
+        with the shared deviations, if there are any. There is always at
+        least one, so the windows use the deviation values reported.
+    :param n_jobs: number of worker processes. 1 runs in this process,
+        -1 uses all cores.
+    :param buffer: the buffer added to the errors in quadrature, see get_isig.
+        Defaults to 0.01 * median(abs(y)) over the whole series.
+    :param out: optional directory to write base_model.npy and y_fit.npy to,
+        returned as memmaps, so the full solution is never held in memory
+    :return: dict with base_model and y_fit for the whole series,
+        deviations, a dict of the shared deviation values by name,
+        windows, a list of dicts with each window's range, solver_info
+        and seconds, and seams, a list of dicts with the position and
+        the largest difference between neighbouring windows where
+        they're blended
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    assert n_jobs >= 1
+
+    if engine is None:
+        banded_ok = l_norm == 2 and not monotonic and not positive and \
+            not (constrain_zero and linear_deviations)
+        engine = 'banded' if banded_ok else 'admm'
+
+    assert engine != 'cvxpy', 'Use one of the engines that don\'t go through cvxpy'
+
+    n = len(open_array(x))
+    assert len(open_array(y)) == n
+
+    if buffer is None:
+        buffer = get_buffer(open_array(y))
+
+    windows = get_windows(n, chunk_size, overlap)
+
+    # the defaults from complete_linear_deviation, the matrices are built in the windows
+    completed_devs = [dict({'name': 'linear_deviation_%s' % i, 'alpha': 1e-3, 'positive': False},
+                           **lin_dev) for i, lin_dev in enumerate(linear_deviations)]
+
+    options = {'alpha_1': alpha_1, 'alpha_2': alpha_2, 'l_norm': l_norm,
+               'monotonic': monotonic, 'positive': positive,
+               'engine': engine, 'engine_options': engine_options}
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+
+    def fit_windows(consensus_values):
+        # the fits come back in window order. The workers read their
+        # windows themselves and at most 2 * n_jobs fits are held at once.
+        arguments = ((share_array(x, window[0], window[1]), share_array(y, window[0], window[1]),
+                      None if y_err is None else share_array(y_err, window[0], window[1]),
+                      window,
+                      [slice_deviation(lin_dev, slice(window[0], window[1]))
+                       for lin_dev in linear_deviations],
+                      consensus_values, buffer,
+                      dict(options, constrain_zero=constrain_zero and i == 0))
+                     for i, window in enumerate(windows))
+        if executor is None:
+            for args in arguments:
+                yield fit_window(*args)
+            return
+
+        pending = deque()
+        for args in arguments:
+            pending.append(executor.submit(fit_window, *args))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    try:
+        fits = fit_windows(None)
+        values = None
+        if linear_deviations:
+            # start from the average of the windows, weighted by chunk length
+            sums = [0.0] * len(completed_devs)
+            for fit in fits:
+                length = fit['window'][3] - fit['window'][2]
+                sums = [total + length * fit['deviations'][lin_dev['name']]
+                        for total, lin_dev in zip(sums, completed_devs)]
+            values = [total / n for total in sums]
+
+            # at least one round so the windows are fit with the values reported,
+            # the fits of the last are blended below
+            n_rounds = max(consensus_rounds, 1)
+            for round_number in range(n_rounds - 1):
+                normal_matrix, normal_rhs = 0.0, 0.0
+                for fit in fit_windows(values):
+                    normal_matrix = normal_matrix + fit['normal_matrix']
+                    normal_rhs = normal_rhs + fit['normal_rhs']
+                values = update_consensus(normal_matrix, normal_rhs, completed_devs,
+                                          values, l_norm)
+
+            fits = fit_windows(values)
+
+        if out is None:
+            base_model = np.zeros(n)
+            y_fit = np.zeros(n)
+        else:
+            os.makedirs(out, exist_ok=True)
+            base_model = np.lib.format.open_memmap(os.path.join(out, 'base_model.npy'),
+                                                   mode='w+', dtype=float, shape=(n,))
+            y_fit = np.lib.format.open_memmap(os.path.join(out, 'y_fit.npy'),
+                                              mode='w+', dtype=float, shape=(n,))
+
+        window_info = []
+        seams = []
+        previous = None
+        for fit in fits:
+            window = fit['window']
+            weights = blend_weights(window, n, overlap)
+            base_model[window[0]:window[1]] += weights * fit['base_model']
+            y_fit[window[0]:window[1]] += weights * fit['y_fit']
+
+            if previous is not None:
+                # compare with the window before where they're blended
+                edge = window[2]
+                half = overlap // 2
+                before = previous['y_fit'][edge - half - previous['window'][0]:
+                                           edge + half + 1 - previous['window'][0]]
+                after = fit['y_fit'][edge - half - window[0]:edge + half + 1 - window[0]]
+                difference = np.abs(before - after)
+                seams.append({'position': window[2], 'max_difference': float(difference.max())})
+
+            window_info.append({'window': window[:2], 'chunk': window[2:],
+                                'deviations': fit['deviations'],
+                                'solver_info': fit['solver_info'],
+                                'seconds': fit['seconds']})
+            previous = fit
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if out is not None:
+        base_model.flush()
+        y_fit.flush()
+
+    deviations = {} if values is None else \
+        {lin_dev['name']: value for lin_dev, value in zip(completed_devs, values)}
+
+    return {'base_model': base_model,
+            'y_fit': y_fit,
+            'deviations': deviations,
+            'windows': window_info,
+            'seams': seams}
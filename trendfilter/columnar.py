@@ -0,0 +1,461 @@
+"""
+Fit many series stored end to end in flat columns
+
+The series are read as zero-copy slices of memory-mapped columns
+(e.g. .npy files) given an index of offsets and lengths, so they can
+be ragged. Each is fit with one of the engines and its fitted values
+and base model are written straight into preallocated memory-mapped
+output columns with the same layout as y, and the deviation values,
+objective and status into per-series outputs. No results are kept
+between chunks of series, so memory stays flat however many series
+there are. Worker processes are sent the file of a memory-mapped
+column, or only a chunk's part of a column in memory, and read the
+series themselves.
+
+After each chunk the outputs are flushed and then the number of
+series done is written to progress.json, so a run that is stopped
+part way, or crashes, picks up from the last chunk written when run
+again with the same out. progress.json also holds the options, engine
+options and a fingerprint of the input columns, and a run with any of
+them different isn't resumed.
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from trendfilter.chunked import open_array, share_array, read_array
+from trendfilter.hashing import hash_array
+from trendfilter.linear_deviations import slice_deviation
+
+STATUSES = ['pending', 'ok', 'failed', 'error']
+PROGRESS_FILE = 'progress.json'
+
+
+def get_index(offsets=None, lengths=None, n_points=None):
+    """
+    The offsets and lengths of the series in the columns
+    :param offsets: int array of where each series starts. With no lengths,
+        it may have one more entry, the end of the last series.
+    :param lengths: optional int array of the length of each series,
+        defaults to up to the next offset
+    :param n_points: the length of the columns, the end of the last series
+        if there are neither lengths nor a last offset. With no offsets
+        either, it's all one series.
+    :return: offsets, lengths as int64 numpy arrays
+    """
+    if offsets is None:
+        offsets = [0]
+
+    offsets = np.asarray(open_array(offsets), dtype=np.int64)
+    if lengths is None:
+        if len(offsets) > 1 and (n_points is None or offsets[-1] == n_points):
+            ends = offsets[1:]
+            offsets = offsets[:-1]
+        else:
+            ends = np.append(offsets[1:], n_points)
+        lengths = ends - offsets
+    else:
+        lengths = np.asarray(open_array(lengths), dtype=np.int64)
+
+    assert len(offsets) == len(lengths)
+    assert np.all(offsets >= 0) and np.all(lengths >= 0)
+    if n_points is not None:
+        assert np.all(offsets + lengths <= n_points), 'A series runs past the end of the columns'
+
+    return offsets, lengths
+
+
+def iter_series(x, y, offsets, lengths, y_err=None, start=0, stop=None):
+    """
+    The series as views of the columns, without copying them
+    :param x: numpy array, memmap or path of the x column, or None
+        for x = 0, 1, ... in each series
+    :param y: numpy array, memmap or path of the y column
+    :param offsets: see get_index
+    :param lengths: see get_index
+    :param y_err: None, or like y
+    :param start: the first series
+    :param stop: one past the last series, defaults to all of them
+    :return: generator of (index, x, y, y_err) for each series
+    """
+    x = None if x is None else open_array(x)
+    y = open_array(y)
+    y_err = None if y_err is None else open_array(y_err)
+
+    if stop is None:
+        stop = len(offsets)
+
+    for index in range(start, stop):
+        series = slice(int(offsets[index]), int(offsets[index] + lengths[index]))
+        x_series = np.arange(float(lengths[index])) if x is None else x[series]
+        y_err_series = None if y_err is None else y_err[series]
+        yield index, x_series, y[series], y_err_series
+
+
+def fit_series(x, y, y_err, linear_deviations, options):
+    """
+    Fit one series with one of the engines
+    :return: dict with status, error, y_fit, base_model, deviation values
+        and objective. status is 'ok', 'failed' (the engine didn't
+        converge) or 'error' (an exception, see error)
+    """
+    # imported here so the workers only load what the engine needs
+    from trendfilter.engines import trend_filter_engine
+
+    try:
+        tf_result = trend_filter_engine(np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+                                        y_err=y_err, linear_deviations=linear_deviations,
+                                        **options)
+    except Exception as error:
+        return {'status': 'error',
+                'error': '%s: %s' % (type(error).__name__, error)}
+
+    converged = tf_result['solver_info'].get('converged', True)
+    return {'status': 'ok' if converged else 'failed',
+            'error': None if converged else 'engine did not converge',
+            'y_fit': tf_result['y_fit'],
+            'base_model': tf_result['base_model'],
+            'deviation_values': [lin_dev['values']
+                                 for lin_dev in tf_result['linear_deviations']],
+            'objective': tf_result['objective_total']}
+
+
+def fit_chunk(x, y, y_err, offsets, lengths, start, linear_deviations, options):
+    """
+    Fit a chunk of series. Runs in a worker process, which reads the
+    part of the columns the chunk spans itself, so only the chunk's
+    results are sent back.
+    :param x: that part of the x column, see share_array, or None
+    :param y: that part of the y column, see share_array
+    :param y_err: that part of the y_err column, see share_array, or None
+    :param offsets: the offsets of the chunk's series from the start of the part
+    :param lengths: the lengths of the chunk's series
+    :param start: the index of the chunk's first series
+    :param linear_deviations: linear deviations, sliced to the part
+    :param options: see fit_series
+    :return: (start, list of fit_series results)
+    """
+    x = None if x is None else read_array(x)
+    y_err = None if y_err is None else read_array(y_err)
+    fits = []
+    for index, x_series, y_series, y_err_series in iter_series(x, read_array(y), offsets,
+                                                               lengths, y_err=y_err):
+        series = slice(int(offsets[index]), int(offsets[index] + lengths[index]))
+        lin_devs = [slice_deviation(lin_dev, series) for lin_dev in linear_deviations]
+        fits.append(fit_series(x_series, y_series, y_err_series, lin_devs, options))
+
+    return start, fits
+
+
+def column_fingerprint(array):
+    """
+    A cheap identity of a column, so a run isn't resumed on other data:
+    the file, size and modification time of a .npy file or memmap,
+    otherwise a hash of the array
+    :param array: numpy array, np.memmap, path of a .npy file, or None
+    :return: json-able value
+    """
+    if array is None:
+        return None
+
+    shared = share_array(array)
+    if 'array' in shared:
+        return hash_array(shared['array'])
+
+    stat = os.stat(shared['filename'])
+    return {'file': os.path.abspath(shared['filename']), 'offset': int(shared['offset']),
+            'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def json_options(options):
+    """
+    The options as they're stored in progress.json, with numbers as
+    floats and arrays hashed, see normalize_options
+    :param options: dict
+    :return: dict
+    """
+    # imported here as only the run description needs it
+    from trendfilter.result_cache import normalize_options
+    def default(value):
+        return hash_array(value) if isinstance(value, np.ndarray) else str(value)
+
+    return json.loads(json.dumps(normalize_options(options), sort_keys=True, default=default))
+
+
+def open_outputs(out, n_points, n_series, linear_deviations, run_info, resume=True):
+    """
+    Open the output columns, creating them unless resuming a run
+    :param out: directory of the outputs
+    :param n_points: length of the columns
+    :param n_series: number of series
+    :param linear_deviations: list of linear deviations, with name and n_vars
+    :param run_info: json-able description of the run, which must match
+        to resume it
+    :param resume: If True, carry on from progress.json if there is one
+    :return: dict of memmaps, the number of series already done
+    """
+    os.makedirs(out, exist_ok=True)
+    shapes = {'y_fit': (n_points,),
+              'base_model': (n_points,),
+              'objective': (n_series,),
+              'status': (n_series,)}
+    for lin_dev in linear_deviations:
+        shapes['deviation_%s' % lin_dev['name']] = (n_series, lin_dev['n_vars'])
+
+    progress_path = os.path.join(out, PROGRESS_FILE)
+    if resume and os.path.exists(progress_path):
+        with open(progress_path) as progress_file:
+            progress = json.load(progress_file)
+
+        if progress['run'] != run_info:
+            raise ValueError("%s has the outputs of a different run, use another "
+                             "directory or resume=False" % out)
+
+        outputs = {name: np.load(os.path.join(out, name + '.npy'), mmap_mode='r+')
+                   for name in shapes}
+        return outputs, progress['n_done']
+
+    outputs = {}
+    for name, shape in shapes.items():
+        dtype = np.int8 if name == 'status' else float
+        outputs[name] = np.lib.format.open_memmap(os.path.join(out, name + '.npy'),
+                                                  mode='w+', dtype=dtype, shape=shape)
+
+    write_progress(out, run_info, 0)
+    return outputs, 0
+
+
+def write_progress(out, run_info, n_done):
+    """
+    Record the number of series done. The file is replaced in one
+    step so it's never half written.
+    """
+    path = os.path.join(out, PROGRESS_FILE)
+    with open(path + '.tmp', 'w') as progress_file:
+        json.dump({'run': run_info, 'n_done': n_done}, progress_file)
+
+    os.replace(path + '.tmp', path)
+
+
+def iter_columnar(x, y, offsets=None, lengths=None, y_err=None, out=None, alpha_1=0.0,
+                  alpha_2=0.0, l_norm=2, constrain_zero=False, monotonic=False,
+                  positive=False, linear_deviations=None, engine=None, engine_options=None,
+                  chunk_size=100, n_jobs=1, resume=True):
+    """
+    Fit the series one chunk at a time, writing the results to the
+    outputs and yielding a small summary of each series as it's written.
+    Stop iterating to stop the run, it can be resumed later.
+    See trend_filter_columnar for the parameters.
+    :return: generator of dicts with index, offset, length, status, error
+        and objective, in the order they are written, which is the
+        order of the series for n_jobs=1
+    """
+    assert out is not None, 'out, the directory of the outputs, is needed'
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    assert n_jobs >= 1
+
+    if engine is None:
+        banded_ok = l_norm == 2 and not monotonic and not positive and \
+            not (constrain_zero and linear_deviations)
+        engine = 'banded' if banded_ok else 'admm'
+
+    assert engine != 'cvxpy', 'Use one of the engines that don\'t go through cvxpy'
+
+    n_points = len(open_array(y))
+    offsets, lengths = get_index(offsets=offsets, lengths=lengths, n_points=n_points)
+    n_series = len(offsets)
+
+    # the defaults from complete_linear_deviation, the matrices are built per series
+    completed_devs = [dict({'name': 'linear_deviation_%s' % i, 'alpha': 1e-3}, **lin_dev)
+                      for i, lin_dev in enumerate(linear_deviations)]
+
+    options = {'alpha_1': alpha_1, 'alpha_2': alpha_2, 'l_norm': l_norm,
+               'constrain_zero': constrain_zero, 'monotonic': monotonic,
+               'positive': positive, 'engine': engine, 'engine_options': engine_options}
+
+    run_info = {'n_points': n_points, 'n_series': n_series,
+                'options': {'alpha_1': float(alpha_1), 'alpha_2': float(alpha_2),
+                            'l_norm': int(l_norm), 'constrain_zero': bool(constrain_zero),
+                            'monotonic': bool(monotonic), 'positive': bool(positive),
+                            'engine': engine},
+                'engine_options': json_options(engine_options or {}),
+                'deviations': [[lin_dev['name'], int(lin_dev['n_vars']), float(lin_dev['alpha'])]
+                               for lin_dev in completed_devs],
+                'inputs': {'x': column_fingerprint(x), 'y': column_fingerprint(y),
+                           'y_err': column_fingerprint(y_err),
+                           'offsets': hash_array(offsets), 'lengths': hash_array(lengths)}}
+    outputs, n_done = open_outputs(out, n_points, n_series, completed_devs, run_info,
+                                   resume=resume)
+
+    def write(start, fits):
+        summaries = []
+        for index, fit in enumerate(fits, start):
+            offset, length = int(offsets[index]), int(lengths[index])
+            outputs['status'][index] = STATUSES.index(fit['status'])
+            if 'y_fit' in fit:
+                outputs['y_fit'][offset:offset + length] = fit['y_fit']
+                outputs['base_model'][offset:offset + length] = fit['base_model']
+                outputs['objective'][index] = fit['objective']
+                for lin_dev, values in zip(completed_devs, fit['deviation_values']):
+                    outputs['deviation_%s' % lin_dev['name']][index] = values
+            else:
+                outputs['y_fit'][offset:offset + length] = np.nan
+                outputs['base_model'][offset:offset + length] = np.nan
+                outputs['objective'][index] = np.nan
+                for lin_dev in completed_devs:
+                    outputs['deviation_%s' % lin_dev['name']][index] = np.nan
+
+            summaries.append({'index': index, 'offset': offset, 'length': length,
+                              'status': fit['status'], 'error': fit['error'],
+                              'objective': float(outputs['objective'][index])})
+        return summaries
+
+    def flush():
+        for output in outputs.values():
+            output.flush()
+
+    def chunk_task(start, stop):
+        # only the part of the columns the chunk spans, memmaps by their file
+        low = int(offsets[start:stop].min())
+        high = int((offsets[start:stop] + lengths[start:stop]).max())
+        part = slice(low, high)
+        return (None if x is None else share_array(x, low, high), share_array(y, low, high),
+                None if y_err is None else share_array(y_err, low, high),
+                offsets[start:stop] - low, lengths[start:stop], start,
+                [slice_deviation(lin_dev, part) for lin_dev in completed_devs], options)
+
+    chunks = [(start, min(start + chunk_size, n_series))
+              for start in range(n_done, n_series, chunk_size)]
+    tasks = (chunk_task(start, stop) for start, stop in chunks)
+
+    if n_jobs == 1:
+        for (start, stop), task in zip(chunks, tasks):
+            start, fits = fit_chunk(*task)
+            summaries = write(start, fits)
+            flush()
+            write_progress(out, run_info, stop)
+            for summary in summaries:
+                yield summary
+        return
+
+    # the chunks can finish out of order, the progress is the end of the
+    # chunks that are all done, later ones are refit on resuming
+    stops = dict(chunks)
+    finished = set()
+    progress = n_done
+    pending = tasks
+    executor = ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        # a few chunks per worker in flight, so the results waiting to
+        # be written don't pile up
+        running = {executor.submit(fit_chunk, *task) for task in _take(pending, 2 * n_jobs)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            running |= {executor.submit(fit_chunk, *task)
+                        for task in _take(pending, len(done))}
+            for future in done:
+                start, fits = future.result()
+                summaries = write(start, fits)
+                flush()
+                finished.add(start)
+                while progress in finished:
+                    progress = stops[progress]
+                write_progress(out, run_info, progress)
+                for summary in summaries:
+                    yield summary
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def trend_filter_columnar(x, y, offsets=None, lengths=None, y_err=None, out=None,
+                          alpha_1=0.0, alpha_2=0.0, l_norm=2, constrain_zero=False,
+                          monotonic=False, positive=False, linear_deviations=None,
+                          engine=None, engine_options=None, chunk_size=100, n_jobs=1,
+                          resume=True):
+    """
+    Fit every series in flat columns, with the results written to
+    memory-mapped output columns
+    :param x: numpy array, np.memmap or path of a .npy file with the x of
+        every series end to end, each sorted. None for x = 0, 1, ... in
+        each series.
+    :param y: The y variable, same types as x
+    :param offsets: see get_index
+    :param lengths: see get_index
+    :param y_err: None, or same types as x
+    :param out: directory for the outputs: y_fit.npy and base_model.npy,
+        like y, objective.npy and status.npy (the index in STATUSES) with
+        one entry per series, and deviation_<name>.npy with a row of
+        values per series for each linear deviation. Series that
+        raise an error are NaN.
+    :param alpha_1: see trend_filter
+    :param alpha_2: see trend_filter
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter. The same for every series.
+        Mappings are evaluated on each series' x, matrices and indices
+        span the columns and are sliced. Mappings must be picklable
+        for n_jobs > 1.
+    :param engine: one of the ENGINES. Defaults to 'banded' where it supports
+        the options, otherwise 'admm'
+    :param engine_options: dict of keyword arguments for the engine
+    :param chunk_size: number of series fit between writing the progress
+    :param n_jobs: number of worker processes. 1 runs in this process,
+        -1 uses all cores.
+    :param resume: If True and out has the progress of the same run, with
+        the same options, engine options and input columns, carry on from
+        the last chunk written. Otherwise start again.
+    :return: the outputs as from load_columnar, with n_fit, the number
+        of series fit in this call
+    """
+    n_fit = 0
+    for _ in iter_columnar(x, y, offsets=offsets, lengths=lengths, y_err=y_err, out=out,
+                           alpha_1=alpha_1, alpha_2=alpha_2, l_norm=l_norm,
+                           constrain_zero=constrain_zero, monotonic=monotonic,
+                           positive=positive, linear_deviations=linear_deviations,
+                           engine=engine, engine_options=engine_options,
+                           chunk_size=chunk_size, n_jobs=n_jobs, resume=resume):
+        n_fit += 1
+
+    outputs = load_columnar(out)
+    outputs['n_fit'] = n_fit
+    return outputs
+
+
+def load_columnar(out):
+    """
+    Open the outputs of trend_filter_columnar without reading them
+    :param out: directory of the outputs
+    :return: dict with y_fit, base_model, objective, status and deviations
+        as read-only memmaps, n_series, n_done and counts, the number
+        of series by status
+    """
+    with open(os.path.join(out, PROGRESS_FILE)) as progress_file:
+        progress = json.load(progress_file)
+
+    def load(name):
+        return np.load(os.path.join(out, name + '.npy'), mmap_mode='r')
+
+    status = load('status')
+    codes = np.bincount(status, minlength=len(STATUSES))
+    return {'y_fit': load('y_fit'),
+            'base_model': load('base_model'),
+            'objective': load('objective'),
+            'status': status,
+            'deviations': {name: load('deviation_%s' % name)
+                           for name, _, _ in progress['run']['deviations']},
+            'n_series': progress['run']['n_series'],
+            'n_done': progress['n_done'],
+            'counts': {name: int(count) for name, count in zip(STATUSES, codes)}}
+
+
+def _take(iterator, n):
+    return [task for _, task in zip(range(n), iterator)]
@@ -0,0 +1,305 @@
+"""
+Compiled, parameterized trend filter problems
+
+Building and canonicalizing a cvxpy problem often costs more than
+solving it for small series. A CompiledTrendFilter builds the problem
+once for a given x grid and set of options with the data and the
+regularization strengths as cvxpy Parameters. Re-fitting a new series
+or new alphas on the same grid then only updates parameter values.
+"""
+
+from collections import OrderedDict
+import numpy as np
+import cvxpy
+from scipy.sparse import csr_matrix
+from trendfilter.extrapolate import get_interp_extrapolate_functions
+from trendfilter.derivatives import first_derv_nes_cvxpy
+from trendfilter.linear_deviations import complete_linear_deviations, \
+    add_deviation_matrix
+from trendfilter.trendfilter import get_reg, get_isig, get_mask, solve_problem
+from trendfilter.hashing import hash_array
+from trendfilter.profiling import Profiler
+
+
+class CompiledTrendFilter:
+    """
+    A DPP-compliant trend filter problem for a fixed x grid and
+    fixed options. The parameters y, isig, alpha_1, alpha_2 and
+    one alpha per linear deviation are set on each call to solve.
+    """
+
+    def __init__(self, x, l_norm=2, constrain_zero=False, monotonic=False,
+                 positive=False, linear_deviations=None):
+        """
+        :param x: The x-value, numpy array
+        :param l_norm: 1 or 2 to use either L1 or L2 norm
+        :param constrain_zero: If True constrains the model to be zero at origin
+        :param monotonic: If True, the model will be monotonically increasing
+        :param positive: If True, base model will be positive
+        :param linear_deviations: list of linear deviation objects
+        """
+        assert l_norm in [1, 2]
+
+        if linear_deviations is None:
+            linear_deviations = []
+
+        self.x = x
+        self.n = len(x)
+        self.l_norm = l_norm
+
+        n = self.n
+        self.linear_deviations = complete_linear_deviations(linear_deviations, x)
+
+        self.isig = cvxpy.Parameter(n, nonneg=True, name='isig')
+        # isig * y, kept as a separate parameter so the problem is DPP
+        self.isig_y = cvxpy.Parameter(n, name='isig_y')
+        self.alpha_1 = cvxpy.Parameter(nonneg=True, name='alpha_1')
+        self.alpha_2 = cvxpy.Parameter(nonneg=True, name='alpha_2')
+        self.deviation_alphas = [cvxpy.Parameter(nonneg=True, name='alpha_%s' % lin_dev['name'])
+                                 for lin_dev in self.linear_deviations]
+
+        self.base_model = cvxpy.Variable(n, pos=positive)
+
+        model = self.base_model
+        for lin_dev in self.linear_deviations:
+            model += lin_dev['model_contribution']
+        self.model = model
+
+        diff = cvxpy.multiply(self.isig, model) - self.isig_y
+        self.objective_function = cvxpy.sum(cvxpy.huber(diff))
+
+        self.derv_1 = first_derv_nes_cvxpy(x, self.base_model)
+
+        self.reg_sum, self.regs = get_reg(x, self.base_model, self.derv_1, l_norm,
+                                          self.alpha_1, self.alpha_2,
+                                          linear_deviations=self.linear_deviations,
+                                          deviation_alphas=self.deviation_alphas)
+
+        self.objective = cvxpy.Minimize(self.objective_function + self.reg_sum)
+
+        self.constraints = []
+        if constrain_zero:
+            self.constraints.append(model[0] == 0)
+
+        if monotonic:
+            self.constraints.append(self.derv_1 >= 0)
+
+        self.problem = cvxpy.Problem(self.objective, constraints=self.constraints)
+        assert self.problem.is_dcp(dpp=True)
+
+        self.n_solves = 0
+
+    def set_parameters(self, y, y_err=None, alpha_1=0.0, alpha_2=0.0,
+                       deviation_alphas=None, mask=None):
+        """
+        Set the parameter values for the next solve
+        :param y: The y variable, numpy array
+        :param y_err: The y_err variable, numpy array
+            Default to 1
+        :param alpha_1: Regularization against non-zero slope
+        :param alpha_2: Regularization against changing slope
+        :param deviation_alphas: list of alphas, one per linear deviation
+            Defaults to the alphas the linear deviations were compiled with
+        :param mask: optional boolean numpy array, True for the points to fit.
+            The others, and any with NaN in y or y_err, are given zero
+            weight in the Huber loss.
+        """
+        y = np.asarray(y, dtype=float)
+        assert len(y) == self.n
+        if y_err is None:
+            y_err = np.ones(self.n)
+        else:
+            y_err = np.asarray(y_err, dtype=float)
+            assert len(y_err) == self.n
+
+        if deviation_alphas is None:
+            deviation_alphas = [lin_dev['alpha'] for lin_dev in self.linear_deviations]
+
+        assert len(deviation_alphas) == len(self.deviation_alphas)
+
+        isig = get_isig(y, y_err, mask=get_mask(y, y_err=y_err, mask=mask))
+        self.isig.value = isig
+        self.isig_y.value = isig * np.where(isig > 0, y, 0.0)
+        self.alpha_1.value = alpha_1
+        self.alpha_2.value = alpha_2
+        for param, alpha in zip(self.deviation_alphas, deviation_alphas):
+            assert alpha >= 0.0
+            param.value = alpha
+
+    def solve(self, y, y_err=None, alpha_1=0.0, alpha_2=0.0,
+              linear_deviations=None, deviation_alphas=None,
+              solver='ECOS', warm_start=True, mask=None, profile=False):
+        """
+        Solve the compiled problem for new data and/or new alphas
+        :param y: The y variable, numpy array
+        :param y_err: The y_err variable, numpy array
+            Default to 1
+        :param alpha_1: Regularization against non-zero slope
+        :param alpha_2: Regularization against changing slope
+        :param linear_deviations: optional list of linear deviation objects
+            with the same structure as compiled, used only for their alphas
+        :param deviation_alphas: optional list of alphas, one per linear deviation
+        :param solver: solver_name, check cvxpy.installed_solvers(), or 'auto'
+        :param warm_start: If True, start from the previous solution
+            for solvers that support it
+        :param mask: optional boolean numpy array, True for the points to fit.
+            The others are given zero weight in the Huber loss.
+        :param profile: If True, time each phase, see trend_filter
+        :return: The fit model information, same as trend_filter.
+            Note that the cvxpy expressions are shared with this object
+            and will reflect the most recent solve.
+        """
+        if deviation_alphas is None and linear_deviations:
+            deviation_alphas = [lin_dev.get('alpha', 1e-3) for lin_dev in linear_deviations]
+
+        profiler = Profiler(enabled=bool(profile), memory=profile == 'memory')
+
+        with profiler.phase('parameters'):
+            self.set_parameters(y, y_err=y_err, alpha_1=alpha_1, alpha_2=alpha_2,
+                                deviation_alphas=deviation_alphas, mask=mask)
+
+        with profiler.phase('solve'):
+            solve_problem(self.problem, solver, warm_start=warm_start)
+        self.n_solves += 1
+        profiler.record_problem(self.problem)
+
+        completed_devs = []
+        for lin_dev, param in zip(self.linear_deviations, self.deviation_alphas):
+            lin_dev = lin_dev.copy()
+            lin_dev['alpha'] = param.value
+            completed_devs.append(lin_dev)
+
+        with profiler.phase('interpolation'):
+            func_base, func_deviates, func = \
+                get_interp_extrapolate_functions(self.x, self.base_model, completed_devs)
+
+        if y_err is None:
+            y_err = np.ones(self.n)
+
+        tf_result = {'x': self.x,
+                     'y': y,
+                     'y_err': y_err,
+                     'function': func,
+                     'function_base': func_base,
+                     'function_deviates': func_deviates,
+                     'model': self.model,
+                     'base_model': self.base_model,
+                     'objective_model': self.objective_function,
+                     'regularization_total': self.reg_sum,
+                     'regularizations': self.regs,
+                     'objective_total': self.objective,
+                     'y_fit': self.model.value,
+                     'constraints': self.constraints,
+                     'linear_deviations': completed_devs}
+
+        return profiler.finish(tf_result)
+
+
+def deviation_structure_key(linear_deviations):
+    """
+    A hashable key for the structure of linear deviations which
+    must already include their matrices. The alphas are not part
+    of the structure as they are parameters.
+    :param linear_deviations: list of linear deviation objects
+    :return: tuple
+    """
+    keys = []
+    for i, lin_dev in enumerate(linear_deviations):
+        matrix = csr_matrix(lin_dev['matrix'])
+        matrix.sum_duplicates()
+        keys.append((lin_dev.get('name', 'linear_deviation_%s' % i),
+                     lin_dev['n_vars'],
+                     bool(lin_dev.get('positive', False)),
+                     hash_array(matrix.data), hash_array(matrix.indices),
+                     hash_array(matrix.indptr)))
+
+    return tuple(keys)
+
+
+def problem_key(x, l_norm=2, constrain_zero=False, monotonic=False,
+                positive=False, linear_deviations=None):
+    """
+    The key for a compiled problem in the cache
+    :return: tuple
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    x = np.asarray(x, dtype=float)
+    return (len(x), hash_array(x), l_norm, bool(constrain_zero), bool(monotonic),
+            bool(positive), deviation_structure_key(linear_deviations))
+
+
+class ProblemCache:
+    """
+    A bounded least-recently-used cache of CompiledTrendFilter objects
+    """
+
+    def __init__(self, maxsize=32):
+        assert maxsize >= 1
+        self.maxsize = maxsize
+        self.problems = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.problems)
+
+    def clear(self):
+        self.problems.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, x, l_norm=2, constrain_zero=False, monotonic=False,
+            positive=False, linear_deviations=None):
+        """
+        Get the compiled problem, building it if it isn't cached
+        :return: CompiledTrendFilter
+        """
+        if linear_deviations is None:
+            linear_deviations = []
+
+        linear_deviations = [add_deviation_matrix(lin_dev, x) for lin_dev in linear_deviations]
+
+        key = problem_key(x, l_norm=l_norm, constrain_zero=constrain_zero,
+                          monotonic=monotonic, positive=positive,
+                          linear_deviations=linear_deviations)
+
+        if key in self.problems:
+            self.hits += 1
+            self.problems.move_to_end(key)
+            return self.problems[key]
+
+        self.misses += 1
+        compiled = CompiledTrendFilter(x, l_norm=l_norm, constrain_zero=constrain_zero,
+                                       monotonic=monotonic, positive=positive,
+                                       linear_deviations=linear_deviations)
+        self.problems[key] = compiled
+        if len(self.problems) > self.maxsize:
+            self.problems.popitem(last=False)
+
+        return compiled
+
+
+problem_cache = ProblemCache()
+
+
+def get_compiled_trend_filter(x, l_norm=2, constrain_zero=False, monotonic=False,
+                              positive=False, linear_deviations=None, cache=None):
+    """
+    Get a compiled trend filter problem from the cache
+    :param x: The x-value, numpy array
+    :param l_norm: 1 or 2 to use either L1 or L2 norm
+    :param constrain_zero: If True constrains the model to be zero at origin
+    :param monotonic: If True, the model will be monotonically increasing
+    :param positive: If True, base model will be positive
+    :param linear_deviations: list of linear deviation objects
+    :param cache: ProblemCache, defaults to the module level cache
+    :return: CompiledTrendFilter
+    """
+    if cache is None:
+        cache = problem_cache
+
+    return cache.get(x, l_norm=l_norm, constrain_zero=constrain_zero,
+                     monotonic=monotonic, positive=positive,
+                     linear_deviations=linear_deviations)
@@ -0,0 +1,251 @@
+"""
+Regularization sweeps and cross-validation for choosing the alphas
+"""
+
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from trendfilter.trendfilter import trend_filter, get_isig, get_mask
+from trendfilter.engines import trend_filter_engine
+from trendfilter.linear_deviations import matrix_only_deviations
+from trendfilter.numeric import huber
+from trendfilter.extrapolate import get_deviation_values
+
+
+def alpha_grid(param_grid):
+    """
+    All combinations of the alphas in the parameter grid
+    :param param_grid: dict of name to list of values. Names are
+        'alpha_1', 'alpha_2' or the name of a linear deviation.
+    :return: list of dicts, in the order of itertools.product
+    """
+    names = list(param_grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[param_grid[name] for name in names])]
+
+
+def alpha_path(x, y, param_grid, y_err=None, mask=None,
+               l_norm=2, constrain_zero=False, monotonic=False,
+               positive=False, linear_deviations=None,
+               solver='ECOS', engine='cvxpy'):
+    """
+    Fit the model for every combination of alphas in the grid. Each fit is
+    warm-started from the previous one so it is best to order each list
+    of alphas from most to least regularized.
+    With the cvxpy engine one compiled problem is used for the whole sweep.
+    Only some solvers take the warm start, e.g. OSQP and SCS but not the
+    default ECOS, which solves each fit from scratch. The engines all
+    take it.
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param param_grid: dict of name to list of values. Names are
+        'alpha_1', 'alpha_2' or the name of a linear deviation.
+        Alphas not in the grid are 0 or the deviation's own alpha.
+    :param y_err: The y_err variable, numpy array
+    :param mask: optional boolean numpy array, True for the points to fit.
+        The others are given zero weight in the Huber loss.
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter
+    :param solver: see trend_filter
+    :param engine: see trend_filter
+    :return: list of dicts with alphas, y_fit, base_model, deviation_values
+        and objective, one per grid point
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    linear_deviations = matrix_only_deviations(linear_deviations, x)
+    names = _deviation_names(linear_deviations)
+
+    for name in param_grid:
+        assert name in ['alpha_1', 'alpha_2'] + names, 'Unknown alpha %s' % name
+
+    options = {'l_norm': l_norm, 'constrain_zero': constrain_zero,
+               'monotonic': monotonic, 'positive': positive}
+
+    if engine == 'cvxpy':
+        # imported here so the other engines don't need cvxpy
+        from trendfilter.compiled import get_compiled_trend_filter
+        compiled = get_compiled_trend_filter(x, linear_deviations=linear_deviations, **options)
+    else:
+        compiled = None
+
+    fits = []
+    warm_start = None
+    for alphas in alpha_grid(param_grid):
+        deviation_alphas = [alphas.get(name, lin_dev.get('alpha', 1e-3))
+                            for name, lin_dev in zip(names, linear_deviations)]
+
+        if compiled is not None:
+            result = compiled.solve(y, y_err=y_err,
+                                    alpha_1=alphas.get('alpha_1', 0.0),
+                                    alpha_2=alphas.get('alpha_2', 0.0),
+                                    deviation_alphas=deviation_alphas,
+                                    solver=solver, warm_start=True, mask=mask)
+            base_model = np.array(result['base_model'].value)
+            objective = compiled.problem.value
+        else:
+            lin_devs = [dict(lin_dev, alpha=alpha)
+                        for lin_dev, alpha in zip(linear_deviations, deviation_alphas)]
+            result = trend_filter_engine(x, y, y_err=y_err,
+                                         alpha_1=alphas.get('alpha_1', 0.0),
+                                         alpha_2=alphas.get('alpha_2', 0.0),
+                                         linear_deviations=lin_devs, engine=engine,
+                                         engine_options={'warm_start': warm_start},
+                                         mask=mask, **options)
+            base_model = result['base_model']
+            objective = result['objective_total']
+
+        warm_start = base_model
+        fits.append({'alphas': alphas,
+                     'y_fit': np.array(result['y_fit']),
+                     'base_model': base_model,
+                     'deviation_values': [np.array(get_deviation_values(lin_dev))
+                                          for lin_dev in result['linear_deviations']],
+                     'objective': objective})
+
+    return fits
+
+
+def get_folds(n, n_folds=5, method='kfold'):
+    """
+    Get the train and test masks for cross-validation
+    :param n: number of points
+    :param n_folds: number of folds
+    :param method: 'kfold' holds out every n_folds-th point, so each
+        fold still covers the whole range of x.
+        'forward' splits x into n_folds + 1 contiguous blocks and fold i
+        trains on blocks 0..i and tests on block i + 1, so the model is
+        always scored on extrapolation into the future.
+    :return: list of (train mask, test mask)
+    """
+    assert method in ['kfold', 'forward']
+    assert n_folds >= 2 or method == 'forward'
+
+    folds = []
+    if method == 'kfold':
+        fold_ids = np.arange(n) % n_folds
+        for fold in range(n_folds):
+            test = fold_ids == fold
+            folds.append((~test, test))
+    else:
+        edges = np.linspace(0, n, n_folds + 2).astype(int)
+        for fold in range(n_folds):
+            train = np.arange(n) < edges[fold + 1]
+            test = (np.arange(n) >= edges[fold + 1]) & (np.arange(n) < edges[fold + 2])
+            folds.append((train, test))
+
+    return folds
+
+
+def score_fold(x, y, y_err, train, test, param_grid, options):
+    """
+    Fit the alpha path for one fold and score it on the held-out points
+    with the same Huber loss as the objective. Runs in a worker process.
+    :return: list of scores, one per grid point
+    """
+    fits = alpha_path(x, y, param_grid, y_err=y_err, mask=train, **options)
+
+    if y_err is None:
+        y_err = np.ones(len(y))
+
+    # missing points in the test fold aren't scored
+    test = get_mask(y, y_err=y_err, mask=test)
+    isig = get_isig(y, y_err, mask=test)[test]
+    return [float(np.mean(huber(isig * (fit['y_fit'][test] - y[test])))) for fit in fits]
+
+
+def trend_filter_cv(x, y, param_grid, y_err=None, n_folds=5, method='kfold',
+                    l_norm=2, constrain_zero=False, monotonic=False,
+                    positive=False, linear_deviations=None,
+                    solver='ECOS', engine='cvxpy', n_jobs=1):
+    """
+    Choose the alphas by cross-validation and refit with the best.
+    Held-out points are masked out of the Huber loss so every fold uses
+    the full x grid. Each fold sweeps the grid with warm starts and the
+    folds run in parallel.
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param param_grid: dict of name to list of values. Names are
+        'alpha_1', 'alpha_2' or the name of a linear deviation.
+    :param y_err: The y_err variable, numpy array
+    :param n_folds: number of folds
+    :param method: 'kfold' or 'forward', see get_folds
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter
+    :param solver: see trend_filter. The folds are only warm-started with
+        a solver that takes warm starts, see alpha_path
+    :param engine: see trend_filter
+    :param n_jobs: number of worker processes. 1 runs in this process,
+        -1 uses all cores.
+    :return: dict with the grid, scores (grid points x folds), mean_scores,
+        score_surface (mean scores shaped like the grid), best_alphas
+        and result, the refit on all the data
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # mappings are replaced by matrices so they can be pickled
+    options = {'l_norm': l_norm, 'constrain_zero': constrain_zero,
+               'monotonic': monotonic, 'positive': positive,
+               'linear_deviations': matrix_only_deviations(linear_deviations, x),
+               'solver': solver, 'engine': engine}
+
+    folds = get_folds(len(x), n_folds=n_folds, method=method)
+    tasks = [(x, y, y_err, train, test, param_grid, options) for train, test in folds]
+
+    if n_jobs == 1:
+        fold_scores = [score_fold(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(score_fold, *task) for task in tasks]
+            fold_scores = [future.result() for future in futures]
+
+    grid = alpha_grid(param_grid)
+    scores = np.array(fold_scores).T
+    mean_scores = scores.mean(axis=1)
+    best_index = int(np.argmin(mean_scores))
+    best_alphas = grid[best_index]
+
+    shape = tuple(len(param_grid[name]) for name in param_grid)
+
+    names = _deviation_names(linear_deviations)
+    lin_devs = [dict(lin_dev, alpha=best_alphas.get(name, lin_dev.get('alpha', 1e-3)))
+                for name, lin_dev in zip(names, linear_deviations)]
+
+    result = trend_filter(x, y, y_err=y_err,
+                          alpha_1=best_alphas.get('alpha_1', 0.0),
+                          alpha_2=best_alphas.get('alpha_2', 0.0),
+                          l_norm=l_norm, constrain_zero=constrain_zero,
+                          monotonic=monotonic, positive=positive,
+                          linear_deviations=lin_devs, solver=solver,
+                          engine=engine)
+
+    return {'grid': grid,
+            'scores': scores,
+            'mean_scores': mean_scores,
+            'std_scores': scores.std(axis=1),
+            'score_surface': mean_scores.reshape(shape),
+            'best_index': best_index,
+            'best_alphas': best_alphas,
+            'result': result}
+
+
+def _deviation_names(linear_deviations):
+    return [lin_dev.get('name', 'linear_deviation_%s' % i)
+            for i, lin_dev in enumerate(linear_deviations)]
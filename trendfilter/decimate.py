@@ -0,0 +1,115 @@
+"""
+Decimation of long series for plotting
+
+A browser can only show about one point per pixel, so a curve with
+10^5 or more points is reduced to a budget of a few per pixel before
+it is drawn. lttb (largest triangle three buckets, Steinarsson 2013)
+keeps the points that matter to the shape of the line. minmax keeps
+the lowest and highest point in each pixel-wide bin of x, so no
+spike is lost. Both keep the first and last points and return
+indices into the sorted x, so the same points can be taken from
+other arrays.
+"""
+
+import numpy as np
+
+DECIMATIONS = ['lttb', 'minmax']
+
+
+def lttb(x, y, n_out):
+    """
+    Largest triangle three buckets decimation
+    :param x: sorted numpy array
+    :param y: numpy array
+    :param n_out: number of points to keep, at least 3
+    :return: sorted numpy array of the indices kept
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+
+    assert n_out >= 3, 'lttb needs n_out >= 3'
+
+    # the points between the first and last, in n_out - 2 buckets
+    # of at least one point each
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    counts = np.diff(edges)
+    x_sums = np.concatenate([[0.0], np.cumsum(x)])
+    y_sums = np.concatenate([[0.0], np.cumsum(y)])
+    x_means = (x_sums[edges[1:]] - x_sums[edges[:-1]]) / counts
+    y_means = (y_sums[edges[1:]] - y_sums[edges[:-1]]) / counts
+    # the last bucket looks ahead to the last point
+    x_means = np.append(x_means[1:], x[-1])
+    y_means = np.append(y_means[1:], y[-1])
+
+    index = np.empty(n_out, dtype=int)
+    index[0] = 0
+    index[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        x_prev, y_prev = x[previous], y[previous]
+        # twice the area of the triangle with the previous point
+        # kept and the mean of the next bucket
+        area = np.abs((x_prev - x_means[bucket]) * (y[low:high] - y_prev) -
+                      (x_prev - x[low:high]) * (y_means[bucket] - y_prev))
+        previous = low + int(np.argmax(area))
+        index[bucket + 1] = previous
+
+    return index
+
+
+def minmax(x, y, n_out):
+    """
+    Min/max decimation in bins of equal width in x
+    :param x: sorted numpy array
+    :param y: numpy array
+    :param n_out: largest number of points to keep, at least 4
+    :return: sorted numpy array of the indices kept
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+
+    assert n_out >= 4, 'minmax needs n_out >= 4'
+
+    n_bins = (n_out - 2) // 2
+    span = x[-1] - x[0]
+    if span > 0:
+        bins = np.minimum(((x - x[0]) / span * n_bins).astype(int), n_bins - 1)
+    else:
+        bins = np.zeros(n, dtype=int)
+
+    # x is sorted so the bins are too, sorting by y within them
+    # puts each bin's min first and max last
+    order = np.lexsort((y, bins))
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(bins) != 0]))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([[0, n - 1], order[starts], order[ends]]))
+
+
+def decimate(x, y, n_out, method='lttb'):
+    """
+    Decimate a series for plotting, leaving out points that
+    aren't finite
+    :param x: sorted numpy array
+    :param y: numpy array
+    :param n_out: number of points to keep, see lttb and minmax
+    :param method: one of the DECIMATIONS, or None to keep every point
+    :return: x, y as numpy arrays
+    """
+    assert method is None or method in DECIMATIONS, \
+        'Unknown decimation %s, choose from %s' % (method, DECIMATIONS)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+
+    if method is None:
+        return x, y
+
+    decimation = lttb if method == 'lttb' else minmax
+    index = decimation(x, y, n_out)
+    return x[index], y[index]
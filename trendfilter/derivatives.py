@@ -3,9 +3,9 @@ Sparse derivative matrices
 """
 
 import numpy as np
-from scipy.sparse import spdiags, coo_matrix, dia_matrix
-from itertools import chain
-import cvxpy
+from scipy.sparse import spdiags, dia_matrix, csr_matrix
+from scipy.sparse.linalg import LinearOperator
+from trendfilter.hashing import memoize_on_array
 
 
 def first_derivative_matrix(n):
@@ -21,13 +21,20 @@ def first_derivative_matrix(n):
 
 def first_derivative_matrix_circular(n):
     """
-    A matrix representing the first derivative operator
-    Circular so it wraps around. Not sparse matrix.
+    A sparse matrix representing the first derivative operator
+    Circular so it wraps around.
     :param n: a number
-    :return: a numpy array that applies the derivative operator
+    :return: a sparse matrix that applies the derivative operator
              to a numpy array or list to yield a numpy array
     """
-    return np.eye(n) - np.roll(np.eye(n), 1, axis=0)
+    rows = np.repeat(np.arange(n), 2)
+    cols = np.empty(2 * n, dtype=int)
+    cols[0::2] = (np.arange(n) - 1) % n
+    cols[1::2] = np.arange(n)
+    data = np.tile([-1.0, 1.0], n)
+    matrix = csr_matrix((data, (rows, cols)), shape=(n, n))
+    matrix.sum_duplicates()
+    return matrix
 
 
 def second_derivative_matrix(n):
@@ -52,9 +59,69 @@ def first_derivative(x):
     return x[:, 1:] - x[:, 0:-1]
 
 
+def second_derivative_rows(x, a_min=0.0, a_max=None, scale_free=False):
+    """
+    The non-zero values of each row of the second derivative matrix
+    for non-equally spaced points. Row i applies to x[i], x[i+1], x[i+2].
+    See second_derivative_matrix_nes.
+    :param : x numpy array of x-values
+    :return: numpy array of shape (len(x) - 2, 3)
+    """
+    x = np.asarray(x)
+
+    # These are all positive if sorted
+    a0 = (x[2:] - x[1:-1]).astype(float)
+    a2 = (x[1:-1] - x[:-2]).astype(float)
+
+    assert (a0 >= 0).all() and (a2 >= 0).all(), "Points do not appear to be sorted"
+
+    # And neither cab be zero
+    assert (a0 > 0).all() and (a2 > 0).all(), "Second derivative doesn't exist for repeated points"
+
+    # Now allow for a min and max on the differences
+    # of the x separations
+    if a_max is not None:
+        a0 = np.minimum(a0, a_max)
+        a2 = np.minimum(a2, a_max)
+
+    a0 = np.maximum(a0, a_min)
+    a2 = np.maximum(a2, a_min)
+    a1 = a0 + a2
+
+    if scale_free:
+        # Just subtract derivatives
+        # don't divide again by the length scale
+        scf = a1/2.0
+    else:
+        scf = 1.0
+
+    return np.column_stack([2.0*scf/(a1*a2), -2.0*scf/(a0*a2), 2.0*scf/(a0*a1)])
+
+
+def second_derivative_matrix_from_rows(rows):
+    """
+    Build the sparse second derivative matrix from its row values
+    :param rows: numpy array of shape (m, 3) from second_derivative_rows
+    :return: dia_matrix of shape (m, m + 2)
+    """
+    m = len(rows)
+    n = m + 2
+
+    # row i has entries in columns i, i+1, i+2 which are
+    # stored at those column positions of the diagonals
+    data = np.zeros((3, n))
+    data[0, :m] = rows[:, 0]
+    data[1, 1:m+1] = rows[:, 1]
+    data[2, 2:] = rows[:, 2]
+
+    return dia_matrix((data, [0, 1, 2]), shape=(m, n))
+
+
+@memoize_on_array()
 def second_derivative_matrix_nes(x, a_min=0.0, a_max=None, scale_free=False):
     """
     Get the second derivative matrix for non-equally spaced points
+    Memoized per x grid so treat the result as read-only.
     :param : x numpy array of x-values
     :param : a_min, float. Allows for modification where the x-values
              can't get any closer than this. (Not technically the sec derv)
@@ -62,46 +129,48 @@ def second_derivative_matrix_nes(x, a_min=0.0, a_max=None, scale_free=False):
     :return: A matrix D such that if x.size == (n,1), D * x is the second derivative of x
     assumes points are sorted
     """
-    n = len(x)
-    m = n - 2
-
-    values = []
-    for i in range(1, n-1):
-        # These are all positive if sorted
-        a0 = float(x[i+1] - x[i])
-        a2 = float(x[i] - x[i-1])
+    rows = second_derivative_rows(x, a_min=a_min, a_max=a_max, scale_free=scale_free)
+    return second_derivative_matrix_from_rows(rows)
 
-        assert (a0 >= 0) and (a2 >= 0), "Points do not appear to be sorted"
 
-        # And neither cab be zero
-        assert (a0 > 0) and (a2 > 0), "Second derivative doesn't exist for repeated points"
-
-        # Now allow for a min and max on the differences
-        # of the x separations
-        if a_max is not None:
-            a0 = min(a0, a_max)
-            a2 = min(a2, a_max)
-
-        a0 = max(a0, a_min)
-        a2 = max(a2, a_min)
-        a1 = a0 + a2
-
-        if scale_free:
-            # Just subtract derivatives
-            # don't divide again by the length scale
-            scf = a1/2.0
-        else:
-            scf = 1.0
+@memoize_on_array()
+def first_derivative_matrix_nes(x, ep=1e-9):
+    """
+    The first derivative matrix for non-equally spaced points,
+    the backward difference divided by the x separation as
+    in first_derv_nes. Memoized per x grid so treat the result as read-only.
+    :param x: numpy array of x-values
+    :param ep: small number added to the separations
+    :return: a sparse matrix with n-1 rows
+    """
+    x = np.asarray(x)
+    idx = 1.0 / (x[1:] - x[0:-1] + ep)
+    return first_derivative_matrix_from_idx(idx)
 
-        vals = [2.0*scf/(a1*a2), -2.0*scf/(a0*a2), 2.0*scf/(a0*a1)]
-        values.extend(vals)
 
-    i = list(chain(*[[_] * 3 for _ in range(m)]))
-    j = list(chain(*[[_, _ + 1, _ + 2] for _ in range(m)]))
+def first_derivative_matrix_from_idx(idx):
+    """
+    Build the sparse first derivative matrix from the inverse separations
+    :param idx: numpy array of 1 / (x[1:] - x[:-1])
+    :return: dia_matrix of shape (len(idx), len(idx) + 1)
+    """
+    n = len(idx) + 1
+    data = np.zeros((2, n))
+    data[0, :n-1] = -idx
+    data[1, 1:] = idx
+    return dia_matrix((data, [0, 1]), shape=(n-1, n))
 
-    d2 = coo_matrix((values, (i, j)), shape=(m, n))
 
-    return dia_matrix(d2)
+def get_operators(x):
+    """
+    The operators used in the regularization, for the engines
+    :param x: numpy array of x-values
+    :return: dict with 'd1', the first derivative matrix from
+        first_derivative_matrix_nes and 'd2', the scale free
+        second derivative matrix
+    """
+    return {'d1': first_derivative_matrix_nes(x),
+            'd2': second_derivative_matrix_nes(x, scale_free=True)}
 
 
 def first_derv_nes(x, y):
@@ -113,6 +182,7 @@ def first_derv_nes(x, y):
 
 
 def first_derv_nes_cvxpy(x, y):
+    import cvxpy
     n = len(x)
     ep = 1e-9
     idx = 1.0 / (x[1:] - x[0:-1] + ep)
@@ -122,9 +192,18 @@ def first_derv_nes_cvxpy(x, y):
 
 def cumulative_matrix(n):
     """
-    Matrix of nxn dimension that when multiplied with a vector
-        results in the cumulative sum
+    Operator of nxn dimension that when multiplied with a vector
+        results in the cumulative sum. It is a LinearOperator
+        rather than a dense lower triangular matrix so it's O(n).
+        For cvxpy expressions use cvxpy.cumsum.
     :param n: dimension
-    :return: cumulative sum matrix
+    :return: cumulative sum operator
     """
-    return np.tril(np.ones((n, n)))
+    def matvec(vector):
+        return np.cumsum(vector, axis=0)
+
+    def rmatvec(vector):
+        return np.cumsum(vector[::-1], axis=0)[::-1]
+
+    return LinearOperator((n, n), matvec=matvec, rmatvec=rmatvec, matmat=matvec,
+                          dtype=float)
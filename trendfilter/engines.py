@@ -0,0 +1,98 @@
+"""
+Trend filter engines that don't go through the cvxpy modeling layer
+"""
+
+import numpy as np
+from trendfilter.linear_deviations import complete_linear_deviations
+from trendfilter.numeric import get_numeric_result
+from trendfilter.trendfilter import get_isig, get_mask
+from trendfilter.admm import admm_trend_filter
+from trendfilter.banded import banded_trend_filter
+from trendfilter.qp import qp_trend_filter
+from trendfilter.derivatives import get_operators
+from trendfilter.profiling import Profiler
+
+# Each engine takes
+#   (x, y, isig, alpha_1=, alpha_2=, l_norm=, constrain_zero=,
+#    monotonic=, positive=, linear_deviations=, operators=, **engine_options)
+# and returns a dict with base_model, deviation_values and solver_info
+ENGINES = {'admm': admm_trend_filter,
+           'banded': banded_trend_filter,
+           'qp': qp_trend_filter}
+
+
+def trend_filter_engine(x, y, y_err=None, alpha_1=0.0,
+                        alpha_2=0.0, l_norm=2,
+                        constrain_zero=False, monotonic=False,
+                        positive=False,
+                        linear_deviations=None,
+                        engine='admm',
+                        engine_options=None,
+                        mask=None,
+                        operators=None,
+                        profile=False):
+    """
+    Same as trend_filter but solved with one of the ENGINES.
+    :param engine: name of the engine
+    :param engine_options: dict of keyword arguments for the engine
+    :param mask: optional boolean numpy array, True for the points to fit.
+        The others, and any with NaN in y or y_err, are given zero weight
+        in the Huber loss.
+    :param operators: optional dict of 'd1' and 'd2' matrices for x,
+        see get_operators. Defaults to the memoized operators for x.
+    :param profile: If True, time each phase, see trend_filter
+    :return: The fit model information. The model, base_model and objective
+        entries are numpy arrays and floats rather than cvxpy expressions.
+        'solver_info' has the engine's convergence diagnostics.
+    """
+    assert engine in ENGINES, 'Unknown engine %s, choose from %s' % (engine, sorted(ENGINES))
+    assert l_norm in [1, 2]
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if engine_options is None:
+        engine_options = {}
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+
+    assert len(y) == n
+    if y_err is None:
+        y_err = np.ones(n)
+    else:
+        y_err = np.asarray(y_err, dtype=float)
+        assert len(y_err) == n
+
+    profiler = Profiler(enabled=bool(profile), memory=profile == 'memory', engine=engine)
+
+    with profiler.phase('linear_deviations'):
+        linear_deviations = complete_linear_deviations(linear_deviations, x, with_variables=False)
+
+    with profiler.phase('operators'):
+        if operators is None:
+            operators = get_operators(x)
+
+    isig = get_isig(y, y_err, mask=get_mask(y, y_err=y_err, mask=mask))
+
+    # the points with zero weight may be missing
+    y_data = np.where(isig > 0, y, 0.0)
+
+    with profiler.phase('solve'):
+        solution = ENGINES[engine](x, y_data, isig, alpha_1=alpha_1, alpha_2=alpha_2,
+                                   l_norm=l_norm, constrain_zero=constrain_zero,
+                                   monotonic=monotonic, positive=positive,
+                                   linear_deviations=linear_deviations,
+                                   operators=operators, **engine_options)
+
+    profiler.record_solver_info(solution['solver_info'])
+
+    with profiler.phase('interpolation'):
+        tf_result = get_numeric_result(x, y_data, y_err, isig, solution['base_model'],
+                                       solution['deviation_values'], linear_deviations,
+                                       l_norm, alpha_1, alpha_2, engine,
+                                       solution['solver_info'], operators=operators)
+    tf_result['y'] = y
+
+    return profiler.finish(tf_result)
@@ -1,5 +1,5 @@
-from scipy.interpolate import interp1d
 import numpy as np
+from trendfilter.linear_deviations import get_deviation_memberships, deviation_contribution
 
 
 def vectorize(func_orig):
@@ -20,33 +20,159 @@ def vectorize(func_orig):
     return func
 
 
+def vectorize_array(func_array):
+    """
+    A function that takes a function of a 1-D numpy array and
+    returns another that can run on scalars, lists and arrays.
+    Scalars give scalars, lists give lists and arrays give arrays
+    of the same shape, as with vectorize, but the function is only
+    called once. The array keeps the dtype of x_new, so mappings can
+    still index with integer x.
+    :param func_array: function of a 1-D numpy array
+    :return: vectorized function
+    """
+    def func(x_new):
+        values = func_array(np.asarray(x_new).ravel())
+
+        if isinstance(x_new, list):
+            return list(values)
+
+        if isinstance(x_new, np.ndarray):
+            return values.reshape(x_new.shape)
+
+        return values[0]
+    return func
+
+
+def interp_extrapolate(x, values, x_new):
+    """
+    Linear interpolation which extrapolates linearly from the
+    first and last segments, like interp1d with fill_value="extrapolate"
+    :param x: sorted numpy array of x values
+    :param values: numpy array of values at x
+    :param x_new: numpy array of x values to evaluate at
+    :return: numpy array
+    """
+    result = np.interp(x_new, x, values)
+
+    below = x_new < x[0]
+    if below.any():
+        slope = (values[1] - values[0]) / (x[1] - x[0])
+        result[below] = values[0] + slope * (x_new[below] - x[0])
+
+    above = x_new > x[-1]
+    if above.any():
+        slope = (values[-1] - values[-2]) / (x[-1] - x[-2])
+        result[above] = values[-1] + slope * (x_new[above] - x[-1])
+
+    return result
+
+
+def interpolation_matrix(x, x_new):
+    """
+    The matrix M such that M @ values is interp_extrapolate(x, values, x_new),
+    so many sets of values on the same x can be evaluated at once
+    :param x: sorted numpy array of x values, at least two
+    :param x_new: numpy array of x values to evaluate at
+    :return: sparse CSR matrix of shape (len(x_new), len(x))
+    """
+    # imported here as the rest of the module only needs numpy
+    from scipy.sparse import csr_matrix
+
+    x = np.asarray(x, dtype=float)
+    x_new = np.asarray(x_new, dtype=float)
+    left = np.clip(np.searchsorted(x, x_new, side='right') - 1, 0, len(x) - 2)
+    t = (x_new - x[left]) / (x[left + 1] - x[left])
+
+    rows = np.repeat(np.arange(len(x_new)), 2)
+    cols = np.column_stack([left, left + 1]).ravel()
+    return csr_matrix((np.column_stack([1 - t, t]).ravel(), (rows, cols)),
+                      shape=(len(x_new), len(x)))
+
+
+def get_deviation_lookup(x, linear_deviation, values):
+    """
+    Get a function returning the deviation contribution for an array of x.
+    If there is a mapping it gives the indices to the values.
+    If there is only a matrix, it can only be evaluated at the original x.
+    :param x: the x data
+    :param linear_deviation: completed linear deviation object
+    :param values: the fitted values of the deviation variables
+    :return: function of a 1-D numpy array
+    """
+    if 'mapping' in linear_deviation:
+        mapping = linear_deviation['mapping']
+
+        def lookup(x_new):
+            indices, weights = get_deviation_memberships(x_new, mapping)
+            return deviation_contribution(values, indices, weights)
+
+        return lookup
+
+    x = np.asarray(x, dtype=float)
+    contribution = np.asarray(linear_deviation['matrix'] @ values).ravel()
+
+    def lookup_matrix(x_new):
+        index = np.clip(np.searchsorted(x, x_new), 0, len(x) - 1)
+        if not np.array_equal(x[index], x_new):
+            raise ValueError("Linear deviation '%s' has no mapping so can only be "
+                             "evaluated at the original x" % linear_deviation['name'])
+
+        return contribution[index]
+
+    return lookup_matrix
+
+
 def get_interp_extrapolate_functions(x, base_model, linear_deviations):
     """
     Get the three interp/extrapolation model functions:
         base function, deviates function, total model function
+    Each is evaluated for a whole array at once.
     :param x: the x data
-    :param base_model: model model cvxpy expression
-    :param linear_deviations: list of completed linear_deviations objects
+    :param base_model: model model cvxpy expression or numpy array of values
+    :param linear_deviations: list of completed linear_deviations objects,
+        either with a cvxpy 'variable' or with numpy 'values'
     :return:  base function, deviates function, total model function
     """
 
-    # TODO: this requires mapping to be given, make it work with matrix only
-    interp_base_model_func = interp1d(x, base_model.value, fill_value="extrapolate")
+    if isinstance(base_model, np.ndarray):
+        base_values = base_model
+    else:
+        base_values = base_model.value
+
+    x = np.asarray(x, dtype=float)
+    order = np.argsort(x, kind='stable')
+    x_sorted = x[order]
+
+    # take copies of the values now so the functions don't change
+    # if the variables are later re-solved
+    base_sorted = np.array(base_values, dtype=float)[order]
+    lookups = [get_deviation_lookup(x, lin_dev, get_deviation_values(lin_dev).copy())
+               for lin_dev in linear_deviations]
 
     def func_base(x_new):
-        return interp_base_model_func(x_new)
+        return interp_extrapolate(x_sorted, base_sorted, x_new)
 
     def func_deviates(x_new):
-        linear_dev_value = 0.0
-        for lin_dev in linear_deviations:
-            index = lin_dev['mapping'](x_new)
-            var = lin_dev['variable'].value
-            value = var[index]
-            linear_dev_value += value
+        linear_dev_value = np.zeros(len(x_new))
+        for lookup in lookups:
+            linear_dev_value += lookup(x_new)
 
         return linear_dev_value
 
     def func(x_new):
         return func_base(x_new) + func_deviates(x_new)
 
-    return vectorize(func_base), vectorize(func_deviates), vectorize(func)
+    return vectorize_array(func_base), vectorize_array(func_deviates), vectorize_array(func)
+
+
+def get_deviation_values(linear_deviation):
+    """
+    The fitted values of a completed linear deviation
+    :param linear_deviation: completed linear deviation object
+    :return: numpy array
+    """
+    if 'values' in linear_deviation:
+        return linear_deviation['values']
+
+    return linear_deviation['variable'].value
@@ -0,0 +1,352 @@
+"""
+A compact fitted trend that only holds numpy arrays
+
+The trend_filter result holds the cvxpy problem, variables and
+closures. A FittedTrend keeps just what is needed to predict, so it
+is small, pickles cheaply and can be saved to .npz or to a directory
+of .npy files that are memory-mapped on load.
+"""
+
+import os
+import json
+import numpy as np
+from scipy.sparse import csr_matrix
+from trendfilter.extrapolate import interp_extrapolate, vectorize_array, \
+    get_deviation_values
+from trendfilter.linear_deviations import get_deviation_memberships, deviation_contribution
+
+METADATA_FILE = 'metadata.json'
+
+
+class FittedTrend:
+    """
+    A fitted trend filter model. The base model is interpolated and
+    extrapolated linearly. Each linear deviation is a set of coefficients
+    and the memberships of each fitted x, the index of its coefficient or,
+    for several weighted memberships, padded indices and weights as in
+    membership_matrix. At new x the memberships come from the deviation's
+    mapping, when one is attached.
+    """
+
+    __slots__ = ('x', 'base', 'deviation_names', 'deviation_values',
+                 'deviation_indices', 'deviation_weights', 'mappings', 'metadata', 'debug')
+
+    def __init__(self, x, base, deviation_names=None, deviation_values=None,
+                 deviation_indices=None, mappings=None, metadata=None, debug=None,
+                 deviation_weights=None):
+        """
+        :param x: The x-value, numpy array, sorted
+        :param base: The base model at x, numpy array
+        :param deviation_names: list of linear deviation names
+        :param deviation_values: list of numpy arrays of coefficients
+        :param deviation_indices: list of integer numpy arrays, the coefficient
+            index for each x, or shape (len(x), k) for up to k memberships
+            padded with -1
+        :param mappings: optional list of mapping functions, or None, one per
+            linear deviation. These are not saved.
+        :param metadata: dict of JSON-serializable fit information
+        :param debug: optional trend_filter result, not saved
+        :param deviation_weights: optional list of numpy arrays of weights
+            the same shape as the indices, or None for weights of 1,
+            one per linear deviation
+        """
+        if deviation_names is None:
+            deviation_names = []
+            deviation_values = []
+            deviation_indices = []
+
+        if mappings is None:
+            mappings = [None] * len(deviation_names)
+
+        if deviation_weights is None:
+            deviation_weights = [None] * len(deviation_names)
+
+        assert len(x) == len(base)
+        assert len(deviation_values) == len(deviation_names)
+        assert len(deviation_indices) == len(deviation_names)
+        assert len(deviation_weights) == len(deviation_names)
+        assert len(mappings) == len(deviation_names)
+
+        self.x = x
+        self.base = base
+        self.deviation_names = list(deviation_names)
+        self.deviation_values = list(deviation_values)
+        self.deviation_indices = list(deviation_indices)
+        self.deviation_weights = list(deviation_weights)
+        self.mappings = list(mappings)
+        self.metadata = metadata or {}
+        self.debug = debug
+
+    @classmethod
+    def from_result(cls, tf_result, metadata=None, debug=False):
+        """
+        Make a FittedTrend from a trend_filter result
+        :param tf_result: The fit model information from trend_filter
+            or any of the engines
+        :param metadata: dict of JSON-serializable fit information
+        :param debug: If True, keep the full result as .debug
+        :return: FittedTrend
+        """
+        x = np.asarray(tf_result['x'], dtype=float)
+        base_model = tf_result['base_model']
+        if not isinstance(base_model, np.ndarray):
+            base_model = base_model.value
+
+        objective = tf_result['objective_total']
+        objective = getattr(objective, 'value', objective)
+        if base_model is None or objective is None:
+            raise ValueError('The fit has no solution, the solver failed or '
+                             'the problem is infeasible')
+
+        order = np.argsort(x, kind='stable')
+
+        names, values, indices, weights, mappings = [], [], [], [], []
+        for lin_dev in tf_result['linear_deviations']:
+            names.append(lin_dev['name'])
+            values.append(np.array(get_deviation_values(lin_dev), dtype=float))
+            dev_indices, dev_weights = matrix_memberships(lin_dev['matrix'])
+            indices.append(dev_indices[order])
+            weights.append(None if dev_weights is None else dev_weights[order])
+            mappings.append(lin_dev.get('mapping'))
+
+        metadata = dict(metadata or {})
+        metadata.setdefault('engine', tf_result.get('engine', 'cvxpy'))
+        metadata.setdefault('objective', float(objective))
+
+        return cls(x[order], np.array(base_model, dtype=float)[order],
+                   deviation_names=names, deviation_values=values,
+                   deviation_indices=indices, mappings=mappings,
+                   metadata=metadata, debug=tf_result if debug else None,
+                   deviation_weights=weights)
+
+    def predict(self, x_new, deviation_indices=None, deviations=True):
+        """
+        Evaluate the model at new x for a whole array at once
+        :param x_new: scalar, list or numpy array
+        :param deviation_indices: optional dict of linear deviation name to
+            integer indices for x_new, or a tuple of indices and weights
+            as a mapping can return. Needed for linear deviations without
+            a mapping at x other than the fitted x.
+        :param deviations: If False, only the base model
+        :return: same type and shape as x_new
+        """
+        def predict_array(x_array):
+            values = interp_extrapolate(self.x, self.base, x_array)
+            if deviations:
+                values += self._deviations(x_array, deviation_indices or {})
+            return values
+
+        return vectorize_array(predict_array)(x_new)
+
+    def predict_base(self, x_new):
+        """
+        Evaluate the base model at new x
+        :param x_new: scalar, list or numpy array
+        :return: same type and shape as x_new
+        """
+        return self.predict(x_new, deviations=False)
+
+    def _deviations(self, x_new, deviation_indices):
+        total = np.zeros(len(x_new))
+        for name, values, indices, fitted_weights, mapping in zip(
+                self.deviation_names, self.deviation_values, self.deviation_indices,
+                self.deviation_weights, self.mappings):
+            weights = None
+            if name in deviation_indices:
+                index = deviation_indices[name]
+                if isinstance(index, tuple):
+                    index, weights = index
+                index = np.asarray(index, dtype=int)
+            elif mapping is not None:
+                index, weights = get_deviation_memberships(x_new, mapping)
+            else:
+                position = np.clip(np.searchsorted(self.x, x_new), 0, len(self.x) - 1)
+                if not np.array_equal(self.x[position], x_new):
+                    raise ValueError("Linear deviation '%s' has no mapping so can only be "
+                                     "evaluated at the fitted x or with deviation_indices"
+                                     % name)
+                index = indices[position]
+                if fitted_weights is not None:
+                    weights = fitted_weights[position]
+
+            total += deviation_contribution(values, index, weights)
+
+        return total
+
+    @property
+    def nbytes(self):
+        """
+        Total size of the arrays in bytes
+        """
+        arrays = [self.x, self.base] + self.deviation_values + self.deviation_indices + \
+            [weights for weights in self.deviation_weights if weights is not None]
+        return sum(array.nbytes for array in arrays)
+
+    def save(self, path, compressed=False):
+        """
+        Save the arrays and metadata. Mappings and debug are not saved.
+        :param path: a file ending in .npz, or a directory which will
+            hold one .npy file per array and can be memory-mapped on load
+        :param compressed: If True, compress the .npz file
+        """
+        arrays = {'x': self.x, 'base': self.base}
+        for i, (values, indices, weights) in enumerate(zip(self.deviation_values,
+                                                           self.deviation_indices,
+                                                           self.deviation_weights)):
+            arrays['deviation_values_%s' % i] = values
+            arrays['deviation_indices_%s' % i] = indices
+            if weights is not None:
+                arrays['deviation_weights_%s' % i] = weights
+
+        metadata = {'deviation_names': self.deviation_names, 'metadata': self.metadata}
+
+        if str(path).endswith('.npz'):
+            save = np.savez_compressed if compressed else np.savez
+            save(path, metadata=np.array(json.dumps(metadata)), **arrays)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+        with open(os.path.join(path, METADATA_FILE), 'w') as fp:
+            json.dump(metadata, fp)
+
+    @classmethod
+    def load(cls, path, mappings=None, mmap=True):
+        """
+        Load a FittedTrend saved with save
+        :param path: the .npz file or directory
+        :param mappings: optional dict of linear deviation name to mapping
+            function, for predicting at new x
+        :param mmap: If True, memory-map the arrays of a directory
+            rather than reading them
+        :return: FittedTrend
+        """
+        if str(path).endswith('.npz'):
+            with np.load(path) as data:
+                metadata = json.loads(str(data['metadata']))
+                arrays = {name: data[name] for name in data.files if name != 'metadata'}
+        else:
+            with open(os.path.join(path, METADATA_FILE)) as fp:
+                metadata = json.load(fp)
+
+            mmap_mode = 'r' if mmap else None
+            arrays = {}
+            for filename in os.listdir(path):
+                if filename.endswith('.npy'):
+                    arrays[filename[:-4]] = np.load(os.path.join(path, filename),
+                                                    mmap_mode=mmap_mode)
+
+        names = metadata['deviation_names']
+        mappings = mappings or {}
+        return cls(arrays['x'], arrays['base'], deviation_names=names,
+                   deviation_values=[arrays['deviation_values_%s' % i] for i in range(len(names))],
+                   deviation_indices=[arrays['deviation_indices_%s' % i] for i in range(len(names))],
+                   mappings=[mappings.get(name) for name in names],
+                   metadata=metadata['metadata'],
+                   deviation_weights=[arrays.get('deviation_weights_%s' % i)
+                                      for i in range(len(names))])
+
+    def to_dict(self):
+        """
+        The arrays as lists and the metadata, so it can be sent as JSON.
+        Mappings and debug are not included.
+        :return: dict
+        """
+        return {'x': self.x.tolist(),
+                'base': self.base.tolist(),
+                'deviation_names': self.deviation_names,
+                'deviation_values': [values.tolist() for values in self.deviation_values],
+                'deviation_indices': [indices.tolist() for indices in self.deviation_indices],
+                'deviation_weights': [None if weights is None else weights.tolist()
+                                      for weights in self.deviation_weights],
+                'metadata': self.metadata}
+
+    @classmethod
+    def from_dict(cls, data, mappings=None):
+        """
+        Make a FittedTrend from the output of to_dict
+        :param data: dict
+        :param mappings: optional dict of linear deviation name to mapping
+            function, for predicting at new x
+        :return: FittedTrend
+        """
+        names = data['deviation_names']
+        mappings = mappings or {}
+        return cls(np.asarray(data['x'], dtype=float), np.asarray(data['base'], dtype=float),
+                   deviation_names=names,
+                   deviation_values=[np.asarray(values, dtype=float)
+                                     for values in data['deviation_values']],
+                   deviation_indices=[np.asarray(indices, dtype=int)
+                                      for indices in data['deviation_indices']],
+                   mappings=[mappings.get(name) for name in names],
+                   metadata=data['metadata'],
+                   deviation_weights=[None if weights is None else np.asarray(weights, dtype=float)
+                                      for weights in data.get('deviation_weights',
+                                                              [None] * len(names))])
+
+    def __getstate__(self):
+        # the debug result holds cvxpy objects so isn't pickled
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'debug'}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.debug = None
+
+    def __repr__(self):
+        return 'FittedTrend(n=%s, deviations=%s)' % (len(self.x), self.deviation_names)
+
+
+def matrix_memberships(matrix):
+    """
+    The memberships of each row of a deviation matrix, the inverse
+    of membership_matrix
+    :param matrix: scipy sparse matrix
+    :return: (integer numpy array of the column of each row, None) when
+        each row has a single 1, otherwise (indices, weights) of shape
+        (n, k) for up to k memberships per row, padded with -1 and 0
+    """
+    matrix = csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    counts = np.diff(matrix.indptr)
+    if np.all(counts == 1) and np.all(matrix.data == 1):
+        return matrix.indices.astype(int), None
+
+    n = matrix.shape[0]
+    k = max(int(counts.max()) if n else 0, 1)
+    rows = np.repeat(np.arange(n), counts)
+    positions = np.arange(len(matrix.indices)) - matrix.indptr[rows]
+    indices = np.full((n, k), -1, dtype=int)
+    weights = np.zeros((n, k))
+    indices[rows, positions] = matrix.indices
+    weights[rows, positions] = matrix.data
+    return indices, weights
+
+
+def fit_trend(x, y, y_err=None, debug=False, **kwargs):
+    """
+    Same as trend_filter but returns a FittedTrend
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param debug: If True, keep the full trend_filter result,
+        with the cvxpy objects, as .debug
+    :param kwargs: keyword arguments for trend_filter
+    :return: FittedTrend
+    """
+    # imported here as only fitting needs the cvxpy modeling layer
+    from trendfilter.trendfilter import trend_filter
+    tf_result = trend_filter(x, y, y_err=y_err, **kwargs)
+
+    metadata = {'n': len(x)}
+    for key in ['alpha_1', 'alpha_2', 'l_norm', 'constrain_zero', 'monotonic',
+                'positive', 'solver', 'engine']:
+        if key in kwargs:
+            metadata[key] = kwargs[key]
+
+    alphas = {lin_dev['name']: lin_dev['alpha'] for lin_dev in tf_result['linear_deviations']}
+    metadata['deviation_alphas'] = {name: float(alpha) for name, alpha in alphas.items()}
+
+    return FittedTrend.from_result(tf_result, metadata=metadata, debug=debug)
@@ -23,8 +23,12 @@ def get_example_data():
 def deviation_mapping(index):
     # assume data points are monthly values
     # maps the x data point to the right linear
-    index = int(index)
     # deviation variable
+    # works on arrays too, which is much faster for long series
+    if np.ndim(index):
+        return np.asarray(index).astype(int) % 12
+
+    index = int(index)
     return index % 12
 
 
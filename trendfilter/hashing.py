@@ -0,0 +1,54 @@
+"""
+Fast content hashes of arrays
+"""
+
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import numpy as np
+
+
+def hash_array(array):
+    """
+    A fast content hash of a numpy array
+    :param array: numpy array or anything that can be made into one
+    :return: hex digest string
+    """
+    array = np.ascontiguousarray(array)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(str(array.dtype).encode())
+    hasher.update(str(array.shape).encode())
+    hasher.update(array.tobytes())
+    return hasher.hexdigest()
+
+
+def memoize_on_array(maxsize=32):
+    """
+    Decorator to memoize a function whose first argument is an array
+    and whose other arguments are hashable. Keyed on the content of
+    the array. The cached results are shared so treat them as read-only.
+    :param maxsize: the maximum number of cached results, least
+        recently used are dropped first
+    :return: decorator
+    """
+    def decorator(func):
+        cache = OrderedDict()
+
+        @wraps(func)
+        def memoized(array, *args, **kwargs):
+            key = (hash_array(np.asarray(array)), args, tuple(sorted(kwargs.items())))
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+
+            result = func(array, *args, **kwargs)
+            cache[key] = result
+            if len(cache) > maxsize:
+                cache.popitem(last=False)
+
+            return result
+
+        memoized.cache = cache
+        return memoized
+
+    return decorator
@@ -1,21 +1,211 @@
 import numpy as np
-import cvxpy
-from scipy.sparse import dok_matrix
+from scipy.sparse import csr_matrix
 
 
-def get_model_deviation_matrix(x, deviation_mapping, n_deviates):
-    num_x = len(x)
-    matrix = dok_matrix((num_x, n_deviates), dtype=np.float32)
-    for i, xx in enumerate(x):
-        j = deviation_mapping(xx)
-        assert isinstance(j, int)
-        assert j < n_deviates
-        matrix[i, j] = 1.0
+def get_deviation_indices(x, deviation_mapping):
+    """
+    Apply the mapping to get the deviation index for each x.
+    An array-aware mapping is called once on the whole array,
+    otherwise it is called per point.
+    :param x: The x-value, numpy array
+    :param deviation_mapping: function from x to integer index
+    :return: integer numpy array of indices
+    """
+    x = np.asarray(x)
+    return _indices_from_result(x, deviation_mapping, _map_array(x, deviation_mapping))
+
+
+def get_deviation_memberships(x, deviation_mapping):
+    """
+    Apply a mapping that may give several weighted memberships per point.
+    An array-aware mapping can return an integer array of shape (len(x), k)
+    for k memberships per point, with -1 for none, or a tuple of that
+    and an array of weights of the same shape. Otherwise it is
+    treated as in get_deviation_indices.
+    :param x: The x-value, numpy array
+    :param deviation_mapping: function from x to indices
+    :return: (integer numpy array of indices, weights numpy array or None)
+    """
+    x = np.asarray(x)
+    result = _map_array(x, deviation_mapping)
+
+    weights = None
+    if isinstance(result, tuple):
+        result, weights = result
+        weights = np.asarray(weights, dtype=float)
+
+    indices = None if result is None else np.asarray(result)
+    if indices is not None and indices.ndim in [1, 2] and len(indices) == len(x) and \
+            np.issubdtype(indices.dtype, np.integer):
+        assert weights is None or weights.shape == indices.shape
+        return indices, weights
+
+    # re-use the array result rather than calling the mapping again
+    return _indices_from_result(x, deviation_mapping, indices), None
+
+
+def _map_array(x, deviation_mapping):
+    # a mapping that only takes scalars may raise any of these on an array
+    try:
+        return deviation_mapping(x)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _indices_from_result(x, deviation_mapping, result):
+    # the array result if it has an index per point, otherwise per point
+    indices = None if result is None else np.asarray(result)
+    if indices is None or indices.shape != x.shape or \
+            not np.issubdtype(indices.dtype, np.integer):
+        indices = np.empty(len(x), dtype=int)
+        for i, xx in enumerate(x):
+            j = deviation_mapping(xx)
+            assert isinstance(j, (int, np.integer))
+            indices[i] = j
 
+    return indices
+
+
+def membership_matrix(indices, n_vars, weights=None):
+    """
+    The assignment matrix of points to deviation variables,
+    built without a loop over the points
+    :param indices: integer numpy array, shape (n,) for one membership per
+        point or (n, k) for up to k, with -1 for none
+    :param n_vars: number of deviation variables
+    :param weights: optional numpy array of weights, the same shape as indices.
+        Defaults to 1.
+    :return: sparse CSR matrix of shape (n, n_vars)
+    """
+    indices = np.asarray(indices)
+    assert np.issubdtype(indices.dtype, np.integer)
+    assert (indices < n_vars).all()
+
+    num_x = len(indices)
+    if indices.ndim == 1 and weights is None:
+        assert (indices >= 0).all()
+        data = np.ones(num_x)
+        return csr_matrix((data, indices, np.arange(num_x + 1)), shape=(num_x, n_vars))
+
+    indices = indices.reshape(num_x, -1)
+    if weights is None:
+        weights = np.ones(indices.shape)
+    weights = np.asarray(weights, dtype=float).reshape(indices.shape)
+    assert (indices >= -1).all()
+
+    member = indices >= 0
+    rows = np.broadcast_to(np.arange(num_x)[:, None], indices.shape)
+    matrix = csr_matrix((weights[member], (rows[member], indices[member])),
+                        shape=(num_x, n_vars))
+    matrix.sum_duplicates()
     return matrix
 
 
-def complete_linear_deviation(linear_deviation, x, default_name):
+def deviation_contribution(values, indices, weights=None):
+    """
+    The model contribution of a linear deviation from its memberships,
+    the same as membership_matrix(indices, len(values), weights) @ values
+    :param values: numpy array of deviation values
+    :param indices: integer numpy array, see membership_matrix
+    :param weights: optional numpy array of weights, see membership_matrix
+    :return: numpy array, one value per point
+    """
+    indices = np.asarray(indices)
+    if indices.ndim == 1 and weights is None:
+        return values[indices]
+
+    indices = indices.reshape(len(indices), -1)
+    contributions = np.where(indices >= 0, values[np.maximum(indices, 0)], 0.0)
+    if weights is not None:
+        contributions = contributions * np.asarray(weights).reshape(indices.shape)
+
+    return contributions.sum(axis=1)
+
+
+def get_model_deviation_matrix(x, deviation_mapping, n_deviates):
+    """
+    The assignment matrix of points to deviation variables
+    :param x: The x-value, numpy array
+    :param deviation_mapping: function from x to integer index,
+        preferably array-aware, see get_deviation_memberships
+    :param n_deviates: number of deviation variables
+    :return: sparse CSR matrix of shape (len(x), n_deviates)
+    """
+    indices, weights = get_deviation_memberships(x, deviation_mapping)
+    return membership_matrix(indices, n_deviates, weights=weights)
+
+
+def build_deviation_matrix(linear_deviation, x):
+    """
+    The matrix of a linear deviation, given directly, from precomputed
+    'indices' (and optional 'weights') for each x, or from the mapping
+    :param linear_deviation: linear deviation object
+    :param x: The x-value, numpy array
+    :return: sparse matrix of shape (len(x), n_vars)
+    """
+    if 'matrix' in linear_deviation:
+        return linear_deviation['matrix']
+
+    assert 'n_vars' in linear_deviation
+    if 'indices' in linear_deviation:
+        assert len(linear_deviation['indices']) == len(x)
+        return membership_matrix(linear_deviation['indices'], linear_deviation['n_vars'],
+                                 weights=linear_deviation.get('weights'))
+
+    assert 'mapping' in linear_deviation
+    return get_model_deviation_matrix(x, linear_deviation['mapping'], linear_deviation['n_vars'])
+
+
+def slice_deviation(linear_deviation, index):
+    """
+    A copy of the linear deviation for a subset of the points,
+    with the matrix, indices and weights sliced
+    :param linear_deviation: linear deviation object
+    :param index: slice or integer numpy array of the points
+    :return: linear deviation object
+    """
+    lin_dev = linear_deviation.copy()
+    for key in ['matrix', 'indices', 'weights']:
+        if lin_dev.get(key) is not None:
+            lin_dev[key] = lin_dev[key][index]
+
+    return lin_dev
+
+
+def add_deviation_matrix(linear_deviation, x):
+    """
+    Return a copy of the linear deviation that includes the matrix,
+    building it if it wasn't given, see build_deviation_matrix
+    :param linear_deviation: linear deviation object
+    :param x: The x-value, numpy array
+    :return: copy of linear deviation object with a 'matrix'
+    """
+    lin_dev = linear_deviation.copy()
+    lin_dev['matrix'] = build_deviation_matrix(lin_dev, x)
+
+    return lin_dev
+
+
+def matrix_only_deviations(linear_deviations, x):
+    """
+    Copies of the linear deviations with the matrix built and the
+    mapping and indices dropped, so they can be pickled and sent to
+    other processes and sliced
+    :param linear_deviations: list of linear deviation objects
+    :param x: The x-value, numpy array
+    :return: list of linear deviation objects
+    """
+    lin_devs = []
+    for lin_dev in linear_deviations:
+        lin_dev = add_deviation_matrix(lin_dev, x)
+        for key in ['mapping', 'indices', 'weights']:
+            lin_dev.pop(key, None)
+        lin_devs.append(lin_dev)
+
+    return lin_devs
+
+
+def complete_linear_deviation(linear_deviation, x, default_name, with_variables=True):
     assert 'n_vars' in linear_deviation
     lin_dev = linear_deviation.copy()
 
@@ -27,26 +217,35 @@ def complete_linear_deviation(linear_deviation, x, default_name):
 
     assert lin_dev['alpha'] >= 0.0
 
-    if 'matrix' not in linear_deviation:
-        assert 'mapping' in lin_dev
-        matrix = get_model_deviation_matrix(x, lin_dev['mapping'], lin_dev['n_vars'])
-        lin_dev['matrix'] = matrix
+    lin_dev['matrix'] = build_deviation_matrix(lin_dev, x)
 
     if 'positive' not in lin_dev:
         lin_dev['positive'] = False
 
-    lin_dev['variable'] = cvxpy.Variable(lin_dev['n_vars'], pos=lin_dev['positive'])
-    lin_dev['model_contribution'] = lin_dev['matrix'] @ lin_dev['variable']
+    if with_variables:
+        # imported here so the numpy engines don't need cvxpy
+        import cvxpy
+        lin_dev['variable'] = cvxpy.Variable(lin_dev['n_vars'], pos=lin_dev['positive'])
+        lin_dev['model_contribution'] = lin_dev['matrix'] @ lin_dev['variable']
 
     return lin_dev
 
 
-def complete_linear_deviations(linear_deviations, x):
+def complete_linear_deviations(linear_deviations, x, with_variables=True):
+    """
+    Fill in the defaults and the matrix for each linear deviation
+    :param linear_deviations: list of linear deviation objects
+    :param x: The x-value, numpy array
+    :param with_variables: If True, add the cvxpy variable and model contribution.
+        Engines that don't use cvxpy set this to False.
+    :return: list of completed linear deviations
+    """
     completed_devs = []
     names = set()
     for i, linear_deviation in enumerate(linear_deviations):
         default_name = 'linear_deviation_%s' % i
-        completed = complete_linear_deviation(linear_deviation, x, default_name)
+        completed = complete_linear_deviation(linear_deviation, x, default_name,
+                                              with_variables=with_variables)
 
         # ensure unique names
         assert completed['name'] not in names
@@ -0,0 +1,147 @@
+"""
+Coarse-to-fine fitting for very long series
+
+The series is fit on a decimated x grid first. That solution is
+interpolated onto the next finer grid as the warm start, and so on
+up to the full grid. The operators are built for each grid with the
+non-equally spaced derivatives so any decimation works.
+"""
+
+import time
+import numpy as np
+from trendfilter.engines import trend_filter_engine
+from trendfilter.extrapolate import interp_extrapolate, get_interp_extrapolate_functions
+from trendfilter.linear_deviations import matrix_only_deviations
+
+
+def get_levels(n, factor=4, min_points=1000):
+    """
+    The indices of the points in each grid, coarsest first.
+    Every factor-th point is kept at each level, always including
+    the first and last points.
+    :param n: number of points
+    :param factor: decimation factor between levels
+    :param min_points: the coarsest grid has at least this many points
+    :return: list of integer numpy arrays, the last is all the points
+    """
+    assert factor >= 2
+
+    levels = [np.arange(n)]
+    step = factor
+    while n // step >= min_points:
+        levels.append(np.unique(np.append(np.arange(0, n, step), n - 1)))
+        step *= factor
+
+    return levels[::-1]
+
+
+def trend_filter_multiresolution(x, y, y_err=None, alpha_1=0.0, alpha_2=0.0,
+                                 l_norm=2, constrain_zero=False, monotonic=False,
+                                 positive=False, linear_deviations=None,
+                                 engine=None, engine_options=None,
+                                 factor=4, min_points=1000, check=False, mask=None):
+    """
+    Fit coarse-to-fine, warm-starting each level from the one before
+    :param x: The x-value, numpy array, sorted
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param alpha_1: see trend_filter
+    :param alpha_2: see trend_filter
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter
+    :param engine: one of the engines that takes a warm start, 'admm',
+        'banded' or 'qp'. Defaults to 'banded' where it supports
+        the options, otherwise 'admm'. For l_norm=2, 'qp' uses OSQP
+        unless another solver is given, as Clarabel has no warm start.
+        OSQP is slow to converge for l_norm=1 so is not the default.
+    :param engine_options: dict of keyword arguments for the engine
+    :param factor: decimation factor between levels
+    :param min_points: the coarsest grid has at least this many points
+    :param check: If True, also fit the full grid directly, without
+        the warm start, and compare
+    :param mask: see trend_filter
+    :return: The fit model information for the full grid, see trend_filter,
+        with 'levels', a list of dicts with n, seconds, iterations
+        and objective for each level, and 'check' if requested
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if engine is None:
+        banded_ok = l_norm == 2 and not monotonic and not positive and \
+            not (constrain_zero and linear_deviations)
+        engine = 'banded' if banded_ok else 'admm'
+
+    assert engine in ['admm', 'banded', 'qp'], 'The engine must take a warm start'
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if y_err is None:
+        y_err = np.ones(n)
+
+    # the matrices can be sliced for each level
+    original_deviations = linear_deviations
+    linear_deviations = matrix_only_deviations(linear_deviations, x)
+
+    options = {'alpha_1': alpha_1, 'alpha_2': alpha_2, 'l_norm': l_norm,
+               'constrain_zero': constrain_zero, 'monotonic': monotonic,
+               'positive': positive, 'engine': engine}
+
+    if engine == 'qp' and l_norm == 2:
+        engine_options = dict({'solver': 'OSQP'}, **(engine_options or {}))
+
+    levels = []
+    result = None
+    x_previous = None
+    start = time.perf_counter()
+    for index in get_levels(n, factor=factor, min_points=min_points):
+        level_options = dict(engine_options or {})
+        if result is not None:
+            level_options['warm_start'] = interp_extrapolate(x_previous, result['base_model'],
+                                                             x[index])
+
+        lin_devs = [dict(lin_dev, matrix=lin_dev['matrix'][index]) for lin_dev in linear_deviations]
+
+        level_start = time.perf_counter()
+        result = trend_filter_engine(x[index], y[index], y_err=y_err[index],
+                                     mask=None if mask is None else mask[index],
+                                     linear_deviations=lin_devs,
+                                     engine_options=level_options, **options)
+        levels.append({'n': len(index),
+                       'seconds': time.perf_counter() - level_start,
+                       'iterations': result['solver_info'].get('iterations'),
+                       'objective': result['objective_total']})
+        x_previous = x[index]
+
+    # put back the mappings so the functions can extrapolate the
+    # linear deviations as trend_filter's do
+    result['linear_deviations'] = [
+        dict(lin_dev, **{key: original[key] for key in ['mapping', 'indices', 'weights']
+                         if key in original})
+        for lin_dev, original in zip(result['linear_deviations'], original_deviations)]
+    result['function_base'], result['function_deviates'], result['function'] = \
+        get_interp_extrapolate_functions(x, result['base_model'], result['linear_deviations'])
+    result['levels'] = levels
+
+    if check:
+        seconds = time.perf_counter() - start
+        direct_start = time.perf_counter()
+        direct = trend_filter_engine(x, y, y_err=y_err, mask=mask,
+                                     linear_deviations=linear_deviations,
+                                     engine_options=engine_options, **options)
+        direct_seconds = time.perf_counter() - direct_start
+        difference = result['objective_total'] - direct['objective_total']
+        result['check'] = {'objective': result['objective_total'],
+                           'direct_objective': direct['objective_total'],
+                           'relative_difference': difference / abs(direct['objective_total']),
+                           'max_model_difference': float(np.abs(result['y_fit'] -
+                                                                direct['y_fit']).max()),
+                           'seconds': seconds,
+                           'direct_seconds': direct_seconds,
+                           'direct_iterations': direct['solver_info'].get('iterations')}
+
+    return result
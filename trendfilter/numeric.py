@@ -0,0 +1,132 @@
+"""
+Numpy versions of the trend filter objective and result
+for the engines that don't go through cvxpy
+"""
+
+import numpy as np
+from trendfilter.extrapolate import get_interp_extrapolate_functions
+from trendfilter.derivatives import get_operators
+
+
+def huber(x):
+    """
+    The Huber function with M=1, same as cvxpy.huber
+    :param x: numpy array
+    :return: numpy array
+    """
+    ax = np.abs(x)
+    return np.where(ax <= 1.0, x ** 2, 2.0 * ax - 1.0)
+
+
+def norm_value(x, l_norm):
+    """
+    Value of the regularization norm, sum of squares for L2
+    as used in get_reg
+    :param x: numpy array
+    :param l_norm: 1 or 2
+    :return: float
+    """
+    if l_norm == 2:
+        return float(np.sum(x ** 2))
+
+    return float(np.sum(np.abs(x)))
+
+
+def get_model_values(base_model, linear_deviations, deviation_values):
+    """
+    The model, base model plus linear deviations
+    :param base_model: numpy array
+    :param linear_deviations: list of completed linear deviations
+    :param deviation_values: list of numpy arrays, one per linear deviation
+    :return: numpy array
+    """
+    model = np.array(base_model, dtype=float, copy=True)
+    for lin_dev, values in zip(linear_deviations, deviation_values):
+        model += lin_dev['matrix'] @ values
+
+    return model
+
+
+def get_objective_values(x, y, isig, base_model, l_norm, alpha_1, alpha_2,
+                         linear_deviations=None, deviation_values=None,
+                         operators=None):
+    """
+    Evaluate the trend filter objective with numpy
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param isig: inverse sigma from get_isig
+    :param base_model: base model values, numpy array
+    :param l_norm: 1 or 2
+    :param alpha_1: Regularization against non-zero slope
+    :param alpha_2: Regularization against changing slope
+    :param linear_deviations: list of completed linear deviations
+    :param deviation_values: list of numpy arrays, one per linear deviation
+    :param operators: optional dict of 'd1' and 'd2' matrices for x,
+        see get_operators
+    :return: (objective of model, list of regularizations)
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+        deviation_values = []
+
+    model = get_model_values(base_model, linear_deviations, deviation_values)
+    obj_model = float(np.sum(huber(isig * (model - y))))
+
+    if operators is None:
+        operators = get_operators(x)
+
+    regs = [alpha_1 * norm_value(operators['d1'] @ base_model, l_norm),
+            alpha_2 * norm_value(operators['d2'] @ base_model, l_norm)]
+
+    for lin_dev, values in zip(linear_deviations, deviation_values):
+        regs.append(lin_dev['alpha'] * norm_value(values, l_norm))
+
+    return obj_model, regs
+
+
+def get_numeric_result(x, y, y_err, isig, base_model, deviation_values,
+                       linear_deviations, l_norm, alpha_1, alpha_2,
+                       engine, solver_info, operators=None):
+    """
+    Package the solution from a non-cvxpy engine in the same form
+    as the trend_filter result. The model, base_model and
+    objective entries are numpy arrays and floats instead of
+    cvxpy expressions. operators are passed to get_objective_values.
+    :return: The fit model information
+    """
+    completed_devs = []
+    for lin_dev, values in zip(linear_deviations, deviation_values):
+        lin_dev = lin_dev.copy()
+        lin_dev['values'] = values
+        completed_devs.append(lin_dev)
+
+    model = get_model_values(base_model, completed_devs, deviation_values)
+    obj_model, regs = get_objective_values(x, y, isig, base_model, l_norm,
+                                           alpha_1, alpha_2,
+                                           linear_deviations=completed_devs,
+                                           deviation_values=deviation_values,
+                                           operators=operators)
+    reg_sum = sum(regs)
+
+    func_base, func_deviates, func = \
+        get_interp_extrapolate_functions(x, base_model, completed_devs)
+
+    tf_result = {'x': x,
+                 'y': y,
+                 'y_err': y_err,
+                 'function': func,
+                 'function_base': func_base,
+                 'function_deviates': func_deviates,
+                 'model': model,
+                 'base_model': base_model,
+                 'objective_model': obj_model,
+                 'regularization_total': reg_sum,
+                 'regularizations': regs,
+                 'objective_total': obj_model + reg_sum,
+                 'y_fit': model,
+                 'constraints': [],
+                 'linear_deviations': completed_devs,
+                 'engine': engine,
+                 'solver_info': solver_info}
+
+    return tf_result
@@ -0,0 +1,185 @@
+"""
+Online trend filtering for append-only series
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from trendfilter.derivatives import second_derivative_rows, \
+    second_derivative_matrix_from_rows, first_derivative_matrix_from_idx
+from trendfilter.linear_deviations import get_deviation_indices
+from trendfilter.engines import trend_filter_engine
+
+
+class OnlineTrendFilter:
+    """
+    A trend filter that is updated one point at a time.
+    The operators are kept between updates and only the rows
+    for the new point are computed. Each fit is warm-started
+    from the previous one, extended linearly to the new point.
+    With a window, only the most recent points are fit so the
+    cost per update stays the same as the history grows.
+    """
+
+    def __init__(self, alpha_1=0.0, alpha_2=0.0, l_norm=2,
+                 constrain_zero=False, monotonic=False, positive=False,
+                 linear_deviations=None, window=None,
+                 engine=None, engine_options=None):
+        """
+        :param alpha_1: see trend_filter
+        :param alpha_2: see trend_filter
+        :param l_norm: see trend_filter
+        :param constrain_zero: see trend_filter, not with a window
+        :param monotonic: see trend_filter
+        :param positive: see trend_filter
+        :param linear_deviations: see trend_filter. These need a mapping
+            so they can be extended to new points.
+        :param window: optional maximum number of points to fit
+        :param engine: 'admm' or 'banded'. Defaults to 'banded' when
+            it supports the options, otherwise 'admm'
+        :param engine_options: dict of keyword arguments for the engine
+        """
+        if linear_deviations is None:
+            linear_deviations = []
+
+        for lin_dev in linear_deviations:
+            assert 'mapping' in lin_dev, 'Online linear deviations need a mapping'
+
+        assert window is None or window >= 3
+        assert not (constrain_zero and window), 'constrain_zero is not supported with a window'
+
+        if engine is None:
+            banded_ok = l_norm == 2 and not monotonic and not positive and \
+                not (constrain_zero and linear_deviations)
+            engine = 'banded' if banded_ok else 'admm'
+
+        self.alpha_1 = alpha_1
+        self.alpha_2 = alpha_2
+        self.l_norm = l_norm
+        self.constrain_zero = constrain_zero
+        self.monotonic = monotonic
+        self.positive = positive
+        self.linear_deviations = linear_deviations
+        self.window = window
+        self.engine = engine
+        self.engine_options = engine_options or {}
+
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.y_err = np.zeros(0)
+
+        # operator rows, kept in step with x
+        self._d2_rows = np.zeros((0, 3))
+        self._idx = np.zeros(0)
+        self._deviation_indices = [np.zeros(0, dtype=int) for _ in linear_deviations]
+
+        self.result = None
+        self.n_updates = 0
+
+    def fit(self, x, y, y_err=None):
+        """
+        Start from a history of points
+        :param x: The x-value, numpy array, sorted
+        :param y: The y variable, numpy array
+        :param y_err: The y_err variable, numpy array
+        :return: The fit model information, see trend_filter
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        y_err = np.ones(len(x)) if y_err is None else np.asarray(y_err, dtype=float)
+
+        if self.window is not None:
+            x, y, y_err = x[-self.window:], y[-self.window:], y_err[-self.window:]
+
+        self.x, self.y, self.y_err = x, y, y_err
+        self._d2_rows = second_derivative_rows(x, scale_free=True)
+        self._idx = 1.0 / (x[1:] - x[0:-1] + 1e-9)
+        self._deviation_indices = [get_deviation_indices(x, lin_dev['mapping'])
+                                   for lin_dev in self.linear_deviations]
+        self.result = None
+
+        return self._solve()
+
+    def update(self, x_new, y_new, y_err_new=1.0):
+        """
+        Add one point and refit
+        :param x_new: the new x, greater than all previous x
+        :param y_new: the new y
+        :param y_err_new: the new y_err
+        :return: The fit model information, see trend_filter.
+            None until there are 3 points.
+        """
+        x_new = float(x_new)
+        if len(self.x):
+            assert x_new > self.x[-1], 'Points must arrive in increasing x'
+
+        self.x = np.append(self.x, x_new)
+        self.y = np.append(self.y, float(y_new))
+        self.y_err = np.append(self.y_err, float(y_err_new))
+
+        # only the rows involving the new point
+        if len(self.x) >= 2:
+            self._idx = np.append(self._idx, 1.0 / (self.x[-1] - self.x[-2] + 1e-9))
+        if len(self.x) >= 3:
+            row = second_derivative_rows(self.x[-3:], scale_free=True)
+            self._d2_rows = np.vstack([self._d2_rows, row])
+
+        for i, lin_dev in enumerate(self.linear_deviations):
+            index = get_deviation_indices(self.x[-1:], lin_dev['mapping'])
+            self._deviation_indices[i] = np.append(self._deviation_indices[i], index)
+
+        shift = 0
+        if self.window is not None and len(self.x) > self.window:
+            shift = len(self.x) - self.window
+            self.x = self.x[shift:]
+            self.y = self.y[shift:]
+            self.y_err = self.y_err[shift:]
+            self._idx = self._idx[shift:]
+            self._d2_rows = self._d2_rows[shift:]
+            self._deviation_indices = [indices[shift:] for indices in self._deviation_indices]
+
+        self.n_updates += 1
+
+        if len(self.x) < 3:
+            return None
+
+        return self._solve(shift=shift)
+
+    def _warm_start(self, shift):
+        if self.result is None:
+            return None
+
+        base_model = self.result['base_model'][shift:]
+        if len(base_model) < 2:
+            return None
+
+        # extend linearly to the new point
+        slope = (base_model[-1] - base_model[-2]) / (self.x[-2] - self.x[-3])
+        return np.append(base_model, base_model[-1] + slope * (self.x[-1] - self.x[-2]))
+
+    def _solve(self, shift=0):
+        n = len(self.x)
+        operators = {'d1': first_derivative_matrix_from_idx(self._idx),
+                     'd2': second_derivative_matrix_from_rows(self._d2_rows)}
+
+        lin_devs = []
+        for lin_dev, indices in zip(self.linear_deviations, self._deviation_indices):
+            matrix = csr_matrix((np.ones(n), indices, np.arange(n + 1)),
+                                shape=(n, lin_dev['n_vars']))
+            lin_devs.append(dict(lin_dev, matrix=matrix))
+
+        engine_options = dict(self.engine_options)
+        warm_start = self._warm_start(shift)
+        if warm_start is not None:
+            engine_options['warm_start'] = warm_start
+
+        self.result = trend_filter_engine(self.x, self.y, y_err=self.y_err,
+                                          alpha_1=self.alpha_1, alpha_2=self.alpha_2,
+                                          l_norm=self.l_norm,
+                                          constrain_zero=self.constrain_zero,
+                                          monotonic=self.monotonic,
+                                          positive=self.positive,
+                                          linear_deviations=lin_devs,
+                                          engine=self.engine,
+                                          engine_options=engine_options,
+                                          operators=operators)
+        return self.result
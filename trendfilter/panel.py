@@ -0,0 +1,164 @@
+"""
+Fit many series jointly with shared linear deviations
+
+Each series has its own base model but the linear deviations, a
+seasonal pattern for example, are estimated once from all of them,
+optionally with a per-series offset shrunk towards the shared values.
+The series are stacked into one problem whose difference operators are
+block diagonal, so it is still banded and the cost grows linearly with
+the number of series. The shared deviations couple the blocks only
+through their few columns, and the per-series offsets are handled like
+any other high-cardinality deviation.
+"""
+
+import numpy as np
+from scipy.sparse import block_diag, vstack
+from trendfilter.derivatives import get_operators
+from trendfilter.engines import ENGINES
+from trendfilter.linear_deviations import complete_linear_deviations
+from trendfilter.numeric import get_numeric_result, get_objective_values
+from trendfilter.trendfilter import get_isig, get_mask
+
+
+def trend_filter_panel(xs, ys, y_errs=None, alpha_1=0.0, alpha_2=0.0, l_norm=2,
+                       monotonic=False, positive=False, linear_deviations=None,
+                       engine=None, engine_options=None):
+    """
+    Fit many series with their own base models and shared linear deviations
+    :param xs: a single x array shared by all series, a 2-D array
+        with one row per series or a list of (possibly ragged) x arrays
+    :param ys: 2-D array with one row per series or a list of y arrays.
+        Points where y or y_err is NaN are missing, as in trend_filter.
+    :param y_errs: None, or like ys
+    :param alpha_1: see trend_filter, the same for every series
+    :param alpha_2: see trend_filter, the same for every series
+    :param l_norm: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter. These are shared by all the
+        series. A 'matrix', 'indices' or 'weights' can be a list with one
+        per series, otherwise the mapping is applied to each series.
+        With 'series_alpha' each series also gets its own offset from
+        the shared values, regularized with that alpha.
+    :param engine: one of the ENGINES. Defaults to 'banded' where it supports
+        the options, otherwise 'admm'
+    :param engine_options: dict of keyword arguments for the engine
+    :return: dict with
+        series, a list of per-series results like those of the engines,
+            with each linear deviation's values the shared values plus
+            the series offset,
+        deviations, a dict of the shared deviation values by name,
+        offsets, a dict of name to 2-D array of per-series offsets
+            for the deviations with a series_alpha,
+        objective_total of the joint problem, engine and solver_info
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if engine_options is None:
+        engine_options = {}
+
+    if engine is None:
+        banded_ok = l_norm == 2 and not monotonic and not positive
+        engine = 'banded' if banded_ok else 'admm'
+
+    assert engine in ENGINES, 'Unknown engine %s, choose from %s' % (engine, sorted(ENGINES))
+
+    n_series = len(ys)
+    if isinstance(xs, np.ndarray) and xs.ndim == 1:
+        xs = [xs] * n_series
+
+    if y_errs is None:
+        y_errs = [None] * n_series
+
+    assert len(xs) == n_series
+    assert len(y_errs) == n_series
+
+    xs = [np.asarray(x, dtype=float) for x in xs]
+    ys = [np.asarray(y, dtype=float) for y in ys]
+    y_errs = [np.ones(len(x)) if y_err is None else np.asarray(y_err, dtype=float)
+              for x, y_err in zip(xs, y_errs)]
+    isigs = [get_isig(y, y_err, mask=get_mask(y, y_err=y_err)) for y, y_err in zip(ys, y_errs)]
+    # the points with zero weight may be missing
+    ys_data = [np.where(isig > 0, y, 0.0) for y, isig in zip(ys, isigs)]
+
+    # each series' deviations, with their matrices
+    series_devs = [complete_linear_deviations([_series_deviation(lin_dev, i) for lin_dev
+                                               in linear_deviations], x, with_variables=False)
+                   for i, x in enumerate(xs)]
+
+    # the stacked problem: shared deviations stack their matrices,
+    # offsets get a block per series
+    stacked_devs = []
+    for k, lin_dev in enumerate(series_devs[0] if series_devs else []):
+        matrices = [devs[k]['matrix'] for devs in series_devs]
+        stacked_devs.append(dict(lin_dev, matrix=vstack(matrices, format='csr')))
+        if lin_dev.get('series_alpha') is not None:
+            stacked_devs.append({'name': lin_dev['name'] + '_offsets',
+                                 'matrix': block_diag(matrices, format='csr'),
+                                 'n_vars': n_series * lin_dev['n_vars'],
+                                 'alpha': lin_dev['series_alpha'],
+                                 'positive': False})
+
+    series_operators = [get_operators(x) for x in xs]
+    operators = {'d1': block_diag([ops['d1'] for ops in series_operators], format='csr'),
+                 'd2': block_diag([ops['d2'] for ops in series_operators], format='csr')}
+
+    x = np.concatenate(xs)
+    y = np.concatenate(ys_data)
+    isig = np.concatenate(isigs)
+
+    solution = ENGINES[engine](x, y, isig, alpha_1=alpha_1, alpha_2=alpha_2, l_norm=l_norm,
+                               constrain_zero=False, monotonic=monotonic, positive=positive,
+                               linear_deviations=stacked_devs, operators=operators,
+                               **engine_options)
+
+    obj_model, regs = get_objective_values(x, y, isig, solution['base_model'], l_norm,
+                                           alpha_1, alpha_2, linear_deviations=stacked_devs,
+                                           deviation_values=solution['deviation_values'],
+                                           operators=operators)
+
+    values = dict(zip([lin_dev['name'] for lin_dev in stacked_devs],
+                      solution['deviation_values']))
+
+    deviations = {}
+    offsets = {}
+    for lin_dev in series_devs[0] if series_devs else []:
+        deviations[lin_dev['name']] = values[lin_dev['name']]
+        if lin_dev.get('series_alpha') is not None:
+            offsets[lin_dev['name']] = values[lin_dev['name'] + '_offsets'].reshape(n_series, -1)
+
+    series = []
+    start = 0
+    for i, (x_i, y_i, y_err_i, isig_i) in enumerate(zip(xs, ys_data, y_errs, isigs)):
+        stop = start + len(x_i)
+        deviation_values = [deviations[lin_dev['name']] + offsets[lin_dev['name']][i]
+                            if lin_dev['name'] in offsets else deviations[lin_dev['name']]
+                            for lin_dev in series_devs[i]]
+        series.append(get_numeric_result(x_i, y_i, y_err_i, isig_i,
+                                         solution['base_model'][start:stop], deviation_values,
+                                         series_devs[i], l_norm, alpha_1, alpha_2, engine,
+                                         solution['solver_info'],
+                                         operators=series_operators[i]))
+        series[-1]['y'] = ys[i]
+        start = stop
+
+    return {'series': series,
+            'deviations': deviations,
+            'offsets': offsets,
+            'objective_total': obj_model + sum(regs),
+            'engine': engine,
+            'solver_info': solution['solver_info']}
+
+
+def _series_deviation(linear_deviation, index):
+    """
+    The linear deviation for one series, picking that series'
+    matrix, indices and weights where they're given as lists
+    """
+    lin_dev = linear_deviation.copy()
+    for key in ['matrix', 'indices', 'weights']:
+        if isinstance(lin_dev.get(key), list):
+            lin_dev[key] = lin_dev[key][index]
+
+    return lin_dev
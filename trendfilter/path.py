@@ -0,0 +1,230 @@
+"""
+The exact L1 regularization path in alpha_2
+
+For l_norm=1, with the whole Huber loss in its quadratic part, the
+problem is a weighted generalized lasso
+    sum(isig^2 (base - y)^2) + alpha_2 |D2 base|_1
+whose solution is piecewise linear in alpha_2. The dual path algorithm
+of Tibshirani and Taylor (2011), as in the genlasso R package, follows
+the dual variables from alpha_2 = infinity down, one knot at a time.
+Each knot adds or drops one changepoint. Between knots the base model
+is the weighted fit of lines with changes of slope at the changepoints,
+a tridiagonal solve, and the dual follows from its residuals by a double
+cumulative sum, so the cost is linear in the length of the series and
+there is no D2 D2' to invert, which is badly conditioned for x with
+points close together.
+
+Points in the linear part of the Huber loss make the problem no longer
+piecewise linear. The path is then that of the squared loss, which
+trend_filter only matches while every scaled residual is at most 1.
+'huber_ok' flags the knots where that holds.
+"""
+
+import numpy as np
+from scipy.linalg import solveh_banded
+from scipy.sparse import csr_matrix
+from trendfilter.banded import sparse_to_upper_bands
+from trendfilter.derivatives import get_operators
+from trendfilter.trendfilter import get_isig
+
+
+def trend_filter_path(x, y, y_err=None, min_alpha=0.0, max_changepoints=None,
+                      max_knots=None, callback=None):
+    """
+    Every knot of the l_norm=1 path in alpha_2, from the largest alpha_2
+    with a linear base model down to min_alpha
+    :param x: The x-value, numpy array, sorted
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param min_alpha: stop once alpha_2 is below this
+    :param max_changepoints: optional, stop once there are this many changepoints
+    :param max_knots: optional, stop after this many knots
+    :param callback: optional function of (alpha_2, base_model) called at
+        each knot. The path stops there if it returns True.
+    :return: dict with x, alphas (decreasing), base_models (one row per knot),
+        n_changepoints and huber_ok at each knot, and complete, True if the
+        path was followed to alpha_2 = 0. See evaluate_path.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if y_err is None:
+        y_err = np.ones(n)
+
+    isig = get_isig(y, np.asarray(y_err, dtype=float))
+    weights = isig ** 2
+    d2 = csr_matrix(get_operators(x)['d2'])
+    m = d2.shape[0]
+
+    boundary = []
+    signs = []
+    interior = np.ones(m, dtype=bool)
+
+    lambdas = []
+    base_models = []
+    n_changepoints = []
+    huber_ok = []
+
+    def record(lam, base):
+        lambdas.append(lam)
+        base_models.append(base)
+        n_changepoints.append(len(boundary))
+        huber_ok.append(bool(np.all(np.abs(isig * (base - y)) <= 1.0 + 1e-9)))
+        return callback is not None and bool(callback(2 * lam, base))
+
+    lam = np.inf
+    last_added = None
+    last_removed = None
+    complete = False
+    while True:
+        # between knots the base model is base_a - lambda base_b and
+        # the dual is a - lambda b
+        sign_vector = np.array(signs, dtype=float)
+        d_boundary = d2[boundary]
+        base_a, base_b = _restricted_fit(x, y, weights, boundary, d_boundary.T @ sign_vector)
+        a = _dual(weights * (y - base_a), x)
+        b = -_dual(weights * base_b, x)
+        rows = np.flatnonzero(interior)
+        a, b = a[rows], b[rows]
+
+        if lam == np.inf:
+            # above the first knot the base model is linear
+            lam = float(np.abs(a).max()) if len(a) else 0.0
+            if lam == 0.0:
+                record(lam, base_a)
+                complete = True
+                break
+            position = int(np.argmax(np.abs(a)))
+            _add(boundary, signs, interior, rows[position], np.sign(a[position]))
+            last_added = rows[position]
+            if record(lam, base_a):
+                break
+            continue
+
+        # when each interior coordinate reaches +-lambda
+        hits = np.full(len(rows), -np.inf)
+        hit_signs = np.zeros(len(rows))
+        for sign in [1.0, -1.0]:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                times = a / (b + sign)
+            ok = np.isfinite(times) & (times >= 0) & (times <= lam * (1 + 1e-10)) & \
+                (times > hits)
+            if last_removed is not None:
+                ok &= rows != last_removed
+            hits[ok] = times[ok]
+            hit_signs[ok] = sign
+
+        # when each boundary coordinate leaves
+        leaves = np.full(len(boundary), -np.inf)
+        if boundary:
+            c = sign_vector * (d_boundary @ base_a)
+            d = sign_vector * (d_boundary @ base_b)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                times = c / d
+            ok = (c < 0) & (d < 0) & (times <= lam * (1 + 1e-10))
+            ok &= np.array(boundary) != last_added
+            leaves[ok] = times[ok]
+
+        next_hit = hits.max() if len(hits) else -np.inf
+        next_leave = leaves.max() if len(leaves) else -np.inf
+        lam = max(next_hit, next_leave, 0.0)
+        base = base_a - lam * base_b
+
+        if lam <= 0.0:
+            record(0.0, base)
+            complete = True
+            break
+
+        if next_hit >= next_leave:
+            position = int(np.argmax(hits))
+            _add(boundary, signs, interior, rows[position], hit_signs[position])
+            last_added, last_removed = rows[position], None
+        else:
+            position = int(np.argmax(leaves))
+            index = boundary.pop(position)
+            signs.pop(position)
+            interior[index] = True
+            last_added, last_removed = None, index
+
+        stop = record(lam, base)
+
+        if stop or 2 * lam <= min_alpha or \
+                (max_changepoints is not None and len(boundary) >= max_changepoints) or \
+                (max_knots is not None and len(lambdas) >= max_knots):
+            break
+
+    return {'x': x,
+            'alphas': 2 * np.array(lambdas),
+            'base_models': np.array(base_models),
+            'n_changepoints': np.array(n_changepoints),
+            'huber_ok': np.array(huber_ok),
+            'complete': complete}
+
+
+def _add(boundary, signs, interior, index, sign):
+    boundary.append(int(index))
+    signs.append(float(sign))
+    interior[index] = False
+
+
+def _restricted_fit(x, y, weights, boundary, boundary_term):
+    """
+    The weighted least squares fits of y and of boundary_term / weights
+    by lines with changes of slope at the boundary rows, so the base model
+    at lambda is the first minus lambda times the second. The lines are
+    hat functions on the knots so the normal equations are tridiagonal.
+    """
+    n = len(x)
+    nodes = np.unique(np.concatenate([[0, n - 1], np.array(boundary, dtype=int) + 1]))
+    segment = np.clip(np.searchsorted(nodes, np.arange(n), side='right') - 1, 0, len(nodes) - 2)
+    left, right = x[nodes[segment]], x[nodes[segment + 1]]
+    t = (x - left) / (right - left)
+
+    rows = np.repeat(np.arange(n), 2)
+    cols = np.column_stack([segment, segment + 1]).ravel()
+    hats = csr_matrix((np.column_stack([1 - t, t]).ravel(), (rows, cols)),
+                      shape=(n, len(nodes)))
+
+    gram = (hats.T @ hats.multiply(weights[:, None])).tocsr()
+    coefficients = solveh_banded(sparse_to_upper_bands(gram, bandwidth=1),
+                                 np.column_stack([hats.T @ (weights * y),
+                                                  hats.T @ boundary_term]),
+                                 check_finite=False)
+    return hats @ coefficients[:, 0], hats @ coefficients[:, 1]
+
+
+def _dual(r, x):
+    """
+    Solve d2.T @ u = r for the scale free second derivative. Each row of d2
+    is a difference of slopes, so u is a double cumulative sum of r.
+    r must sum to zero against 1 and x, as the residuals of a weighted
+    line fit do.
+    """
+    slopes = np.cumsum(r)[:-1]
+    return np.cumsum(np.diff(x) * slopes)[:-1]
+
+
+def evaluate_path(path, alpha_2):
+    """
+    The base model at any alpha_2 on the computed path,
+    interpolating linearly between the knots
+    :param path: from trend_filter_path
+    :param alpha_2: float
+    :return: numpy array of base model values at the path's x
+    """
+    alphas = path['alphas']
+    if alpha_2 >= alphas[0]:
+        return path['base_models'][0].copy()
+
+    if alpha_2 < alphas[-1]:
+        raise ValueError('alpha_2 = %s is below the end of the path at %s'
+                         % (alpha_2, alphas[-1]))
+
+    # the knots are decreasing
+    upper = int(np.searchsorted(-alphas, -alpha_2, side='right')) - 1
+    lower = upper + 1
+    if lower == len(alphas) or alphas[upper] == alphas[lower]:
+        return path['base_models'][upper].copy()
+
+    weight = (alphas[upper] - alpha_2) / (alphas[upper] - alphas[lower])
+    return (1 - weight) * path['base_models'][upper] + weight * path['base_models'][lower]
@@ -1,57 +1,119 @@
 from tempfile import NamedTemporaryFile
-from bokeh.plotting import figure, show
-from bokeh.io import output_file
 import numpy as np
+from trendfilter.decimate import decimate
 
 
 def plot_model(result, title='', file=None, show_base=False, show_extrap=False,
                show_plot=True, plot_x_min=0, plot_x_max=None,
                plot_y_min=0, plot_y_max=None,
-               extrap_min=0, extrap_max=40, extrap_stride=1):
+               extrap_min=0, extrap_max=40, extrap_stride=1,
+               max_points=None, decimation='lttb', webgl=None,
+               width=900, height=600):
+    """
+    Plot the data and model with bokeh
+    :param result: result dict from trend_filter, or a list of them
+        to plot one below another in the same document
+    :param title: title of the plot, or a list of them, one per result
+    :param file: the html file, defaults to a temporary file
+    :param show_base: If True, also plot the base model
+    :param show_extrap: If True, also plot the extrapolation past the data
+    :param show_plot: If True, open the plot in a browser
+    :param plot_x_min, plot_x_max, plot_y_min, plot_y_max: the ranges of the
+        plot, by default from the data and extrapolation
+    :param extrap_min, extrap_max: the range of the extrapolation past max(x)
+    :param extrap_stride: the spacing of the extrapolation and base model.
+        It is widened so neither has more than max_points points.
+    :param max_points: the most points drawn per curve, defaults to two
+        per pixel of the width
+    :param decimation: how longer curves are decimated, 'lttb' or
+        'minmax' (see trendfilter.decimate), or None to draw every point
+    :param webgl: If True, render with WebGL. Defaults to True if
+        any data has more than max_points points.
+    :param width: width of the plot in pixels
+    :param height: height of the plot in pixels
+    :return: the bokeh figure, or a column of them for a list of results
+    """
+    # imported here so bokeh is only loaded when plotting
+    from bokeh.plotting import figure, show
+    from bokeh.io import output_file
+    from bokeh.layouts import column
 
     if file is None:
         file = NamedTemporaryFile().name+'.html'
 
     output_file(file)
 
-    x = result['x']
-    y = result['y']
+    results = result if isinstance(result, (list, tuple)) else [result]
+    titles = title if isinstance(title, (list, tuple)) else [title] * len(results)
+    assert len(titles) == len(results), 'Need one title per result'
 
-    if plot_x_max is None:
-        plot_x_max = max(x)
-        if show_extrap:
-            plot_x_max += extrap_max
+    if max_points is None:
+        max_points = 2 * width
 
-    if plot_y_max is None:
-        plot_y_max = max(y) * 1.05
+    if webgl is None:
+        webgl = any(len(res['x']) > max_points for res in results)
 
-    plot = figure(title=title, width=900, height=600,
-                  y_range=(plot_y_min, plot_y_max),
-                  x_range=(plot_x_min, plot_x_max))
+    plots = []
+    for res, res_title in zip(results, titles):
+        x_max = plot_x_max
+        if x_max is None:
+            x_max = max(res['x'])
+            if show_extrap:
+                x_max += extrap_max
 
-    plot.circle(x, y, legend_label='data')
-    plot.line(x, y)
+        y_max = plot_y_max
+        if y_max is None:
+            # missing points are NaN
+            y_max = np.nanmax(res['y']) * 1.05
 
-    plot.line(x, result['y_fit'], color='red', legend_label='model')
+        plot = figure(title=res_title, width=width, height=height,
+                      y_range=(plot_y_min, y_max),
+                      x_range=(plot_x_min, x_max),
+                      output_backend='webgl' if webgl else 'canvas')
+        _add_curves(plot, res, show_base=show_base, show_extrap=show_extrap,
+                    extrap_min=extrap_min, extrap_max=extrap_max,
+                    extrap_stride=extrap_stride, max_points=max_points,
+                    decimation=decimation)
+        plots.append(plot)
+
+    plot = column(plots) if isinstance(result, (list, tuple)) else plots[0]
+
+    if show_plot:
+        show(plot)
+
+    return plot
+
+
+def _add_curves(plot, result, show_base, show_extrap, extrap_min, extrap_max,
+                extrap_stride, max_points, decimation):
+    x = np.asarray(result['x'], dtype=float)
+    y = np.asarray(result['y'], dtype=float)
+
+    # missing points are NaN in y
+    x_data, y_data = decimate(x, y, max_points, method=decimation)
+    plot.circle(x_data, y_data, legend_label='data')
+    plot.line(x_data, y_data)
+
+    x_fit, y_fit = decimate(x, result['y_fit'], max_points, method=decimation)
+    plot.line(x_fit, y_fit, color='red', legend_label='model')
 
     if show_extrap:
         # over-plot the function, showing the extrapolation too
-        f = result['function']
-        x_min = max(x) + extrap_min
-        x_max = max(x) + extrap_max
-        xx = np.arange(x_min, x_max, extrap_stride)
-        plot.line(xx, f(xx), color='green', legend_label='model extrapolation')
+        xx = _grid(x.max() + extrap_min, x.max() + extrap_max, extrap_stride, max_points)
+        plot.line(xx, result['function'](xx), color='green', legend_label='model extrapolation')
 
     if show_base:
-        f_base = result['function_base']
-        x_max = max(x)
+        x_max = x.max()
         if extrap_max:
             x_max += extrap_max
 
-        xxx = np.arange(x.min(), x_max)
-        plot.line(xxx, f_base(xxx), color='black', legend_label='base model')
+        xxx = _grid(x.min(), x_max, 1, max_points)
+        plot.line(xxx, result['function_base'](xxx), color='black', legend_label='base model')
 
-    if show_plot:
-        show(plot)
 
-    return plot
+def _grid(x_min, x_max, stride, max_points):
+    n = int(np.ceil((x_max - x_min) / stride))
+    if n <= max_points:
+        return np.arange(x_min, x_max, stride)
+
+    return np.linspace(x_min, x_max, max_points, endpoint=False)
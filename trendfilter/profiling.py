@@ -0,0 +1,141 @@
+"""
+Opt-in timing of the phases of a fit
+
+The wall time, and optionally the peak Python memory, of each phase
+are recorded in the 'profile' of the result along with the solver
+statistics.
+Hooks added with add_profile_hook are called with every profile,
+e.g. to send the numbers to a metrics system.
+"""
+
+import time
+import warnings
+import tracemalloc
+from contextlib import contextmanager
+
+_profile_hooks = []
+
+
+def add_profile_hook(hook):
+    """
+    Call a function with the profile of every profiled fit
+    :param hook: function taking the profile dict
+    :return: the hook, so this can be used as a decorator
+    """
+    _profile_hooks.append(hook)
+    return hook
+
+
+def remove_profile_hook(hook):
+    """
+    Stop calling a hook added with add_profile_hook
+    :param hook: the function that was added
+    """
+    _profile_hooks.remove(hook)
+
+
+class Profiler:
+    """
+    Records the time and peak memory of named phases. When not
+    enabled the phases do nothing, so the fit code can always use it.
+    """
+
+    def __init__(self, enabled=True, memory=False, engine='cvxpy'):
+        """
+        :param enabled: If False, nothing is recorded
+        :param memory: If True, measure the peak memory of each phase
+            with tracemalloc. This counts numpy allocations but not
+            the solvers' own C allocations, and can double the time
+            spent in cvxpy.
+        :param engine: name of the engine, stored in the profile
+        """
+        self.enabled = enabled
+        self.memory = memory
+        self.phases = {}
+        self.solver_stats = {}
+        self.engine = engine
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager recording one phase
+        :param name: name of the phase
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started_tracing = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'seconds': time.perf_counter() - start}
+            if self.memory:
+                record['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+                if started_tracing:
+                    tracemalloc.stop()
+
+            self.phases[name] = record
+
+    def record_problem(self, problem):
+        """
+        Record the statistics of a solved cvxpy problem
+        :param problem: cvxpy.Problem
+        """
+        if not self.enabled:
+            return
+
+        stats = problem.solver_stats
+        self.solver_stats = {'status': problem.status,
+                             'solver_name': getattr(stats, 'solver_name', None),
+                             'solve_time': getattr(stats, 'solve_time', None),
+                             'setup_time': getattr(stats, 'setup_time', None),
+                             'num_iters': getattr(stats, 'num_iters', None)}
+
+    def record_solver_info(self, solver_info):
+        """
+        Record the statistics from one of the engines
+        :param solver_info: the engine's solver_info dict
+        """
+        if not self.enabled:
+            return
+
+        converged = solver_info.get('converged')
+        self.solver_stats = {'status': 'optimal' if converged else 'not converged',
+                             'solver_name': self.engine,
+                             'solve_time': self.phases.get('solve', {}).get('seconds'),
+                             'setup_time': None,
+                             'num_iters': solver_info.get('iterations')}
+
+    def finish(self, tf_result):
+        """
+        Add the profile to the result and call the hooks
+        :param tf_result: the fit model information
+        :return: tf_result
+        """
+        if not self.enabled:
+            return tf_result
+
+        profile = {'engine': self.engine,
+                   'n': len(tf_result['x']),
+                   'total_seconds': time.perf_counter() - self._start,
+                   'phases': self.phases,
+                   'solver_stats': self.solver_stats}
+        tf_result['profile'] = profile
+
+        for hook in list(_profile_hooks):
+            try:
+                hook(profile)
+            except Exception as error:
+                # a broken metrics hook shouldn't lose the fit
+                warnings.warn('Profile hook %r failed: %s' % (hook, error))
+
+        return tf_result
@@ -0,0 +1,374 @@
+"""
+Direct QP assembly for trend filtering, solved with OSQP or Clarabel
+
+The Huber loss uses the epigraph form
+    huber(r) = min_s  s^2 + 2|r - s|
+so with u >= |r - s| the whole problem is a QP in
+    z = [base, c, s, u, v_1, v_2, w]
+where v_1, v_2 and w bound the L1 terms, only present for l_norm=1.
+The matrices are built directly with scipy.sparse and handed to the
+solver's own API, skipping the cvxpy canonicalization.
+"""
+
+import time
+import numpy as np
+from scipy.sparse import csc_matrix, identity, vstack, hstack, diags, triu, \
+    block_diag
+from trendfilter.derivatives import get_operators
+
+# the solvers tried for solver='auto', in order
+SOLVER_ORDER = {'small': ['CLARABEL', 'OSQP'],
+                'large': ['OSQP', 'CLARABEL']}
+
+# above this many points 'auto' prefers the first-order solver for l_norm=2
+LARGE_PROBLEM = 20000
+
+OSQP_SETTINGS = {'eps_abs': 1e-6, 'eps_rel': 1e-6, 'max_iter': 20000,
+                 'polishing': True, 'verbose': False}
+
+CLARABEL_SETTINGS = {'verbose': False}
+
+
+def assemble_qp(x, y, isig, alpha_1=0.0, alpha_2=0.0, l_norm=2,
+                constrain_zero=False, monotonic=False, positive=False,
+                linear_deviations=None, operators=None):
+    """
+    Build the QP
+        minimize 1/2 z'P z + q'z  subject to  l <= A z <= u
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param isig: inverse sigma from get_isig
+    :param alpha_1: see trend_filter
+    :param alpha_2: see trend_filter
+    :param l_norm: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: list of completed linear deviations (no variables needed)
+    :param operators: optional dict of 'd1' and 'd2' matrices for x,
+        see get_operators
+    :return: dict with P (upper triangle), q, A, l, u as csc matrices and
+        numpy arrays, and 'slices', a dict of variable name to slice of z
+    """
+    assert l_norm in [1, 2]
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if operators is None:
+        operators = get_operators(x)
+
+    n = len(x)
+    d1 = csc_matrix(operators['d1'])
+    d2 = csc_matrix(operators['d2'])
+    n_dev = sum(lin_dev['n_vars'] for lin_dev in linear_deviations)
+    if linear_deviations:
+        dev_matrix = hstack([lin_dev['matrix'] for lin_dev in linear_deviations], format='csc')
+        dev_alphas = np.concatenate([np.full(lin_dev['n_vars'], lin_dev['alpha'])
+                                     for lin_dev in linear_deviations])
+        dev_positive = np.concatenate([np.full(lin_dev['n_vars'], lin_dev.get('positive', False))
+                                       for lin_dev in linear_deviations])
+    else:
+        dev_matrix = csc_matrix((n, 0))
+        dev_alphas = np.zeros(0)
+        dev_positive = np.zeros(0, dtype=bool)
+
+    l1_terms = []
+    if l_norm == 1:
+        if alpha_1 > 0:
+            l1_terms.append(('v_1', d1, alpha_1))
+        if alpha_2 > 0:
+            l1_terms.append(('v_2', d2, alpha_2))
+
+    sizes = [('base', n), ('c', n_dev), ('s', n), ('u', n)]
+    sizes += [(name, matrix.shape[0]) for name, matrix, _ in l1_terms]
+    if l_norm == 1:
+        sizes.append(('w', n_dev))
+
+    slices = {}
+    start = 0
+    for name, size in sizes:
+        slices[name] = slice(start, start + size)
+        start += size
+    n_z = start
+
+    def columns(name):
+        slc = slices[name]
+        size = slc.stop - slc.start
+        return csc_matrix((np.ones(size), (np.arange(size), np.arange(slc.start, slc.stop))),
+                          shape=(size, n_z))
+
+    # the objective
+    p_blocks = {'s': 2.0 * identity(n, format='csc')}
+    q = np.zeros(n_z)
+    q[slices['u']] = 2.0
+
+    if l_norm == 2:
+        p_blocks['base'] = 2.0 * (alpha_1 * (d1.T @ d1) + alpha_2 * (d2.T @ d2))
+        p_blocks['c'] = diags(2.0 * dev_alphas)
+    else:
+        for name, matrix, alpha in l1_terms:
+            q[slices[name]] = alpha
+        q[slices['w']] = dev_alphas
+
+    p_matrix = block_diag([p_blocks.get(name, csc_matrix((size, size))) for name, size in sizes],
+                          format='csc')
+
+    # the constraints, rows of A with lower and upper bounds
+    rows = []
+    infinity = np.inf
+
+    # the Huber epigraph
+    #   isig (base + M c) - s - u <= isig y
+    #   isig (base + M c) - s + u >= isig y
+    weighted_model = diags(isig) @ (columns('base') + dev_matrix @ columns('c'))
+    isig_y = isig * y
+    rows.append((weighted_model - columns('s') - columns('u'), -infinity, isig_y))
+    rows.append((weighted_model - columns('s') + columns('u'), isig_y, infinity))
+
+    for name, matrix, _ in l1_terms:
+        rows.append((matrix @ columns('base') - columns(name), -infinity, 0.0))
+        rows.append((matrix @ columns('base') + columns(name), 0.0, infinity))
+
+    if l_norm == 1 and n_dev:
+        rows.append((columns('c') - columns('w'), -infinity, 0.0))
+        rows.append((columns('c') + columns('w'), 0.0, infinity))
+
+    if constrain_zero:
+        model_0 = (columns('base') + dev_matrix @ columns('c'))[0]
+        rows.append((model_0, 0.0, 0.0))
+
+    if monotonic:
+        rows.append((d1 @ columns('base'), 0.0, infinity))
+
+    if positive:
+        rows.append((columns('base'), 0.0, infinity))
+
+    if dev_positive.any():
+        rows.append((columns('c')[np.flatnonzero(dev_positive)], 0.0, infinity))
+
+    a_matrix = vstack([row[0] for row in rows], format='csc')
+    lower = np.concatenate([np.broadcast_to(row[1], row[0].shape[0]) for row in rows])
+    upper = np.concatenate([np.broadcast_to(row[2], row[0].shape[0]) for row in rows])
+
+    return {'P': triu(p_matrix, format='csc'), 'q': q, 'A': a_matrix,
+            'l': lower, 'u': upper, 'slices': slices}
+
+
+def choose_solvers(n, l_norm, solver='auto'):
+    """
+    The solvers to try, in order
+    :param n: number of points
+    :param l_norm: 1 or 2
+    :param solver: 'auto', 'OSQP' or 'CLARABEL'. A named solver is
+        tried first with the other as a fall back.
+    :return: list of solver names that are installed
+    """
+    if solver == 'auto':
+        # the interior point solver is robust and accurate, OSQP scales better
+        # for large, purely quadratic problems
+        large = n > LARGE_PROBLEM and l_norm == 2
+        order = SOLVER_ORDER['large' if large else 'small']
+    else:
+        assert solver in SOLVERS, 'Unknown solver %s, choose from %s' % (solver, sorted(SOLVERS))
+        order = [solver] + [name for name in SOLVER_ORDER['small'] if name != solver]
+
+    installed = [name for name in order if _installed(name)]
+    assert installed, 'The qp engine needs osqp or clarabel installed'
+    return installed
+
+
+def osqp_is_legacy(version):
+    """
+    Whether the OSQP version is before 1.0, which renamed some settings
+    :param version: version string, e.g. osqp.__version__
+    :return: bool
+    """
+    return int(version.split('.')[0]) < 1
+
+
+def get_osqp_settings(settings=None, legacy=False):
+    """
+    OSQP_SETTINGS updated with settings, with polishing named as the
+    installed OSQP expects, 'polishing' from 1.0 and 'polish' before
+    :param settings: dict of OSQP settings, either name is accepted
+    :param legacy: If True, for OSQP before 1.0
+    :return: dict
+    """
+    settings = dict(OSQP_SETTINGS, **(settings or {}))
+    old_name, new_name = ('polishing', 'polish') if legacy else ('polish', 'polishing')
+    if old_name in settings:
+        settings[new_name] = settings.pop(old_name)
+
+    return settings
+
+
+def solve_osqp(qp, warm_start=None, settings=None):
+    """
+    Solve the QP with OSQP
+    :param qp: dict from assemble_qp
+    :param warm_start: optional dict with the primal 'z' and dual 'dual'
+        of a previous solution of the same size
+    :param settings: dict of OSQP settings, added to OSQP_SETTINGS
+    :return: dict with z, dual, status, solved and iterations
+    """
+    import osqp
+    legacy = osqp_is_legacy(osqp.__version__)
+    solver = osqp.OSQP()
+    solver.setup(qp['P'], qp['q'], qp['A'], qp['l'], qp['u'],
+                 **get_osqp_settings(settings, legacy=legacy))
+
+    if warm_start is not None:
+        if warm_start.get('dual') is not None and len(warm_start['dual']) == len(qp['l']):
+            solver.warm_start(x=warm_start['z'], y=warm_start['dual'])
+        else:
+            solver.warm_start(x=warm_start['z'])
+
+    # failures are reported in the status, as OSQP before 1.0 always did
+    results = solver.solve() if legacy else solver.solve(raise_error=False)
+    status = results.info.status
+    return {'z': results.x, 'dual': results.y, 'status': status,
+            'solved': status in ['solved', 'solved inaccurate'] and results.x is not None
+            and np.all(np.isfinite(results.x)),
+            'iterations': results.info.iter}
+
+
+def solve_clarabel(qp, warm_start=None, settings=None):
+    """
+    Solve the QP with Clarabel. It has no warm start, so that is ignored.
+    :param qp: dict from assemble_qp
+    :param warm_start: ignored
+    :param settings: dict of Clarabel settings, added to CLARABEL_SETTINGS
+    :return: dict with z, dual, status, solved and iterations
+    """
+    import clarabel
+
+    # l <= A z <= u as zero and non-negative cones on b - A z
+    a_matrix = csc_matrix(qp['A'])
+    lower, upper = qp['l'], qp['u']
+    equal = lower == upper
+    has_upper = np.isfinite(upper) & ~equal
+    has_lower = np.isfinite(lower) & ~equal
+
+    a_cone = vstack([a_matrix[equal], a_matrix[has_upper], -a_matrix[has_lower]], format='csc')
+    b_cone = np.concatenate([upper[equal], upper[has_upper], -lower[has_lower]])
+    cones = []
+    if equal.any():
+        cones.append(clarabel.ZeroConeT(int(equal.sum())))
+    cones.append(clarabel.NonnegativeConeT(int(has_upper.sum() + has_lower.sum())))
+
+    clarabel_settings = clarabel.DefaultSettings()
+    for key, value in dict(CLARABEL_SETTINGS, **(settings or {})).items():
+        setattr(clarabel_settings, key, value)
+
+    solver = clarabel.DefaultSolver(qp['P'], qp['q'], a_cone, b_cone, cones, clarabel_settings)
+    solution = solver.solve()
+    status = str(solution.status)
+    z = np.array(solution.x)
+    return {'z': z, 'dual': None, 'status': status,
+            'solved': status in ['Solved', 'AlmostSolved'] and np.all(np.isfinite(z)),
+            'iterations': solution.iterations}
+
+
+SOLVERS = {'OSQP': solve_osqp,
+           'CLARABEL': solve_clarabel}
+
+
+def qp_trend_filter(x, y, isig, alpha_1=0.0, alpha_2=0.0, l_norm=2,
+                    constrain_zero=False, monotonic=False, positive=False,
+                    linear_deviations=None, solver='auto', warm_start=None,
+                    solver_options=None, operators=None):
+    """
+    Solve the trend filter problem by assembling the QP directly
+    and calling OSQP or Clarabel, falling back to the other solver
+    if the first fails
+    :param x: The x-value, numpy array, sorted
+    :param y: The y variable, numpy array
+    :param isig: inverse sigma from get_isig
+    :param alpha_1: Regularization against non-zero slope
+    :param alpha_2: Regularization against changing slope
+    :param l_norm: 1 or 2 to use either L1 or L2 norm
+    :param constrain_zero: If True constrains the model to be zero at origin
+    :param monotonic: If True, the base model will be monotonically increasing
+    :param positive: If True, the base model will be positive
+    :param linear_deviations: list of completed linear deviations (no variables needed)
+    :param solver: 'auto', 'OSQP' or 'CLARABEL', see choose_solvers
+    :param warm_start: None, an array of initial base model values or the
+        'state' from a previous solution of the same problem. Only OSQP
+        uses it.
+    :param solver_options: dict of solver name to a dict of its settings,
+        e.g. {'OSQP': {'eps_abs': 1e-6}}
+    :param operators: optional dict of 'd1' and 'd2' matrices for x,
+        see get_operators
+    :return: dict with base_model, deviation_values and the solver info
+    """
+    if linear_deviations is None:
+        linear_deviations = []
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    isig = np.asarray(isig, dtype=float)
+
+    start = time.perf_counter()
+    qp = assemble_qp(x, y, isig, alpha_1=alpha_1, alpha_2=alpha_2, l_norm=l_norm,
+                     constrain_zero=constrain_zero, monotonic=monotonic,
+                     positive=positive, linear_deviations=linear_deviations,
+                     operators=operators)
+    setup_time = time.perf_counter() - start
+
+    slices = qp['slices']
+    if warm_start is not None and not isinstance(warm_start, dict):
+        z = np.zeros(len(qp['q']))
+        z[slices['base']] = warm_start
+        warm_start = {'z': z, 'dual': None}
+
+    if solver_options is None:
+        solver_options = {}
+
+    failures = []
+    solution = None
+    for name in choose_solvers(len(x), l_norm, solver=solver):
+        try:
+            solution = SOLVERS[name](qp, warm_start=warm_start,
+                                     settings=solver_options.get(name))
+        except Exception as error:
+            failures.append({'solver': name, 'status': '%s: %s' % (type(error).__name__, error)})
+            continue
+
+        if solution['solved']:
+            solution['solver'] = name
+            break
+
+        failures.append({'solver': name, 'status': solution['status']})
+        solution = None
+
+    if solution is None:
+        raise RuntimeError('All solvers failed: %s' % failures)
+
+    z = solution['z']
+    base_model = z[slices['base']].copy()
+    coefficients = z[slices['c']]
+    splits = np.cumsum([lin_dev['n_vars'] for lin_dev in linear_deviations])[:-1]
+
+    info = {'solver': solution['solver'],
+            'status': solution['status'],
+            'converged': True,
+            'iterations': solution['iterations'],
+            'setup_time': setup_time,
+            'solve_time': time.perf_counter() - start - setup_time,
+            'fallbacks': failures,
+            'state': {'z': z, 'dual': solution['dual']}}
+
+    return {'base_model': base_model,
+            'deviation_values': np.split(coefficients.copy(), splits) if linear_deviations else [],
+            'solver_info': info}
+
+
+def _installed(name):
+    module = {'OSQP': 'osqp', 'CLARABEL': 'clarabel'}[name]
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+
+    return True
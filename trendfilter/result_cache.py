@@ -0,0 +1,259 @@
+"""
+A content-addressed cache of fitted trends
+
+Fits are keyed by a hash of x, y, y_err and every keyword option,
+with linear deviations keyed by their matrices, so re-running the same
+fit returns the stored FittedTrend without building or solving a
+problem. Entries are kept in memory up to a size bound, least recently
+used first out, and optionally in a directory of .npz files which is
+bounded the same way.
+"""
+
+import os
+import copy
+import json
+import numbers
+from collections import OrderedDict
+import numpy as np
+from scipy.sparse import csr_matrix
+from trendfilter.fitted import FittedTrend, fit_trend
+from trendfilter.hashing import hash_array
+from trendfilter.linear_deviations import add_deviation_matrix
+
+
+def deviation_key(linear_deviation, x):
+    """
+    A JSON-serializable key for a linear deviation. A mapping or
+    indices are represented by the matrix they give for x.
+    :param linear_deviation: linear deviation object
+    :param x: The x-value, numpy array
+    :return: dict
+    """
+    lin_dev = add_deviation_matrix(linear_deviation, x)
+    matrix = csr_matrix(lin_dev.pop('matrix'), dtype=float)
+    matrix.sum_duplicates()
+    for name in ['mapping', 'indices', 'weights']:
+        lin_dev.pop(name, None)
+
+    key = {name: hash_array(value) if isinstance(value, np.ndarray) else value
+           for name, value in lin_dev.items()}
+    key['matrix'] = [hash_array(matrix.data), hash_array(matrix.indices),
+                     hash_array(matrix.indptr), list(matrix.shape)]
+    return key
+
+
+def result_key(x, y, y_err=None, **kwargs):
+    """
+    The cache key for a fit
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array or None
+    :param kwargs: keyword arguments for trend_filter
+    :return: hex digest string
+    """
+    x = np.asarray(x, dtype=float)
+    options = dict(kwargs)
+    options['linear_deviations'] = [deviation_key(lin_dev, x) for lin_dev
+                                    in options.get('linear_deviations') or []]
+
+    key = {'x': hash_array(x),
+           'y': hash_array(np.asarray(y, dtype=float)),
+           'y_err': None if y_err is None else hash_array(np.asarray(y_err, dtype=float)),
+           'options': normalize_options(options)}
+    text = json.dumps(key, sort_keys=True, default=lambda value: hash_array(np.asarray(value)))
+    return hash_array(np.frombuffer(text.encode(), dtype=np.uint8))
+
+
+def normalize_options(value):
+    """
+    The options with every number as a float, so alpha_2=1, alpha_2=1.0
+    and numpy scalars give the same key. Booleans are left as they are.
+    :param value: dict, list or value of the options
+    :return: like value
+    """
+    if isinstance(value, dict):
+        return {name: normalize_options(item) for name, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [normalize_options(item) for item in value]
+
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+
+    if isinstance(value, numbers.Number):
+        return float(value)
+
+    return value
+
+
+class ResultCache:
+    """
+    A bounded least-recently-used cache of FittedTrend objects
+    in memory, optionally backed by a directory
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, directory=None, max_disk_bytes=2 ** 30):
+        """
+        :param max_bytes: the most bytes of arrays held in memory
+        :param directory: optional directory to also store the fits in
+        :param max_disk_bytes: the most bytes of files in the directory
+        """
+        assert max_bytes >= 0
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.fits = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.fits)
+
+    @property
+    def stats(self):
+        """
+        dict of hits (including disk_hits), disk_hits, misses, evictions,
+        entries and nbytes in memory
+        """
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.fits), 'nbytes': self.nbytes}
+
+    def clear(self, disk=False):
+        """
+        Empty the memory cache and reset the statistics
+        :param disk: If True, also delete the files in the directory
+        """
+        self.fits.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if disk and self.directory is not None:
+            for path, _, _ in self._disk_files():
+                os.remove(path)
+
+    def get(self, key):
+        """
+        The cached fit, from memory or the directory
+        :param key: from result_key
+        :return: FittedTrend, or None if it isn't cached
+        """
+        if key in self.fits:
+            self.hits += 1
+            self.fits.move_to_end(key)
+            return self.fits[key]
+
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            self.hits += 1
+            self.disk_hits += 1
+            # touch it so it is the last evicted from disk
+            os.utime(path)
+            fitted = FittedTrend.load(path)
+            self._put_memory(key, fitted)
+            return fitted
+
+        self.misses += 1
+        return None
+
+    def put(self, key, fitted):
+        """
+        Store a fit
+        :param key: from result_key
+        :param fitted: FittedTrend
+        """
+        self._put_memory(key, fitted)
+
+        path = self._path(key)
+        if path is not None:
+            fitted.save(path)
+            self._evict_disk()
+
+    def _put_memory(self, key, fitted):
+        if key in self.fits:
+            self.nbytes -= self.fits.pop(key).nbytes
+
+        if fitted.nbytes > self.max_bytes:
+            return
+
+        self.fits[key] = fitted
+        self.nbytes += fitted.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.fits.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _path(self, key):
+        if self.directory is None:
+            return None
+
+        return os.path.join(self.directory, key + '.npz')
+
+    def _disk_files(self):
+        files = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.npz'):
+                path = os.path.join(self.directory, filename)
+                stat = os.stat(path)
+                files.append((path, stat.st_mtime, stat.st_size))
+
+        return files
+
+    def _evict_disk(self):
+        # oldest first
+        files = sorted(self._disk_files(), key=lambda file: file[1])
+        total = sum(file[2] for file in files)
+        for path, _, size in files:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+
+result_cache = ResultCache()
+
+
+def cached_fit_trend(x, y, y_err=None, cache=None, **kwargs):
+    """
+    Same as fit_trend, but re-uses the fit if the same inputs
+    and options were fit before
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param cache: ResultCache, defaults to the module level cache
+    :param kwargs: keyword arguments for trend_filter
+    :return: FittedTrend. It's a shallow copy of the cached fit with its
+        own mappings, the arrays are shared so treat them as read-only.
+    """
+    if cache is None:
+        cache = result_cache
+
+    key = result_key(x, y, y_err=y_err, **kwargs)
+    fitted = cache.get(key)
+    if fitted is None:
+        # mappings aren't stored, so the cache holds the fit without them,
+        # the same as on disk
+        fitted = _with_mappings(fit_trend(x, y, y_err=y_err, **kwargs), {})
+        cache.put(key, fitted)
+
+    # the cached fit is shared with other callers, so attach the
+    # mappings given to a copy
+    mappings = {lin_dev.get('name', 'linear_deviation_%s' % i): lin_dev.get('mapping')
+                for i, lin_dev in enumerate(kwargs.get('linear_deviations') or [])}
+    return _with_mappings(fitted, mappings)
+
+
+def _with_mappings(fitted, mappings):
+    fitted_copy = copy.copy(fitted)
+    fitted_copy.debug = fitted.debug
+    fitted_copy.mappings = [mappings.get(name) for name in fitted.deviation_names]
+    return fitted_copy
@@ -0,0 +1,231 @@
+"""
+Choosing alpha_2 from the fit alone, by SURE, AIC or BIC
+
+For l_norm=1 the degrees of freedom of a trend filter fit are the
+number of knots, the non-zero entries of d2 @ base_model, plus the two
+of the linear part (Tibshirani and Taylor 2012). With the Huber loss of
+the scaled residuals in place of the chi-square, each alpha_2 is scored
+from its own fit, so there are no held-out folds to refit.
+
+    sure = loss - n + 2 df
+    aic = loss + 2 df
+    bic = loss + log(n) df
+
+SURE assumes y_err are the true errors. The candidates are the knots of
+the exact path when there is nothing else in the problem and every
+scaled residual stays in the quadratic part of the Huber loss, so the
+path is the fit trend_filter would return. Otherwise they are a grid of
+alpha_2 swept with warm starts. With alpha_1, constraints or
+linear deviations the degrees of freedom are approximate: linear
+deviations add their non-zero coefficients, but the flat sections from
+alpha_1 and the active constraints aren't taken off.
+"""
+
+import numpy as np
+from trendfilter.cross_validation import alpha_path
+from trendfilter.derivatives import get_operators
+from trendfilter.linear_deviations import matrix_only_deviations
+from trendfilter.numeric import huber
+from trendfilter.path import trend_filter_path
+from trendfilter.trendfilter import trend_filter, get_isig, get_mask
+
+CRITERIA = ['sure', 'aic', 'bic']
+
+
+def get_criteria(loss, df, n):
+    """
+    The selection criteria
+    :param loss: sum of the Huber loss of the scaled residuals, float or numpy array
+    :param df: degrees of freedom, like loss
+    :param n: number of points
+    :return: dict of criterion name to value
+    """
+    return {'sure': loss - n + 2 * df,
+            'aic': loss + 2 * df,
+            'bic': loss + np.log(n) * df}
+
+
+def count_nonzero(values, tol=1e-4, scale=0.0):
+    """
+    The number of entries that aren't zero up to the solver's precision
+    :param values: numpy array
+    :param tol: relative to the largest absolute value, or to scale if larger
+    :param scale: typical size of a non-zero value
+    :return: int
+    """
+    values = np.abs(values)
+    if not len(values):
+        return 0
+
+    return int(np.sum(values > tol * max(values.max(), scale)))
+
+
+def get_degrees_of_freedom(x, y, base_model, deviation_values=None,
+                           constrain_zero=False, tol=1e-4):
+    """
+    The degrees of freedom of an l_norm=1 fit
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param base_model: numpy array
+    :param deviation_values: optional list of numpy arrays of linear deviation values
+    :param constrain_zero: If True, the model is fixed at the origin
+    :param tol: see count_nonzero. Changes of slope are relative to the
+        slope across the whole range of the data, and deviation values
+        to the range of y.
+    :return: int
+    """
+    # missing points may be NaN
+    y_range = float(np.nanmax(y) - np.nanmin(y))
+    d2 = get_operators(x)['d2']
+    df = 2 + count_nonzero(d2 @ base_model, tol=tol, scale=y_range / np.ptp(x))
+    for values in deviation_values or []:
+        df += count_nonzero(values, tol=tol, scale=y_range)
+
+    if constrain_zero:
+        df -= 1
+
+    return df
+
+
+def select_alpha_2(x, y, y_err=None, criterion='bic', alphas=None, n_alphas=40,
+                   patience=20, alpha_1=0.0, constrain_zero=False, monotonic=False,
+                   positive=False, linear_deviations=None, solver='ECOS',
+                   engine='cvxpy', tol=1e-4, mask=None):
+    """
+    Choose alpha_2 for an l_norm=1 fit by SURE, AIC or BIC
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param criterion: 'sure', 'aic' or 'bic'
+    :param alphas: optional list of alpha_2 to choose from. By default,
+        the knots of the exact path if the problem has only alpha_2 and
+        the path stays in the quadratic part of the Huber loss, otherwise
+        n_alphas log-spaced from the first knot down by 1e8.
+    :param n_alphas: the size of the default grid
+    :param patience: the path is stopped once it has this many more
+        degrees of freedom than the best fit so far. Changepoints move
+        between neighbouring points along the path, so there are many
+        more knots than changepoints and the score isn't monotonic.
+    :param alpha_1: see trend_filter
+    :param constrain_zero: see trend_filter
+    :param monotonic: see trend_filter
+    :param positive: see trend_filter
+    :param linear_deviations: see trend_filter
+    :param solver: see trend_filter, for the grid
+    :param engine: see trend_filter, for the grid
+    :param tol: see count_nonzero
+    :param mask: see trend_filter. The path isn't used with missing points.
+    :return: dict with criterion, alpha_2 (the chosen alpha), index, method
+        ('path' or 'grid'), and per candidate alphas, loss, df and the
+        value of each of the CRITERIA
+    """
+    assert criterion in CRITERIA, 'Unknown criterion %s, choose from %s' % (criterion, CRITERIA)
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if y_err is None:
+        y_err = np.ones(len(x))
+
+    y_err = np.asarray(y_err, dtype=float)
+    mask = get_mask(y, y_err=y_err, mask=mask)
+    fit_points = np.ones(len(x), dtype=bool) if mask is None else mask
+    n = int(fit_points.sum())
+
+    isig = get_isig(y, y_err, mask=mask)
+    y_data = np.where(isig > 0, y, 0.0)
+
+    def score(y_fit, df):
+        loss = float(np.sum(huber(isig * (y_fit - y_data))))
+        return loss, get_criteria(loss, df, n)[criterion]
+
+    path_only = alpha_1 == 0 and mask is None and \
+        not (constrain_zero or monotonic or positive or linear_deviations)
+
+    losses, dfs = [], []
+    method = 'grid'
+    if alphas is None and path_only:
+        best = {'score': np.inf, 'df': 0, 'huber_ok': True}
+
+        def callback(alpha_2, base_model):
+            # past here the path is the squared loss fit, not the Huber one
+            if np.any(np.abs(isig * (base_model - y_data)) > 1.0 + 1e-9):
+                best['huber_ok'] = False
+                return True
+
+            df = get_degrees_of_freedom(x, y, base_model, tol=tol)
+            loss, value = score(base_model, df)
+            losses.append(loss)
+            dfs.append(df)
+            if value < best['score']:
+                best.update(score=value, df=df)
+            return df > best['df'] + patience
+
+        path_alphas = trend_filter_path(x, y, y_err=y_err, callback=callback)['alphas']
+        if best['huber_ok']:
+            method = 'path'
+            alphas = path_alphas
+        else:
+            losses, dfs = [], []
+
+    if method == 'grid':
+        if alphas is None:
+            alpha_max = trend_filter_path(x[fit_points], y[fit_points], y_err=y_err[fit_points],
+                                          max_knots=1)['alphas'][0]
+            alphas = np.geomspace(alpha_max, 1e-8 * alpha_max, n_alphas)
+
+        linear_deviations = matrix_only_deviations(linear_deviations, x)
+        fits = alpha_path(x, y, {'alpha_2': list(alphas), 'alpha_1': [alpha_1]},
+                          y_err=y_err, l_norm=1, constrain_zero=constrain_zero,
+                          monotonic=monotonic, positive=positive,
+                          linear_deviations=linear_deviations,
+                          solver=solver, engine=engine, mask=mask)
+        for fit in fits:
+            df = get_degrees_of_freedom(x, y, fit['base_model'],
+                                        deviation_values=fit['deviation_values'],
+                                        constrain_zero=constrain_zero, tol=tol)
+            losses.append(score(fit['y_fit'], df)[0])
+            dfs.append(df)
+
+    alphas = np.array(alphas, dtype=float)
+    losses = np.array(losses)
+    dfs = np.array(dfs)
+    values = get_criteria(losses, dfs, n)
+    index = int(np.argmin(values[criterion]))
+
+    selection = {'criterion': criterion,
+                 'alpha_2': float(alphas[index]),
+                 'index': index,
+                 'method': method,
+                 'alphas': alphas,
+                 'loss': losses,
+                 'df': dfs}
+    selection.update(values)
+    return selection
+
+
+def trend_filter_auto(x, y, y_err=None, selection=None, **kwargs):
+    """
+    trend_filter with alpha_2 chosen by select_alpha_2
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param selection: optional dict of keyword arguments for select_alpha_2,
+        e.g. {'criterion': 'sure'}
+    :param kwargs: keyword arguments for trend_filter, other than alpha_2
+    :return: The fit model information, with the select_alpha_2
+        diagnostics under 'alpha_selection'
+    """
+    assert kwargs.get('l_norm', 2) == 1, "alpha_2='auto' needs l_norm=1"
+
+    options = {key: kwargs[key] for key in ['alpha_1', 'constrain_zero', 'monotonic',
+                                            'positive', 'linear_deviations', 'solver',
+                                            'engine', 'mask'] if key in kwargs}
+    options.update(selection or {})
+    chosen = select_alpha_2(x, y, y_err=y_err, **options)
+
+    tf_result = trend_filter(x, y, y_err=y_err, alpha_2=chosen['alpha_2'], **kwargs)
+    tf_result['alpha_selection'] = chosen
+    return tf_result
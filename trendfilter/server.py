@@ -0,0 +1,446 @@
+"""
+A local asyncio fitting service
+
+FitService runs fits in a pool of worker processes that have the
+fitting modules imported and keep their compiled problems between
+requests, so a request handler can await a fit rather than block on
+it. Identical requests in flight share one fit, and requests with
+the same x grid and options that arrive within batch_delay of each
+other go to a worker together. The number of requests in flight is
+capped, beyond which ServerBusy is raised, and each request has a
+timeout. A request that times out no longer counts as in flight, and
+if a worker dies the pool is replaced.
+
+serve runs it behind a TCP socket on localhost that takes one JSON
+request per line and answers with one JSON line holding the compact
+FittedTrend, see FittedTrend.to_dict. Arrays are JSON lists, or
+{'base64': ..., 'dtype': ..., 'shape': ...} for less parsing.
+fit_remote is a small blocking client.
+
+    python -m trendfilter.server --port 8765 --workers 4
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from trendfilter.hashing import hash_array
+from trendfilter.fitted import FittedTrend
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+class ServerBusy(Exception):
+    """
+    Raised when too many requests are already in flight
+    """
+
+
+def warm_worker():
+    """
+    Import the fitting modules when a worker process starts
+    """
+    # imported here, in the worker, so the requests don't pay for it
+    import trendfilter.trendfilter
+    import trendfilter.engines
+    import cvxpy
+
+
+def fit_group(x, ys, y_errs, options):
+    """
+    Fit series that share the x grid and options. Runs in a worker process.
+    With the cvxpy engine the compiled problem is kept for the next request.
+    :param x: The x-value, numpy array
+    :param ys: list of y arrays
+    :param y_errs: list of y_err arrays or None
+    :param options: dict of keyword arguments for trend_filter
+    :return: list of ('ok', FittedTrend) or ('error', message)
+    """
+    # imported here so the parent process doesn't need cvxpy
+    from trendfilter.fitted import fit_trend
+
+    options = dict(options)
+    if options.get('engine', 'cvxpy') == 'cvxpy':
+        options.setdefault('use_cache', True)
+
+    results = []
+    for y, y_err in zip(ys, y_errs):
+        try:
+            results.append(('ok', fit_trend(x, y, y_err=y_err, **options)))
+        except Exception as error:
+            results.append(('error', '%s: %s' % (type(error).__name__, error)))
+
+    return results
+
+
+def options_key(options):
+    """
+    A hashable key for the fit options, with arrays hashed
+    :param options: dict of keyword arguments for trend_filter
+    :return: string
+    """
+    return json.dumps(options, sort_keys=True, default=lambda value: hash_array(value))
+
+
+class FitService:
+    """
+    Fits trend filters in a pool of warm worker processes
+    """
+
+    def __init__(self, n_workers=1, max_pending=1000, timeout=60.0,
+                 batch_delay=0.002, max_batch=64):
+        """
+        :param n_workers: number of worker processes, -1 for all cores
+        :param max_pending: the most requests in flight before ServerBusy
+        :param timeout: default seconds to wait for a fit
+        :param batch_delay: seconds to wait for more requests with the
+            same grid and options before sending them to a worker
+        :param max_batch: the most series sent to a worker together
+        """
+        if n_workers == -1:
+            n_workers = os.cpu_count() or 1
+
+        assert n_workers >= 1
+
+        self.n_workers = n_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        self.executor = None
+        self.stats = {'requests': 0, 'coalesced': 0, 'batches': 0, 'fits': 0,
+                      'rejected': 0, 'timeouts': 0, 'restarts': 0}
+        self._in_flight = {}
+        self._batches = {}
+
+    async def start(self):
+        """
+        Start the workers and wait until they have imported the fitting modules
+        """
+        self.executor = self._new_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, os.getpid)
+                               for _ in range(self.n_workers)])
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.n_workers, initializer=warm_worker)
+
+    def _replace_executor(self, broken):
+        # a worker died, so the pool takes no more work
+        if self.executor is broken:
+            broken.shutdown(wait=False)
+            self.executor = self._new_executor()
+            self.stats['restarts'] += 1
+
+    async def close(self):
+        """
+        Shut down the workers, waiting for running fits
+        """
+        if self.executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+            self.executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    @property
+    def pending(self):
+        """
+        The number of distinct requests in flight
+        """
+        return len(self._in_flight)
+
+    async def fit(self, x, y, y_err=None, options=None, timeout=None):
+        """
+        Fit a trend filter in a worker
+        :param x: The x-value, numpy array
+        :param y: The y variable, numpy array
+        :param y_err: The y_err variable, numpy array or None
+        :param options: dict of keyword arguments for trend_filter,
+            which must be picklable
+        :param timeout: seconds to wait, defaults to the service timeout
+        :return: FittedTrend
+        """
+        assert self.executor is not None, 'Start the service first'
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if y_err is not None:
+            y_err = np.asarray(y_err, dtype=float)
+        options = options or {}
+
+        self.stats['requests'] += 1
+        group = (hash_array(x), options_key(options))
+        key = group + (hash_array(y), None if y_err is None else hash_array(y_err))
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+        else:
+            if self.pending >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise ServerBusy('%s requests in flight' % self.pending)
+
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            self._add_to_batch(group, key, x, y, y_err, options, future)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future),
+                                          self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            # the fit may carry on in a worker but no longer holds a place
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            raise
+
+    def _add_to_batch(self, group, key, x, y, y_err, options, future):
+        loop = asyncio.get_running_loop()
+        if group not in self._batches:
+            self._batches[group] = {'x': x, 'options': options, 'requests': []}
+            loop.call_later(self.batch_delay, self._dispatch, group)
+
+        batch = self._batches[group]
+        batch['requests'].append((key, y, y_err, future))
+        if len(batch['requests']) >= self.max_batch:
+            self._dispatch(group)
+
+    def _dispatch(self, group):
+        batch = self._batches.pop(group, None)
+        if batch is None:
+            # already sent when it filled up
+            return
+
+        requests = batch['requests']
+        self.stats['batches'] += 1
+        self.stats['fits'] += len(requests)
+
+        executor = self.executor
+        arguments = (fit_group, batch['x'], [request[1] for request in requests],
+                     [request[2] for request in requests], batch['options'])
+        loop = asyncio.get_running_loop()
+        try:
+            task = loop.run_in_executor(executor, *arguments)
+        except BrokenProcessPool:
+            self._replace_executor(executor)
+            executor = self.executor
+            task = loop.run_in_executor(executor, *arguments)
+
+        def done(task):
+            try:
+                results = task.result()
+            except Exception as error:
+                if isinstance(error, BrokenProcessPool):
+                    self._replace_executor(executor)
+                results = [('error', '%s: %s' % (type(error).__name__, error))] * len(requests)
+
+            for (key, _, _, future), (status, value) in zip(requests, results):
+                # after a timeout the key may belong to a newer request
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+                if future.done():
+                    continue
+                if status == 'ok':
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(value))
+                    # nobody may be waiting after a timeout
+                    future.exception()
+
+        task.add_done_callback(done)
+
+
+def encode_array(array, binary=False):
+    """
+    An array in the wire format
+    :param array: numpy array
+    :param binary: If True, base64 of the raw bytes, otherwise a list
+    :return: list or dict
+    """
+    array = np.asarray(array)
+    if not binary:
+        return array.tolist()
+
+    array = np.ascontiguousarray(array)
+    return {'base64': base64.b64encode(array.tobytes()).decode('ascii'),
+            'dtype': str(array.dtype),
+            'shape': list(array.shape)}
+
+
+def decode_array(value, dtype=float):
+    """
+    An array from the wire format, see encode_array
+    :param value: list or dict
+    :param dtype: dtype for lists
+    :return: numpy array
+    """
+    if isinstance(value, dict):
+        array = np.frombuffer(base64.b64decode(value['base64']), dtype=value['dtype'])
+        return array.reshape(value['shape'])
+
+    return np.asarray(value, dtype=dtype)
+
+
+def decode_options(options):
+    """
+    The trend_filter options from a request, with the indices and
+    weights of linear deviations as arrays
+    :param options: dict
+    :return: dict
+    """
+    options = dict(options or {})
+    lin_devs = []
+    for lin_dev in options.get('linear_deviations', []):
+        lin_dev = dict(lin_dev)
+        if 'indices' in lin_dev:
+            lin_dev['indices'] = decode_array(lin_dev['indices'], dtype=int)
+        if 'weights' in lin_dev:
+            lin_dev['weights'] = decode_array(lin_dev['weights'])
+        lin_devs.append(lin_dev)
+
+    if lin_devs:
+        options['linear_deviations'] = lin_devs
+
+    return options
+
+
+async def handle_request(service, request):
+    """
+    Answer one request
+    :param service: FitService
+    :param request: dict with id, x, y, optional y_err, options and timeout
+    :return: dict with id, status ('ok', 'busy', 'timeout' or 'error')
+        and model or error
+    """
+    response = {'id': request.get('id')}
+    try:
+        y_err = request.get('y_err')
+        fitted = await service.fit(decode_array(request['x']), decode_array(request['y']),
+                                   y_err=None if y_err is None else decode_array(y_err),
+                                   options=decode_options(request.get('options')),
+                                   timeout=request.get('timeout'))
+        response['status'] = 'ok'
+        response['model'] = fitted.to_dict()
+    except ServerBusy as error:
+        response['status'] = 'busy'
+        response['error'] = str(error)
+    except asyncio.TimeoutError:
+        response['status'] = 'timeout'
+        response['error'] = 'no result within the timeout'
+    except Exception as error:
+        response['status'] = 'error'
+        response['error'] = '%s: %s' % (type(error).__name__, error)
+
+    return response
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None, **service_options):
+    """
+    Run the service on a local socket until cancelled
+    :param host: host to listen on, localhost by default
+    :param port: port to listen on, 0 for any free port
+    :param ready: optional asyncio.Future, set to the port once listening
+    :param service_options: keyword arguments for FitService
+    """
+    async with FitService(**service_options) as service:
+
+        async def handle_connection(reader, writer):
+            lock = asyncio.Lock()
+
+            async def answer(line):
+                try:
+                    response = await handle_request(service, json.loads(line))
+                except ValueError as error:
+                    response = {'id': None, 'status': 'error', 'error': 'bad request: %s' % error}
+
+                async with lock:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+
+            tasks = set()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+            writer.close()
+
+        server = await asyncio.start_server(handle_connection, host, port, limit=2 ** 30)
+        async with server:
+            if ready is not None:
+                ready.set_result(server.sockets[0].getsockname()[1])
+            await server.serve_forever()
+
+
+def fit_remote(x, y, y_err=None, options=None, host=DEFAULT_HOST, port=DEFAULT_PORT,
+               timeout=None, binary=False, mappings=None):
+    """
+    Fit with a running server, blocking until the result arrives
+    :param x: The x-value, numpy array
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array or None
+    :param options: dict of JSON-serializable keyword arguments for
+        trend_filter. Linear deviations need 'indices' rather than a mapping.
+    :param host: server host
+    :param port: server port
+    :param timeout: seconds for the server to wait for the fit
+    :param binary: If True, send the arrays as base64
+    :param mappings: optional dict of linear deviation name to mapping
+        function, for predicting at new x
+    :return: FittedTrend
+    """
+    options = dict(options or {})
+    if 'linear_deviations' in options:
+        options['linear_deviations'] = [
+            {key: encode_array(value, binary) if isinstance(value, np.ndarray) else value
+             for key, value in lin_dev.items()}
+            for lin_dev in options['linear_deviations']]
+
+    request = {'id': 0, 'x': encode_array(x, binary), 'y': encode_array(y, binary),
+               'options': options, 'timeout': timeout}
+    if y_err is not None:
+        request['y_err'] = encode_array(y_err, binary)
+
+    with socket.create_connection((host, port)) as connection:
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as stream:
+            response = json.loads(stream.readline())
+
+    if response['status'] != 'ok':
+        raise RuntimeError('%s: %s' % (response['status'], response['error']))
+
+    return FittedTrend.from_dict(response['model'], mappings=mappings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local trend filter fitting service')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=1, help='-1 for all cores')
+    parser.add_argument('--max-pending', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--batch-delay', type=float, default=0.002)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, n_workers=args.workers,
+                      max_pending=args.max_pending, timeout=args.timeout,
+                      batch_delay=args.batch_delay))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,12 @@
 import numpy as np
-import cvxpy
 from trendfilter.extrapolate import get_interp_extrapolate_functions
 from trendfilter.derivatives import second_derivative_matrix_nes, \
     first_derv_nes_cvxpy
 from trendfilter.linear_deviations import complete_linear_deviations
+from trendfilter.profiling import Profiler
+
+# the cvxpy solvers tried in turn for solver='auto'
+AUTO_SOLVERS = ['CLARABEL', 'ECOS', 'OSQP', 'SCS']
 
 
 def trend_filter(x, y, y_err=None, alpha_1=0.0,
@@ -11,7 +14,14 @@ def trend_filter(x, y, y_err=None, alpha_1=0.0,
                  constrain_zero=False, monotonic=False,
                  positive=False,
                  linear_deviations=None,
-                 solver='ECOS'):
+                 solver='ECOS',
+                 use_cache=False,
+                 engine='cvxpy',
+                 engine_options=None,
+                 profile=False,
+                 multiresolution=False,
+                 selection=None,
+                 mask=None):
     """
     :param x: The x-value, numpy array
     :param y: The y variable, numpy array
@@ -21,6 +31,8 @@ def trend_filter(x, y, y_err=None, alpha_1=0.0,
         Setting this very high will result in stair step model (if L1)
     :param alpha_2: Regularization against (second derivative or changing slope)
         Setting this very high will result in piecewise linear model (if L1)
+        With l_norm=1 it can be 'auto' to choose it by BIC, or as set in
+        selection, see trendfilter.selection
      :param l_norm: 1 or 2 to use either L1 or L2 norm
     :param constrain_zero: If True constrains the model to be zero at origin
         Default False
@@ -30,14 +42,98 @@ def trend_filter(x, y, y_err=None, alpha_1=0.0,
         Default False
     :param linear_deviations: list of linear deviation objects
     :param solver: solver_name, check cvxpy.installed_solvers()
-        for list of installed solvers
-    :return: The fit model information
+        for list of installed solvers, or 'auto' to try the installed
+        AUTO_SOLVERS in turn until one succeeds
+    :param use_cache: If True, re-use a compiled, parameterized problem
+        from the problem cache for this x grid and set of options.
+        Only the parameter values are updated between calls.
+        Default False
+    :param engine: 'cvxpy' to build the problem with cvxpy and solve it with solver,
+        or the name of one of the specialized engines in trendfilter.engines,
+        e.g. 'admm'. These engines return numpy arrays and floats in place of
+        the cvxpy expressions. Default 'cvxpy'
+    :param engine_options: dict of keyword arguments for the engine,
+        e.g. tolerances or a warm start
+    :param profile: If True, time each phase of the fit and return it,
+        with the solver statistics, under the 'profile' key of the result.
+        If 'memory', also record the peak memory of each phase, which
+        slows the fit down. The hooks in trendfilter.profiling are
+        called with the profile. Default False
+    :param multiresolution: If True, or a dict of options for
+        trend_filter_multiresolution, fit on coarser grids first and
+        warm-start the finer ones. Uses engine, or an engine chosen
+        for the options if engine is 'cvxpy'. Default False
+    :param selection: dict of keyword arguments for select_alpha_2 when
+        alpha_2='auto', e.g. {'criterion': 'sure'}
+    :param mask: optional boolean numpy array, True for the points to fit.
+        Points where y or y_err is NaN are left out too. The others get
+        zero weight in the Huber loss but keep their place on the x grid,
+        so the problem is the same whatever is missing and y_fit there
+        fills the gaps.
+    :return: The fit model information. With alpha_2='auto' the
+        selection diagnostics are under 'alpha_selection'
     """
 
     if linear_deviations is None:
         linear_deviations = []
 
-    linear_deviations = complete_linear_deviations(linear_deviations, x)
+    mask = get_mask(y, y_err=y_err, mask=mask)
+
+    if isinstance(alpha_2, str):
+        assert alpha_2 == 'auto', "alpha_2 must be a number or 'auto'"
+        # imported here to avoid a circular import
+        from trendfilter.selection import trend_filter_auto
+        return trend_filter_auto(x, y, y_err=y_err, selection=selection, alpha_1=alpha_1,
+                                 l_norm=l_norm, constrain_zero=constrain_zero,
+                                 monotonic=monotonic, positive=positive,
+                                 linear_deviations=linear_deviations, solver=solver,
+                                 use_cache=use_cache, engine=engine,
+                                 engine_options=engine_options, profile=profile,
+                                 multiresolution=multiresolution, mask=mask)
+
+    if multiresolution:
+        # imported here to avoid a circular import
+        from trendfilter.multiresolution import trend_filter_multiresolution
+        options = multiresolution if isinstance(multiresolution, dict) else {}
+        return trend_filter_multiresolution(x, y, y_err=y_err, alpha_1=alpha_1,
+                                            alpha_2=alpha_2, l_norm=l_norm,
+                                            constrain_zero=constrain_zero,
+                                            monotonic=monotonic, positive=positive,
+                                            linear_deviations=linear_deviations,
+                                            engine=None if engine == 'cvxpy' else engine,
+                                            engine_options=engine_options, mask=mask,
+                                            **options)
+
+    if engine != 'cvxpy':
+        # imported here to avoid a circular import
+        from trendfilter.engines import trend_filter_engine
+        return trend_filter_engine(x, y, y_err=y_err, alpha_1=alpha_1, alpha_2=alpha_2,
+                                   l_norm=l_norm, constrain_zero=constrain_zero,
+                                   monotonic=monotonic, positive=positive,
+                                   linear_deviations=linear_deviations,
+                                   engine=engine, engine_options=engine_options,
+                                   mask=mask, profile=profile)
+
+    if use_cache:
+        # imported here to avoid a circular import
+        from trendfilter.compiled import get_compiled_trend_filter
+        compiled = get_compiled_trend_filter(x, l_norm=l_norm,
+                                             constrain_zero=constrain_zero,
+                                             monotonic=monotonic,
+                                             positive=positive,
+                                             linear_deviations=linear_deviations)
+        return compiled.solve(y, y_err=y_err, alpha_1=alpha_1, alpha_2=alpha_2,
+                              linear_deviations=linear_deviations, solver=solver,
+                              mask=mask, profile=profile)
+
+    # imported here so importing trendfilter and the other engines
+    # don't need cvxpy
+    import cvxpy
+
+    profiler = Profiler(enabled=bool(profile), memory=profile == 'memory')
+
+    with profiler.phase('linear_deviations'):
+        linear_deviations = complete_linear_deviations(linear_deviations, x)
 
     assert l_norm in [1, 2]
     n = len(x)
@@ -50,18 +146,21 @@ def trend_filter(x, y, y_err=None, alpha_1=0.0,
         assert len(y_err) == n
 
     # the objective function
-    result = get_obj_func_model(y, y_err=y_err,
-                                positive=positive,
-                                linear_deviations=linear_deviations)
+    with profiler.phase('objective'):
+        result = get_obj_func_model(y, y_err=y_err,
+                                    positive=positive,
+                                    linear_deviations=linear_deviations,
+                                    mask=mask)
 
     # TODO: this seems wrong
     # y_var = result['objective_function'].variables()[0]
 
-    derv_1 = first_derv_nes_cvxpy(x, result['base_model'])
+    with profiler.phase('operators'):
+        derv_1 = first_derv_nes_cvxpy(x, result['base_model'])
 
-    # the regularization
-    reg_sum, regs = get_reg(x, result['base_model'], derv_1, l_norm, alpha_1, alpha_2,
-                            linear_deviations=linear_deviations)
+        # the regularization
+        reg_sum, regs = get_reg(x, result['base_model'], derv_1, l_norm, alpha_1, alpha_2,
+                                linear_deviations=linear_deviations)
 
     # the total objective function with regularization
     obj_total = result['objective_function'] + reg_sum
@@ -81,10 +180,24 @@ def trend_filter(x, y, y_err=None, alpha_1=0.0,
 
     # define and solve the problem
     problem = cvxpy.Problem(obj, constraints=constraints)
-    problem.solve(solver=solver)
 
-    func_base, func_deviates, func = \
-        get_interp_extrapolate_functions(x, result['base_model'], linear_deviations)
+    if profile:
+        # compile separately so the canonicalization is timed on its own,
+        # solve re-uses the compiled problem
+        with profiler.phase('canonicalization'):
+            problem.get_problem_data(get_solvers(solver)[0])
+
+    with profiler.phase('solve'):
+        solve_problem(problem, solver)
+
+    profiler.record_problem(problem)
+
+    if problem.value is None or result['base_model'].value is None:
+        raise ValueError('The problem has no solution, status %s' % problem.status)
+
+    with profiler.phase('interpolation'):
+        func_base, func_deviates, func = \
+            get_interp_extrapolate_functions(x, result['base_model'], linear_deviations)
 
     tf_result = {'x': x,
                  'y': y,
@@ -102,10 +215,51 @@ def trend_filter(x, y, y_err=None, alpha_1=0.0,
                  'constraints': constraints,
                  'linear_deviations': linear_deviations}
 
-    return tf_result
+    return profiler.finish(tf_result)
 
 
-def get_reg(x, base_model, derv_1, l_norm, alpha_1, alpha_2, linear_deviations=None):
+def get_solvers(solver):
+    """
+    The cvxpy solvers to try
+    :param solver: solver name or 'auto'
+    :return: list of solver names
+    """
+    if solver != 'auto':
+        return [solver]
+
+    import cvxpy
+    installed = cvxpy.installed_solvers()
+    return [name for name in AUTO_SOLVERS if name in installed]
+
+
+def solve_problem(problem, solver, **kwargs):
+    """
+    Solve a cvxpy problem, falling back to the next solver
+    on a solver error or an inaccurate solution when solver='auto'
+    :param problem: cvxpy.Problem
+    :param solver: solver name or 'auto'
+    :param kwargs: keyword arguments for problem.solve
+    :return: the name of the solver used
+    """
+    import cvxpy
+    solvers = get_solvers(solver)
+    assert solvers, 'None of %s are installed' % AUTO_SOLVERS
+
+    for i, name in enumerate(solvers):
+        last = i == len(solvers) - 1
+        try:
+            problem.solve(solver=name, **kwargs)
+        except cvxpy.error.SolverError:
+            if last:
+                raise
+            continue
+
+        if problem.status == cvxpy.OPTIMAL or last:
+            return name
+
+
+def get_reg(x, base_model, derv_1, l_norm, alpha_1, alpha_2, linear_deviations=None,
+            deviation_alphas=None):
     """
     Get the regularization term
     :param x: The x-value, numpy array
@@ -117,8 +271,21 @@ def get_reg(x, base_model, derv_1, l_norm, alpha_1, alpha_2, linear_deviations=N
     :param alpha_2: Regularization against (second derivative or changing slope)
         Setting this very high will result in piecewise linear model (if L1)
     :param linear_deviations: list of linear deviation objects
+    :param deviation_alphas: optional list of regularization parameters,
+        one per linear deviation, used instead of each lin_dev['alpha'].
+        These may be cvxpy.Parameters.
     :return: (sum of regs, list of regs)
     """
+    import cvxpy
+
+    if linear_deviations is None:
+        linear_deviations = []
+
+    if deviation_alphas is None:
+        deviation_alphas = [lin_dev['alpha'] for lin_dev in linear_deviations]
+
+    assert len(deviation_alphas) == len(linear_deviations)
+
     d2 = second_derivative_matrix_nes(x, scale_free=True)
 
     if l_norm == 2:
@@ -130,8 +297,8 @@ def get_reg(x, base_model, derv_1, l_norm, alpha_1, alpha_2, linear_deviations=N
     reg_2 = alpha_2 * norm(d2 @ base_model)
     regs = [reg_1,  reg_2]
 
-    for lin_dev in linear_deviations:
-        reg = lin_dev['alpha'] * norm(lin_dev['variable'])
+    for lin_dev, alpha in zip(linear_deviations, deviation_alphas):
+        reg = alpha * norm(lin_dev['variable'])
         regs.append(reg)
 
     reg_sum = sum(regs)
@@ -139,7 +306,7 @@ def get_reg(x, base_model, derv_1, l_norm, alpha_1, alpha_2, linear_deviations=N
     return reg_sum, regs
 
 
-def get_obj_func_model(y, y_err=None, positive=False, linear_deviations=None):
+def get_obj_func_model(y, y_err=None, positive=False, linear_deviations=None, mask=None):
     """
     Get the objective function and the model as cvxpy expressions
     :param y: The y variable, numpy array
@@ -148,8 +315,11 @@ def get_obj_func_model(y, y_err=None, positive=False, linear_deviations=None):
     :param positive: If set to True, will result in an always positive base model.
         Default is False.
     :param linear_deviations: List of completed linear deviation objects
+    :param mask: optional boolean numpy array, True for the points to fit.
+        The others are given zero weight, see get_mask.
     :return: objective function and the model
     """
+    import cvxpy
 
     if linear_deviations is None:
         linear_deviations = []
@@ -160,9 +330,10 @@ def get_obj_func_model(y, y_err=None, positive=False, linear_deviations=None):
     else:
         assert len(y_err) == n
 
-    buff = 0.01 * np.median(abs(y))
-    buff_2 = buff ** 2
-    isig = 1 / np.sqrt(buff_2 + y_err ** 2)
+    isig = get_isig(y, y_err, mask=mask)
+
+    # the points with zero weight may be missing
+    y = np.where(isig > 0, y, 0.0)
 
     base_model = cvxpy.Variable(n, pos=positive)
 
@@ -179,3 +350,51 @@ def get_obj_func_model(y, y_err=None, positive=False, linear_deviations=None):
               'objective_function': obj_func}
 
     return result
+
+
+def get_mask(y, y_err=None, mask=None):
+    """
+    The points to fit, those in the mask that have a finite y and y_err
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array or None
+    :param mask: optional boolean numpy array, True for the points to fit
+    :return: boolean numpy array, or None if all the points are fit
+    """
+    fit = np.isfinite(np.asarray(y, dtype=float))
+    if y_err is not None:
+        fit &= np.isfinite(np.asarray(y_err, dtype=float))
+
+    if mask is not None:
+        fit &= np.asarray(mask, dtype=bool)
+
+    if fit.all():
+        return None
+
+    return fit
+
+
+def get_isig(y, y_err, mask=None):
+    """
+    Get the inverse sigma used to weight the Huber loss.
+    A small buffer, relative to the median of abs(y), is added
+    to the errors in quadrature
+    :param y: The y variable, numpy array
+    :param y_err: The y_err variable, numpy array
+    :param mask: optional boolean numpy array, True for the points
+        to fit. The others get zero weight and don't count
+        towards the buffer.
+    :return: numpy array of inverse sigmas
+    """
+    if mask is None:
+        buff = 0.01 * np.median(abs(y))
+        buff_2 = buff ** 2
+        return 1 / np.sqrt(buff_2 + y_err ** 2)
+
+    mask = np.asarray(mask, dtype=bool)
+    assert mask.any(), 'No points to fit'
+    y = np.asarray(y, dtype=float)
+    y_err = np.asarray(y_err, dtype=float)
+    buff = 0.01 * np.median(abs(y[mask]))
+    isig = np.zeros(len(y))
+    isig[mask] = 1 / np.sqrt(buff ** 2 + y_err[mask] ** 2)
+    return isig